@@ -0,0 +1,312 @@
+"""Archive every edition with its inputs in a SQLite database"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+
+from get_events import Event
+from get_quote import Quote
+from get_weather import WeatherReport
+
+DEFAULT_RETENTION_DAYS = 400
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS editions (
+    id INTEGER PRIMARY KEY,
+    day TEXT NOT NULL,
+    subscriber TEXT NOT NULL,
+    created REAL NOT NULL,
+    html TEXT NOT NULL REFERENCES blobs(hash),
+    weather TEXT REFERENCES blobs(hash),
+    events TEXT REFERENCES blobs(hash),
+    qotd TEXT REFERENCES blobs(hash),
+    ron TEXT REFERENCES blobs(hash)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS editions_subscriber_day ON editions(subscriber, day);
+CREATE INDEX IF NOT EXISTS editions_day ON editions(day);
+'''
+BLOB_COLUMNS = ('html', 'weather', 'events', 'qotd', 'ron')
+
+
+class ArchivedEdition:
+    """An edition read back from the archive"""
+    def __init__(self, day: datetime.date, subscriber: str, created: datetime.datetime, blobs: dict):
+        """
+        Constructor for an archived edition
+        :param day: Day of the edition
+        :param subscriber: Subscriber name
+        :param created: Time the edition was archived
+        :param blobs: Dictionary of column name to decoded blob, None for missing inputs
+        """
+        self._day = day
+        self._subscriber = subscriber
+        self._created = created
+        self._blobs = blobs
+
+    def day(self) -> datetime.date:
+        """
+        Get the day of the edition
+        :return: date
+        """
+        return self._day
+
+    def subscriber(self) -> str:
+        """
+        Get the subscriber of the edition
+        :return: name
+        """
+        return self._subscriber
+
+    def created(self) -> datetime.datetime:
+        """
+        Get the time the edition was archived
+        :return: datetime
+        """
+        return self._created
+
+    def html(self) -> str:
+        """
+        Get the published page
+        :return: HTML text
+        """
+        return self._blobs['html'].decode('utf-8')
+
+    def report(self) -> WeatherReport:
+        """
+        Get the weather report the edition was rendered from
+        :return: WeatherReport, None if the section was omitted
+        """
+        data = self._blobs['weather']
+        if data is None:
+            return None
+        weather = json.loads(data)
+        if isinstance(weather, list):
+            # Archived before the timeline was kept apart
+            return WeatherReport.from_snapshot(tuple(weather))
+        return WeatherReport.from_snapshot(tuple(weather['snapshot']), weather['timeline'])
+
+    def events(self) -> list:
+        """
+        Get the events the edition was rendered from
+        :return: sorted list of events
+        """
+        data = self._blobs['events']
+        return sorted(Event(event_data, type_) for type_, event_data in json.loads(data or '[]'))
+
+    def qotd(self) -> Quote:
+        """
+        Get the quote of the day of the edition
+        :return: Quote, can be empty
+        """
+        return self._quote('qotd')
+
+    def ron_quote(self) -> Quote:
+        """
+        Get the Ron Swanson quote of the edition
+        :return: Quote, can be empty
+        """
+        return self._quote('ron')
+
+    def _quote(self, column: str) -> Quote:
+        data = self._blobs[column]
+        return Quote(*json.loads(data)) if data is not None else Quote('', '')
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class EditionArchive:
+    """Editions indexed by day and subscriber, their inputs and pages stored once as compressed blobs"""
+    def __init__(self, path: str):
+        """
+        Constructor for the archive, created if missing
+        :param path: SQLite database file
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            # Pages freed by the retention policy are given back to the file system
+            if self._connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 0 and \
+                    self._connection.execute('PRAGMA page_count').fetchone()[0] == 0:
+                self._connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self._lock:
+            self._connection.close()
+
+    def _put_blob(self, data: bytes) -> str:
+        if data is None:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        self._connection.execute('INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)',
+                                 (digest, zlib.compress(data, 9)))
+        return digest
+
+    def store(self, day: datetime.date, subscriber: str, html: str, report: WeatherReport = None,
+              events: list = None, qotd: Quote = None, ron_quote: Quote = None):
+        """
+        Archive an edition, replacing the one of the same day and subscriber
+        :param day: Day of the edition
+        :param subscriber: Subscriber name
+        :param html: Published page
+        :param report: Weather report, None if the section was omitted
+        :param events: List of events
+        :param qotd: Quote of the day
+        :param ron_quote: Ron Swanson quote
+        """
+        # The hourly forecast is kept next to the snapshot, not in it
+        weather = {'snapshot': report.snapshot(), 'timeline': report.timeline()} if report is not None else None
+        values = {'html': _encode(html),
+                  'weather': _encode(weather),
+                  'events': _encode([[event.type(), event.data()] for event in events or []]),
+                  'qotd': _encode([qotd.text(), qotd.author()]) if qotd else None,
+                  'ron': _encode([ron_quote.text(), ron_quote.author()]) if ron_quote else None}
+        with self._lock, self._connection:
+            hashes = [self._put_blob(values[column]) for column in BLOB_COLUMNS]
+            self._connection.execute(
+                f'INSERT OR REPLACE INTO editions (day, subscriber, created, {", ".join(BLOB_COLUMNS)}) '
+                f'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [day.isoformat(), subscriber, datetime.datetime.now().timestamp()] + hashes)
+
+    def get(self, day: datetime.date, subscriber: str) -> ArchivedEdition:
+        """
+        Get an archived edition
+        :param day: Day of the edition
+        :param subscriber: Subscriber name
+        :return: ArchivedEdition, None if not archived
+        """
+        columns = ', '.join(f'{column}.data' for column in BLOB_COLUMNS)
+        joins = ' '.join(f'LEFT JOIN blobs AS {column} ON {column}.hash = editions.{column}'
+                         for column in BLOB_COLUMNS)
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT editions.created, {columns} FROM editions {joins} '
+                f'WHERE editions.subscriber = ? AND editions.day = ?',
+                (subscriber, day.isoformat())).fetchone()
+        if row is None:
+            return None
+        blobs = {column: zlib.decompress(data) if data is not None else None
+                 for column, data in zip(BLOB_COLUMNS, row[1:])}
+        return ArchivedEdition(day, subscriber, datetime.datetime.fromtimestamp(row[0]), blobs)
+
+    def editions(self, subscriber: str = None, start: datetime.date = None,
+                 end: datetime.date = None) -> list:
+        """
+        List the archived editions, oldest first
+        :param subscriber: Only list this subscriber, optional
+        :param start: First day, optional
+        :param end: Last day, optional
+        :return: list of (day, subscriber) tuples
+        """
+        clauses, parameters = [], []
+        for clause, value in (('subscriber = ?', subscriber), ('day >= ?', start), ('day <= ?', end)):
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value.isoformat() if isinstance(value, datetime.date) else value)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT day, subscriber FROM editions {where} ORDER BY day, subscriber',
+                parameters).fetchall()
+        return [(datetime.date.fromisoformat(day), name) for day, name in rows]
+
+    def page_hashes(self, subscriber: str) -> dict:
+        """
+        Get the hash of the page of every edition of a subscriber, without reading the pages
+        :param subscriber: Subscriber name
+        :return: dictionary of day to page hash
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT day, html FROM editions WHERE subscriber = ?',
+                                            (subscriber,)).fetchall()
+        return {datetime.date.fromisoformat(day): digest for day, digest in rows}
+
+    def prune(self, keep_days: int = DEFAULT_RETENTION_DAYS, today: datetime.date = None) -> int:
+        """
+        Apply the retention policy: drop older editions and the blobs only they used
+        :param keep_days: Number of days kept
+        :param today: Day the retention is counted from, today by default
+        :return: number of editions dropped
+        """
+        cutoff = (today or datetime.date.today()) - datetime.timedelta(days=keep_days)
+        # Missing inputs are NULL, which would make NOT IN match no blob at all
+        used = ' UNION '.join(f'SELECT {column} FROM editions WHERE {column} IS NOT NULL'
+                              for column in BLOB_COLUMNS)
+        with self._lock, self._connection:
+            dropped = self._connection.execute('DELETE FROM editions WHERE day < ?',
+                                               (cutoff.isoformat(),)).rowcount
+            # Always swept: a republished edition orphans the blobs of the one it replaced
+            swept = self._connection.execute(f'DELETE FROM blobs WHERE hash NOT IN ({used})').rowcount
+        if dropped or swept:
+            with self._lock:
+                self._connection.execute('PRAGMA incremental_vacuum')
+        return dropped
+
+    def stats(self) -> dict:
+        """
+        Get the size of the archive
+        :return: dictionary with the edition and blob counts and the compressed blob bytes
+        """
+        with self._lock:
+            editions = self._connection.execute('SELECT COUNT(*) FROM editions').fetchone()[0]
+            blobs, size = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs').fetchone()
+        return {'editions': editions, 'blobs': blobs, 'bytes': size}
+
+
+def main():
+    """
+    List, extract or prune archived editions
+    """
+    parser = argparse.ArgumentParser(description='Browse the Daily Commute archive')
+    parser.add_argument('archive', help='SQLite archive')
+    parser.add_argument('--subscriber', dest='subscriber', help='Subscriber name')
+    parser.add_argument('--day', dest='day', type=datetime.date.fromisoformat,
+                        help='Write the page of this day (YYYY-MM-DD) to --out, of the first '
+                             'subscriber unless --subscriber is given')
+    parser.add_argument('--out', dest='out', default='archived.html', help='Extracted page')
+    parser.add_argument('--prune', dest='prune', type=int, metavar='DAYS',
+                        help='Drop the editions older than DAYS')
+    args = parser.parse_args()
+
+    archive = EditionArchive(args.archive)
+    if args.prune is not None:
+        print(f'{archive.prune(args.prune)} edition(s) dropped')
+    if args.day is not None:
+        subscribers = [args.subscriber] if args.subscriber is not None else \
+            [subscriber for _, subscriber in archive.editions(start=args.day, end=args.day)]
+        edition = archive.get(args.day, subscribers[0]) if subscribers else None
+        if edition is None:
+            print(f'No edition on {args.day}')
+            return 1
+        with open(args.out, 'w', encoding='utf-8') as file:
+            file.write(edition.html())
+        print(f'Edition of {args.day} written to {args.out}')
+    else:
+        for day, subscriber in archive.editions(args.subscriber):
+            print(f'{day} {subscriber}')
+        print(archive.stats())
+    archive.close()
+    return 0
+
+
+if __name__ == '__main__':
+    main()
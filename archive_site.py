@@ -0,0 +1,233 @@
+"""Build the browsable archive pages of a subscriber, rebuilding only the pages whose inputs changed"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import dominate
+from dominate import tags
+
+from archive import EditionArchive
+from get_events import use_french_locale
+from inline_assets import LinkedAssets
+
+# Part of every page digest, bump it when the page layout changes to rebuild the whole site
+SITE_VERSION = 2
+ARCHIVE_DIR = 'archive'
+MANIFEST = 'manifest.json'
+# URLs of the assets written by LinkedAssets, relative to the site root
+LINKED_ASSET_URL = re.compile(r'\b(href|src)="(style\.css|Icons/)')
+
+
+def day_path(day: datetime.date) -> str:
+    """
+    Get the path of the page of an edition
+    :param day: Day of the edition
+    :return: path relative to the site root
+    """
+    return f'{ARCHIVE_DIR}/{day:%Y}/{day:%m}/{day:%d}.html'
+
+
+def month_path(year: int, month: int) -> str:
+    """
+    Get the path of the index of a month
+    :param year: Year
+    :param month: Month
+    :return: path relative to the site root
+    """
+    return f'{ARCHIVE_DIR}/{year:04d}/{month:02d}/index.html'
+
+
+def year_path(year: int) -> str:
+    """
+    Get the path of the index of a year
+    :param year: Year
+    :return: path relative to the site root
+    """
+    return f'{ARCHIVE_DIR}/{year:04d}/index.html'
+
+
+def root_path() -> str:
+    """
+    Get the path of the archive index
+    :return: path relative to the site root
+    """
+    return f'{ARCHIVE_DIR}/index.html'
+
+
+def _base_href(path: str) -> str:
+    return '../' * path.count('/')
+
+
+def _digest(*values) -> str:
+    return hashlib.sha1(json.dumps([SITE_VERSION, *values], default=str).encode()).hexdigest()
+
+
+def _month_name(year: int, month: int) -> str:
+    use_french_locale()
+    return time.strftime('%B %Y', datetime.date(year, month, 1).timetuple()).capitalize()
+
+
+def render_day_page(html: str, path: str) -> str:
+    """
+    Adapt an archived edition to its place in the archive: the linked stylesheet and icons
+    point to the site root. No <base> is added, the sprite references of inline pages would
+    resolve to another document
+    :param html: Archived page
+    :param path: Path of the page relative to the site root
+    :return: HTML text
+    """
+    return LINKED_ASSET_URL.sub(lambda match: f'{match.group(1)}="{_base_href(path)}{match.group(2)}',
+                                html)
+
+
+def render_index(title: str, path: str, links: list) -> str:
+    """
+    Render an index page
+    :param title: Page title
+    :param path: Path of the page relative to the site root
+    :param links: List of (label, path relative to the site root)
+    :return: HTML text
+    """
+    doc = dominate.document(title=f'The Daily Commute - {title}')
+    with doc.head:
+        tags.base(href=_base_href(path))
+    LinkedAssets.write_head(doc)
+    with doc:
+        tags.h1('The Daily Commute')
+        tags.h2(title)
+        with tags.ul(cls='archive'):
+            for label, target in links:
+                tags.li(tags.a(label, href=target))
+    return doc.render()
+
+
+class ArchiveSite:
+    """Per-day pages and month, year and archive indexes of a subscriber, built incrementally"""
+    def __init__(self, archive: EditionArchive, subscriber: str, site_dir: str):
+        """
+        Constructor for the site
+        :param archive: Edition archive
+        :param subscriber: Subscriber name
+        :param site_dir: Local directory of the site, holding the dependency manifest
+        """
+        self._archive = archive
+        self._subscriber = subscriber
+        self._site_dir = site_dir
+        self._manifest_path = os.path.join(site_dir, ARCHIVE_DIR, MANIFEST)
+
+    def site_dir(self) -> str:
+        """
+        Get the local directory of the site
+        :return: path
+        """
+        return self._site_dir
+
+    def _read_manifest(self) -> dict:
+        if not os.path.exists(self._manifest_path):
+            return {}
+        try:
+            with open(self._manifest_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as exc:
+            logging.warning(f'Rebuilding the whole archive site, unreadable manifest: {exc}')
+            return {}
+
+    def _write_manifest(self, manifest: dict):
+        self._write(f'{ARCHIVE_DIR}/{MANIFEST}.tmp', json.dumps(manifest, indent=0))
+        os.replace(self._manifest_path + '.tmp', self._manifest_path)
+
+    def _write(self, path: str, text: str):
+        local_path = os.path.join(self._site_dir, *path.split('/'))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    def plan(self) -> dict:
+        """
+        Get the digest of the inputs of every page: the edition for a day page, the listed
+        entries for an index
+        :return: dictionary of page path to (digest, render function)
+        """
+        hashes = self._archive.page_hashes(self._subscriber)
+        months = {}
+        for day in hashes:
+            months.setdefault((day.year, day.month), []).append(day)
+        years = {}
+        for year, month in months:
+            years.setdefault(year, []).append(month)
+
+        pages = {}
+        for day, page_hash in hashes.items():
+            path = day_path(day)
+            pages[path] = (_digest(page_hash), lambda day=day, path=path: render_day_page(
+                self._archive.get(day, self._subscriber).html(), path))
+        for (year, month), days in months.items():
+            days = sorted(days, reverse=True)
+            path = month_path(year, month)
+            links = [(f'{day:%d/%m/%Y}', day_path(day)) for day in days]
+            pages[path] = (_digest(links), lambda path=path, links=links, year=year, month=month:
+                           render_index(_month_name(year, month), path, links))
+        for year, year_months in years.items():
+            path = year_path(year)
+            links = [(_month_name(year, month), month_path(year, month))
+                     for month in sorted(year_months, reverse=True)]
+            pages[path] = (_digest(links), lambda path=path, links=links, year=year:
+                           render_index(str(year), path, links))
+        links = [(str(year), year_path(year)) for year in sorted(years, reverse=True)]
+        pages[root_path()] = (_digest(links), lambda: render_index('Archives', root_path(), links))
+        return pages
+
+    def build(self) -> list:
+        """
+        Write the pages whose inputs changed since the last build and drop the pruned ones
+        :return: list of written page paths, relative to the site root
+        """
+        manifest = self._read_manifest()
+        pages = self.plan()
+        changed = sorted(path for path, (digest, _) in pages.items() if manifest.get(path) != digest)
+        for path in changed:
+            self._write(path, pages[path][1]())
+        for path in set(manifest) - set(pages):
+            local_path = os.path.join(self._site_dir, *path.split('/'))
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+        self._write_manifest({path: digest for path, (digest, _) in pages.items()})
+        logging.info(f'Archive site: {len(changed)} of {len(pages)} page(s) rebuilt')
+        return changed
+
+    def invalidate(self, paths: list):
+        """
+        Forget pages so that the next build writes them again, e.g. after a failed upload
+        :param paths: List of page paths relative to the site root
+        """
+        manifest = self._read_manifest()
+        for path in paths:
+            manifest.pop(path, None)
+        self._write_manifest(manifest)
+
+
+def main():
+    """
+    Build the archive site of a subscriber and list the rebuilt pages
+    """
+    parser = argparse.ArgumentParser(description='Build the Daily Commute archive site')
+    parser.add_argument('archive', help='SQLite archive')
+    parser.add_argument('--subscriber', dest='subscriber', required=True, help='Subscriber name')
+    parser.add_argument('--site-dir', dest='site_dir', default='tdc-site', help='Site directory')
+    args = parser.parse_args()
+
+    archive = EditionArchive(args.archive)
+    for path in ArchiveSite(archive, args.subscriber, args.site_dir).build():
+        print(path)
+    archive.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""Create the Daily Commute editions of many subscribers in a single run"""
+
+import argparse
+import datetime
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import get_quote
+from circuit_breaker import BreakerBoard
+from config_store import ConfigStore
+from deadline import Deadline, SourceFetch, DEFAULT_DEADLINE, parse_budgets
+from section_store import SectionStore
+from daily_commute import ConfigDailyCommute, fetch_weather, fetch_events, publish, make_assets, \
+    archive_edition, publish_archive_site, prune_archive, breaker_name, location_key, make_parse_pool
+from run_metrics import RunMetrics
+
+
+class EditionResult:
+    """Store the outcome and stage timings of one edition of a batch"""
+    def __init__(self, name: str):
+        self._name = name
+        self._timings = {}
+        self._error = None
+
+    def name(self) -> str:
+        """
+        Get the edition name
+        :return: name as string
+        """
+        return self._name
+
+    def timings(self) -> dict:
+        """
+        Get the duration of each stage of the edition
+        :return: dictionary of stage name to seconds
+        """
+        return self._timings
+
+    def add_timing(self, stage: str, seconds: float):
+        """
+        Record the duration of a stage
+        :param stage: Stage name
+        :param seconds: Duration in seconds
+        """
+        self._timings[stage] = seconds
+
+    def error(self, error: str = None) -> str:
+        """
+        Getter/setter for the error which made the edition fail
+        :param error: Error description, optional
+        :return: error description, None if the edition succeeded
+        """
+        if error is not None:
+            self._error = error
+        return self._error
+
+    def succeeded(self) -> bool:
+        """
+        Check if the edition was published
+        :return: bool
+        """
+        return self._error is None
+
+    def __str__(self):
+        timings = ', '.join(f'{stage}: {seconds:.2f}s' for stage, seconds in self._timings.items())
+        status = 'OK' if self.succeeded() else f'FAILED ({self._error})'
+        return f'{self._name}: {status} [{timings}]'
+
+
+class SharedInputs:
+    """Inputs fetched once per batch and shared by every edition"""
+    def __init__(self):
+        # (source, endpoint or location) -> data
+        self._inputs = {}
+        self._stale = {}
+        # Imported on first use, rendering is the only stage needing dominate
+        import write_page
+        self._fragments = write_page.FragmentCache()
+
+    def fetch(self, configs: list, metrics: RunMetrics, breakers: BreakerBoard, deadline: Deadline,
+              store: SectionStore):
+        """
+        Fetch quotes once per distinct endpoint and weather reports once per distinct location within
+        their budget, falling back on the last good data of the store
+        :param configs: List of Daily Commute configurations
+        :param metrics: RunMetrics receiving the fetch spans
+        :param breakers: BreakerBoard of the upstreams
+        :param deadline: Deadline of the shared fetches
+        :param store: SectionStore of the last good data
+        """
+        shared = {}
+        for daily_config in configs:
+            for source in ('qotd', 'ron', 'weather'):
+                shared.setdefault(self._key(source, daily_config), daily_config)
+        logging.info(f'Fetching {len(shared)} shared input(s)')
+        fetches = {}
+        for (source, key), daily_config in shared.items():
+            fetches[source, key] = SourceFetch(source, lambda span, source=source, daily_config=daily_config:
+                                               breakers.call(breaker_name(source, daily_config), self._fetch_source,
+                                                             source, daily_config, span, deadline.budget(source)))
+
+        started = time.monotonic()
+        for source_fetch in fetches.values():
+            source_fetch.start()
+        today = datetime.date.today()
+        for (source, key), source_fetch in fetches.items():
+            value = source_fetch.wait(deadline.wait_timeout(source, started))
+            if source == 'weather':
+                source_fetch.span().set('location', key)
+            metrics.add(source_fetch.span())
+            value, since = store.keep_or_load(source, value, today, key)
+            if since is not None:
+                self._stale[source, key] = since
+            self._inputs[source, key] = value
+
+    @staticmethod
+    def _key(source: str, daily_config: ConfigDailyCommute) -> tuple:
+        # Quotes are shared by endpoint, weather reports by location
+        endpoints = daily_config.endpoints()
+        if source == 'qotd':
+            return source, endpoints.qotd_url()
+        if source == 'ron':
+            return source, endpoints.ron_url()
+        return source, '{},{}'.format(*location_key(daily_config))
+
+    @staticmethod
+    def _fetch_source(source: str, daily_config: ConfigDailyCommute, span, timeout: float):
+        endpoints = daily_config.endpoints()
+        if source == 'qotd':
+            return get_quote.get_quote_of_the_day(url=endpoints.qotd_url(), timeout=timeout)
+        if source == 'ron':
+            return get_quote.get_ron_swanson_quote(endpoints.ron_url(), timeout)
+        return fetch_weather(daily_config, span, timeout)
+
+    def _get(self, source: str, daily_config: ConfigDailyCommute) -> tuple:
+        key = self._key(source, daily_config)
+        return self._inputs.get(key), self._stale.get(key)
+
+    def qotd_for(self, daily_config: ConfigDailyCommute) -> get_quote.Quote:
+        """
+        Get the quote of the day shared by a configuration's endpoint
+        :param daily_config: Daily Commute configuration
+        :return: Quote, can be empty
+        """
+        return self._get('qotd', daily_config)[0] or get_quote.Quote('', '')
+
+    def ron_quote_for(self, daily_config: ConfigDailyCommute) -> get_quote.Quote:
+        """
+        Get the Ron Swanson quote shared by a configuration's endpoint
+        :param daily_config: Daily Commute configuration
+        :return: Quote, can be empty
+        """
+        return self._get('ron', daily_config)[0] or get_quote.Quote('', '')
+
+    def fragments(self):
+        """
+        Get the fragment cache shared by the editions, date, ephemeris and quotes are rendered once
+        :return: FragmentCache
+        """
+        return self._fragments
+
+    def report_for(self, daily_config: ConfigDailyCommute):
+        """
+        Get the weather report shared by a configuration's location
+        :param daily_config: Daily Commute configuration
+        :return: weather report, None if neither fetched nor stored
+        """
+        return self._get('weather', daily_config)[0]
+
+    def stale_for(self, daily_config: ConfigDailyCommute) -> dict:
+        """
+        Get the shared sections of a configuration rendered from old data
+        :param daily_config: Daily Commute configuration
+        :return: dictionary of section name to the time its old data was fetched
+        """
+        stale = {source: self._get(source, daily_config)[1] for source in ('qotd', 'ron', 'weather')}
+        return {source: since for source, since in stale.items() if since is not None}
+
+
+def create_edition(name: str, daily_config: ConfigDailyCommute, shared: SharedInputs,
+                   out_dir: str, metrics: RunMetrics, assets=None,
+                   breakers: BreakerBoard = None, archive=None, site_dir: str = None,
+                   deadline: float = DEFAULT_DEADLINE, budgets: dict = None,
+                   store: SectionStore = None, parse_pool=None) -> EditionResult:
+    """
+    Fetch the personal inputs of a subscriber within their budget, then render and upload the edition.
+    Missing sections are rendered from the last good data of the store with a stale marker, or omitted.
+    :param name: Edition name
+    :param daily_config: Daily Commute configuration of the subscriber
+    :param shared: Inputs shared by the batch
+    :param out_dir: Directory for the temporary HTML file
+    :param metrics: RunMetrics receiving the spans of the edition
+    :param assets: LinkedAssets or InlineAssets, linked by default
+    :param breakers: BreakerBoard of the upstreams, kept in memory if not given
+    :param archive: EditionArchive receiving the edition, optional
+    :param site_dir: Directory of the archive sites, one sub-directory per subscriber, optional
+    :param deadline: Seconds allowed to the edition, upload included
+    :param budgets: Seconds allowed to each source, DEFAULT_BUDGETS if not given
+    :param store: SectionStore of the last good data, kept in memory if not given
+    :param parse_pool: ParsePool of the batch, the parsing of this edition is cancelled if its events miss
+    their budget, optional
+    :return: result of the edition
+    """
+    if breakers is None:
+        breakers = BreakerBoard()
+    if store is None:
+        store = SectionStore()
+    edition_deadline = Deadline(deadline, budgets)
+    result = EditionResult(name)
+    html_path = os.path.join(out_dir, f'tdc-{name}.html')
+    stage = 'fetch.events'
+    parse_job = parse_pool.job() if parse_pool is not None else None
+    try:
+        start = time.perf_counter()
+        events = edition_deadline.fetch(
+            {'events': lambda span: breakers.call(breaker_name('events', daily_config), fetch_events,
+                                                  daily_config, span, edition_deadline.budget('events'),
+                                                  parse_job)},
+            metrics, edition=name)['events']
+        if events is None and parse_job is not None:
+            # An abandoned events fetch would keep the processes busy, the other editions go on
+            parse_job.cancel()
+        result.add_timing(stage, time.perf_counter() - start)
+        today = datetime.date.today()
+        events, since = store.keep_or_load('events', events, today, name)
+        stale = shared.stale_for(daily_config)
+        if since is not None:
+            stale['events'] = since
+        report = shared.report_for(daily_config)
+
+        stage = 'render'
+        import write_page
+        with metrics.span(stage, name) as span:
+            variants = write_page.write_html(report, events or [], html_path, shared.qotd_for(daily_config),
+                                             shared.ron_quote_for(daily_config), shared.fragments(), assets, stale)
+            span.set('stale', sorted(stale))
+        result.add_timing(stage, span.duration())
+        if archive is not None:
+            archive_edition(archive, today, name, html_path, report, events,
+                            shared.qotd_for(daily_config), shared.ron_quote_for(daily_config), metrics, name)
+
+        stage = 'upload'
+        with metrics.span(stage, name) as span:
+            if not publish(daily_config, html_path, variants, span, edition_deadline.upload_timeout()):
+                raise RuntimeError('Upload failed')
+        result.add_timing(stage, span.duration())
+
+        if archive is not None and site_dir is not None:
+            from archive_site import ArchiveSite
+            publish_archive_site(daily_config, ArchiveSite(archive, name, os.path.join(site_dir, name)),
+                                 metrics, edition_deadline.upload_timeout(), name)
+    except Exception as exc:
+        logging.exception(exc)
+        result.error(f'{stage}: {exc}')
+    return result
+
+
+def run_batch(configs: dict, workers: int = 4, out_dir: str = '.', assets=None,
+              metrics: RunMetrics = None, breakers: BreakerBoard = None, archive=None,
+              site_dir: str = None, deadline: float = DEFAULT_DEADLINE, budgets: dict = None,
+              store: SectionStore = None, parse_pool=None) -> list:
+    """
+    Create the editions of many subscribers, fetching shared inputs only once
+    :param configs: Dictionary of edition name to Daily Commute configuration
+    :param workers: Number of editions processed concurrently
+    :param out_dir: Directory for the temporary HTML files
+    :param assets: LinkedAssets or InlineAssets, linked by default
+    :param metrics: RunMetrics receiving the spans of the batch, optional
+    :param breakers: BreakerBoard of the upstreams, kept in memory if not given
+    :param archive: EditionArchive receiving every edition, optional
+    :param site_dir: Directory of the archive sites, one sub-directory per subscriber, optional
+    :param deadline: Seconds allowed to the shared fetches, then to every edition
+    :param budgets: Seconds allowed to each source, DEFAULT_BUDGETS if not given
+    :param store: SectionStore of the last good data, kept in memory if not given
+    :param parse_pool: ParsePool shared by the editions, optional
+    :return: list of edition results, in the order of configs
+    """
+    if not configs:
+        return []
+    if metrics is None:
+        metrics = RunMetrics()
+    if breakers is None:
+        breakers = BreakerBoard()
+    if store is None:
+        store = SectionStore()
+    shared = SharedInputs()
+    start = time.perf_counter()
+    shared.fetch(list(configs.values()), metrics, breakers, Deadline(deadline, budgets), store)
+    logging.info(f'Shared inputs fetched in {time.perf_counter() - start:.2f}s')
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(create_edition, name, daily_config, shared, out_dir, metrics, assets,
+                               breakers, archive, site_dir, deadline, budgets, store, parse_pool)
+                   for name, daily_config in configs.items()]
+        results = [future.result() for future in futures]
+    # The editions only mark their sections, the file is written once for the batch
+    store.flush()
+    breakers.export(metrics)
+    return results
+
+
+def main():
+    """
+    Create and upload the Daily Commute of every given configuration
+    :return: status code 0 if every edition was published, 1 otherwise
+    """
+    logging.getLogger().setLevel(logging.INFO)
+    log_format = '(%(asctime)s) [%(levelname)s] %(message)s'
+    logging.basicConfig(format=log_format, filename='tdc.log', filemode='a')
+    parser = argparse.ArgumentParser(description='Create the Daily Commute for many subscribers')
+    parser.add_argument('--config', dest='configs', required=True, nargs='+',
+                        help='Configuration files or directories of *.ini files, holding one or '
+                             'several subscriber profiles')
+    parser.add_argument('--config-cache', dest='config_cache',
+                        help='File keeping the compiled profiles, passwords included, files are parsed '
+                             'again only when they change')
+    parser.add_argument('--workers', dest='workers', type=int, default=4,
+                        help='Number of editions processed concurrently')
+    parser.add_argument('--out-dir', dest='out_dir', default='.',
+                        help='Directory for the temporary HTML files')
+    parser.add_argument('--inline-assets', dest='inline_assets', metavar='DIR',
+                        help='Inline style.css and an icon sprite from DIR in every edition')
+    parser.add_argument('--metrics', dest='metrics', default='tdc-metrics.jsonl',
+                        help='JSON-lines file receiving the stage spans of every run')
+    parser.add_argument('--prometheus', dest='prometheus', default='tdc.prom',
+                        help='Prometheus textfile-collector file of the last run')
+    parser.add_argument('--deadline', dest='deadline', type=float, default=DEFAULT_DEADLINE,
+                        help='Seconds allowed to the shared fetches, then to every edition, upload included')
+    parser.add_argument('--budget', dest='budget', action='append', metavar='SOURCE=SECONDS',
+                        help='Seconds allowed to a source (weather, events, qotd, ron) before '
+                             'its section falls back on the last good data')
+    parser.add_argument('--sections', dest='sections', default='tdc-batch-sections.json',
+                        help='File keeping the last good data of every section, location and subscriber')
+    parser.add_argument('--breakers', dest='breakers', default='tdc-breakers.json',
+                        help='File keeping the circuit breaker state of every upstream across runs')
+    parser.add_argument('--cool-down', dest='cool_down', type=float, default=600,
+                        help='Seconds during which an upstream is skipped after repeated failures')
+    parser.add_argument('--archive', dest='archive', default='tdc-archive.db',
+                        help='SQLite archive of the editions and their inputs, empty to disable')
+    parser.add_argument('--retention', dest='retention', type=int, default=400,
+                        help='Days of editions kept in the archive')
+    parser.add_argument('--archive-site', dest='archive_site', metavar='DIR',
+                        help='Build the archive pages of every subscriber in DIR/<name> and upload '
+                             'the changed ones next to the edition')
+    args = parser.parse_args()
+    try:
+        budgets = parse_budgets(args.budget)
+    except ValueError as exc:
+        logging.exception(exc)
+        return 1
+
+    store = ConfigStore(args.configs, args.config_cache)
+    store.reload()
+    configs = store.configs()
+    failed = list(store.errors())
+
+    metrics = RunMetrics()
+    breakers = BreakerBoard(args.breakers, cool_down=args.cool_down)
+    archive = None
+    if args.archive:
+        from archive import EditionArchive
+        archive = EditionArchive(args.archive)
+    # A single pool for the whole batch, created before the editions start their threads
+    parse_pool = make_parse_pool(configs.values())
+    results = run_batch(configs, args.workers, args.out_dir, make_assets(args.inline_assets), metrics,
+                        breakers, archive, args.archive_site, args.deadline, budgets,
+                        SectionStore(args.sections, autoflush=False), parse_pool)
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    if archive is not None:
+        prune_archive(archive, args.retention, metrics)
+        archive.close()
+    metrics.write(args.metrics, args.prometheus)
+    for result in results:
+        print(result)
+    for path in failed:
+        print(f'{path}: FAILED (config)')
+
+    return 0 if not failed and all(result.succeeded() for result in results) else 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Benchmark the parsing, filtering and rendering stages of the Daily Commute on fixtures"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import fixtures
+from get_events import Event, ParsePool, parse_today_events
+from get_quote import Quote
+from get_weather import WeatherReport
+import write_page
+
+
+class BenchResult:
+    """Timings of one benchmark at one fixture size"""
+    def __init__(self, name: str, size: int, timings: list):
+        self._name = name
+        self._size = size
+        self._timings = timings
+
+    def name(self) -> str:
+        """
+        Get the benchmark name
+        :return: name
+        """
+        return self._name
+
+    def size(self) -> int:
+        """
+        Get the fixture size, number of events
+        :return: size
+        """
+        return self._size
+
+    def to_dict(self) -> dict:
+        """
+        Convert the result to a JSON serializable dictionary
+        :return: dictionary
+        """
+        return {'name': self._name, 'size': self._size, 'repeat': len(self._timings),
+                'min': min(self._timings), 'median': statistics.median(self._timings),
+                'mean': statistics.mean(self._timings)}
+
+    def __str__(self):
+        values = self.to_dict()
+        return f'{self._name:16} {self._size:>7}  min {values["min"] * 1000:10.2f}ms  ' \
+               f'median {values["median"] * 1000:10.2f}ms'
+
+
+def time_it(function, repeat: int, setup=None) -> list:
+    """
+    Time a function several times
+    :param function: Function to time, receives the result of setup if given
+    :param repeat: Number of runs
+    :param setup: Function called before every run, not timed, optional
+    :return: list of durations in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def read_report(raw: bytes) -> WeatherReport:
+    """
+    Decode a DarkSky response the way WeatherReport.get_report does
+    :param raw: Response body
+    :return: weather report
+    """
+    report = WeatherReport(None, None)
+    report._read_json(json.loads(raw))
+    return report
+
+
+def run_pipeline(calendar: list, raw_weather: bytes, out: str):
+    """
+    Run every offline stage of an edition: parse, filter, sort, weather and render
+    :param calendar: Calendar objects
+    :param raw_weather: DarkSky response body
+    :param out: Path to the rendered page
+    """
+    events = sorted(event for event in (Event(data, Event.WORK) for data in calendar)
+                    if event.is_happening_today())
+    report = read_report(raw_weather)
+    write_page.write_html(report, events, out, Quote('Citation', 'Auteur'), Quote('Meat.', 'Ron'))
+
+
+def parse_in_pool(calendar: list, workers: int) -> list:
+    """
+    Parse a calendar the way FastMailCalendar does with parse_workers, pool start included
+    :param calendar: Calendar objects
+    :param workers: Number of processes
+    :return: list of today's events
+    """
+    pool = ParsePool(workers)
+    try:
+        return list(parse_today_events(calendar, Event.WORK, pool))
+    finally:
+        pool.shutdown()
+
+
+def crossover(results: list, name: str = 'parse_today', pool_name: str = 'parse_pool') -> int:
+    """
+    Find the smallest calendar parsed faster by the process pool
+    :param results: List of BenchResult
+    :param name: Benchmark of the in-process parsing
+    :param pool_name: Benchmark of the pool parsing
+    :return: number of events, None if the pool never wins
+    """
+    medians = {(result.name(), result.size()): result.to_dict()['median'] for result in results}
+    sizes = sorted(size for bench, size in medians if bench == pool_name and (name, size) in medians)
+    return next((size for size in sizes if medians[pool_name, size] < medians[name, size]), None)
+
+
+def run_benchmarks(sizes: list, repeat: int, seed: int = 0, workers: int = None) -> list:
+    """
+    Run the benchmark suite
+    :param sizes: Numbers of events of the calendar fixtures
+    :param repeat: Number of runs per benchmark
+    :param seed: Random seed of the fixtures
+    :param workers: Processes of the pool parsing benchmark, the CPU count by default
+    :return: list of BenchResult
+    """
+    workers = workers or os.cpu_count()
+    results = []
+    raw_weather = json.dumps(fixtures.make_darksky_response(seed)).encode()
+    results.append(BenchResult('weather_read', 1, time_it(lambda: read_report(raw_weather), repeat)))
+    print(results[-1])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out = os.path.join(tmp_dir, 'tdc.html')
+        for size in sizes:
+            calendar = fixtures.make_calendar(size, seed)
+            results.append(BenchResult('event_parse', size, time_it(
+                lambda: [Event(data, Event.WORK) for data in calendar], repeat)))
+
+            events = [Event(data, Event.WORK) for data in calendar]
+            results.append(BenchResult('event_filter', size, time_it(
+                lambda: [event for event in events if event.is_happening_today()], repeat)))
+            results.append(BenchResult('event_sort', size, time_it(lambda: sorted(events), repeat)))
+
+            today = sorted(event for event in events if event.is_happening_today())
+            report = read_report(raw_weather)
+            results.append(BenchResult('write_html', size, time_it(
+                lambda: write_page.write_html(report, today, out, Quote('Citation', 'Auteur'),
+                                              Quote('Meat.', 'Ron')), repeat)))
+            results.append(BenchResult('pipeline', size, time_it(
+                lambda: run_pipeline(calendar, raw_weather, out), repeat)))
+            results.append(BenchResult('parse_today', size, time_it(
+                lambda: list(parse_today_events(calendar, Event.WORK)), repeat)))
+            results.append(BenchResult('parse_pool', size, time_it(
+                lambda: parse_in_pool(calendar, workers), repeat)))
+            for result in results[-7:]:
+                print(result)
+
+    size = crossover(results)
+    print(f'Pool parsing with {workers} process(es) ' +
+          (f'wins from {size} events' if size is not None else 'never wins at these sizes'))
+    return results
+
+
+def git_commit() -> str:
+    """
+    Get the commit of the benchmarked tree
+    :return: short commit hash, None outside of a git repository
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base: dict, current: dict) -> str:
+    """
+    Compare two stored benchmark runs
+    :param base: Reference run
+    :param current: New run
+    :return: comparison table, ratio above 1 means slower
+    """
+    base_results = {(result['name'], result['size']): result for result in base['results']}
+    lines = [f'{base.get("commit")} -> {current.get("commit")}']
+    for result in current['results']:
+        key = (result['name'], result['size'])
+        if key in base_results:
+            ratio = result['median'] / base_results[key]['median']
+            lines.append(f'{result["name"]:16} {result["size"]:>7}  x{ratio:6.2f}')
+    return '\n'.join(lines)
+
+
+def main():
+    """
+    Run the benchmarks and store the results as JSON
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the Daily Commute')
+    parser.add_argument('--sizes', dest='sizes', default='100,10000,100000',
+                        help='Comma separated numbers of events of the calendar fixtures')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='Runs per benchmark')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed of the fixtures')
+    parser.add_argument('--workers', dest='workers', type=int,
+                        help='Processes of the pool parsing benchmark, the CPU count by default')
+    parser.add_argument('--out', dest='out', default='bench_results.json', help='Result file')
+    parser.add_argument('--compare', dest='compare', metavar='BASE',
+                        help='Result file of a previous run to compare with')
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out)
+    base = os.path.abspath(args.compare) if args.compare else None
+    # The ephemeris is loaded relatively to the repository
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    workers = args.workers or os.cpu_count()
+    results = run_benchmarks([int(size) for size in args.sizes.split(',')], args.repeat, args.seed, workers)
+    run = {'commit': git_commit(), 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(), 'platform': platform.platform(),
+           'seed': args.seed, 'workers': workers, 'parse_crossover': crossover(results),
+           'results': [result.to_dict() for result in results]}
+    with open(out, 'w') as file:
+        json.dump(run, file, indent=2)
+
+    if base is not None:
+        with open(base, 'r') as file:
+            print(compare(json.load(file), run))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""Record the upstream exchanges of a run to a cassette file and replay them"""
+
+import argparse
+import base64
+import contextlib
+import datetime
+import hashlib
+import http.client
+import io
+import json
+import lzma
+import threading
+import time
+
+LATENCIES = ('original', 'zero')
+
+
+class Exchange:
+    """One recorded request and its response"""
+    def __init__(self, method: str, url: str, body_hash: str, status: int, reason: str,
+                 headers: list, body: bytes, elapsed: float):
+        """
+        Constructor for an exchange
+        :param method: HTTP method of the request
+        :param url: Full URL of the request
+        :param body_hash: SHA-1 of the request body
+        :param status: Status code of the response
+        :param reason: Reason phrase of the response
+        :param headers: List of (name, value) response headers
+        :param body: Response body
+        :param elapsed: Seconds between the request and the end of the response
+        """
+        self._method = method
+        self._url = url
+        self._body_hash = body_hash
+        self._status = status
+        self._reason = reason
+        self._headers = headers
+        self._body = body
+        self._elapsed = elapsed
+
+    def method(self) -> str:
+        """
+        Get the HTTP method of the request
+        :return: method
+        """
+        return self._method
+
+    def url(self) -> str:
+        """
+        Get the URL of the request
+        :return: url
+        """
+        return self._url
+
+    def body_hash(self) -> str:
+        """
+        Get the SHA-1 of the request body
+        :return: hex digest
+        """
+        return self._body_hash
+
+    def status(self) -> int:
+        """
+        Get the status code of the response
+        :return: status code
+        """
+        return self._status
+
+    def reason(self) -> str:
+        """
+        Get the reason phrase of the response
+        :return: reason
+        """
+        return self._reason
+
+    def headers(self) -> list:
+        """
+        Get the response headers
+        :return: list of (name, value)
+        """
+        return self._headers
+
+    def body(self) -> bytes:
+        """
+        Get the response body
+        :return: bytes
+        """
+        return self._body
+
+    def elapsed(self) -> float:
+        """
+        Get the recorded latency of the exchange
+        :return: seconds
+        """
+        return self._elapsed
+
+    def to_dict(self) -> dict:
+        """
+        Convert the exchange to a JSON serializable dictionary, text bodies are kept readable
+        :return: dictionary
+        """
+        values = {'method': self._method, 'url': self._url, 'body_hash': self._body_hash,
+                  'status': self._status, 'reason': self._reason, 'headers': self._headers,
+                  'elapsed': round(self._elapsed, 6)}
+        try:
+            values['body'] = self._body.decode('utf-8')
+        except UnicodeDecodeError:
+            values['body_b64'] = base64.b64encode(self._body).decode('ascii')
+        return values
+
+    @staticmethod
+    def from_dict(values: dict):
+        """
+        Read an exchange written by to_dict
+        :param values: Dictionary
+        :return: Exchange
+        """
+        if 'body_b64' in values:
+            body = base64.b64decode(values['body_b64'])
+        else:
+            body = values['body'].encode('utf-8')
+        return Exchange(values['method'], values['url'], values['body_hash'], values['status'],
+                        values['reason'], [tuple(header) for header in values['headers']], body,
+                        values['elapsed'])
+
+
+def hash_body(body) -> str:
+    """
+    Hash a request body
+    :param body: Request body, bytes, str or None
+    :return: SHA-1 hex digest
+    """
+    if body is None:
+        body = b''
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha1(body).hexdigest()
+
+
+class Cassette:
+    """Ordered upstream exchanges, stored as LZMA-compressed JSON lines"""
+    def __init__(self, exchanges: list = None, recorded: str = None):
+        """
+        Constructor for a cassette
+        :param exchanges: Recorded exchanges, optional
+        :param recorded: ISO date of the recording, now by default
+        """
+        self._exchanges = list(exchanges or [])
+        self._recorded = recorded or datetime.datetime.now().isoformat(timespec='seconds')
+        self._lock = threading.Lock()
+        self._replayed = {}
+
+    def exchanges(self) -> list:
+        """
+        Get the recorded exchanges
+        :return: list of Exchange
+        """
+        with self._lock:
+            return list(self._exchanges)
+
+    def recorded(self) -> str:
+        """
+        Get the date of the recording
+        :return: ISO date
+        """
+        return self._recorded
+
+    def add(self, exchange: Exchange):
+        """
+        Append an exchange
+        :param exchange: Exchange
+        """
+        with self._lock:
+            self._exchanges.append(exchange)
+
+    def find(self, method: str, url: str, body) -> Exchange:
+        """
+        Find the recorded response of a request. Identical requests get their responses in
+        recording order, the last one is repeated once exhausted. A request whose body changed,
+        like a calendar query for another day, falls back on the method and URL.
+        :param method: HTTP method
+        :param url: Full URL
+        :param body: Request body
+        :return: Exchange, None if the request was not recorded
+        """
+        body_hash = hash_body(body)
+        with self._lock:
+            for key, matches in (((method, url, body_hash),
+                                  lambda exchange: exchange.body_hash() == body_hash),
+                                 ((method, url), lambda exchange: True)):
+                candidates = [exchange for exchange in self._exchanges
+                              if exchange.method() == method and exchange.url() == url
+                              and matches(exchange)]
+                if candidates:
+                    index = self._replayed.get(key, 0)
+                    self._replayed[key] = index + 1
+                    return candidates[min(index, len(candidates) - 1)]
+        return None
+
+    def save(self, path: str):
+        """
+        Write the cassette
+        :param path: Cassette file
+        """
+        with lzma.open(path, 'wt', encoding='utf-8') as file:
+            file.write(json.dumps({'version': 1, 'recorded': self._recorded}) + '\n')
+            for exchange in self.exchanges():
+                file.write(json.dumps(exchange.to_dict(), ensure_ascii=False) + '\n')
+
+    @staticmethod
+    def load(path: str):
+        """
+        Read a cassette written by save
+        :param path: Cassette file
+        :return: Cassette
+        """
+        with lzma.open(path, 'rt', encoding='utf-8') as file:
+            header = json.loads(file.readline())
+            if header.get('version') != 1:
+                raise ValueError(f'Unsupported cassette version {header.get("version")} in {path}')
+            exchanges = [Exchange.from_dict(json.loads(line)) for line in file if line.strip()]
+        return Cassette(exchanges, header.get('recorded'))
+
+
+class _ReplayedResponse(io.BytesIO):
+    """Response body served from memory, with the parts of http.client.HTTPResponse we use"""
+    def __init__(self, exchange: Exchange):
+        super().__init__(exchange.body())
+        self.url = exchange.url()
+        self.status = exchange.status()
+        self.reason = exchange.reason()
+        self.headers = http.client.HTTPMessage()
+        for name, value in exchange.headers():
+            self.headers[name] = value
+
+    def getcode(self) -> int:
+        return self.status
+
+    def geturl(self) -> str:
+        return self.url
+
+    def info(self):
+        return self.headers
+
+
+def _urllib_request(url, data=None) -> tuple:
+    import urllib.request
+    if isinstance(url, urllib.request.Request):
+        return url.get_method(), url.full_url, url.data if data is None else data
+    return ('POST' if data is not None else 'GET'), url, data
+
+
+def _raise_for_status(exchange: Exchange):
+    import urllib.error
+    if exchange.status() >= 400:
+        response = _ReplayedResponse(exchange)
+        raise urllib.error.HTTPError(exchange.url(), exchange.status(), exchange.reason(),
+                                     response.headers, response)
+
+
+def _requests_response(exchange: Exchange):
+    import requests
+    import requests.structures
+    response = requests.Response()
+    response.status_code = exchange.status()
+    response.reason = exchange.reason()
+    response.url = exchange.url()
+    response.headers = requests.structures.CaseInsensitiveDict(exchange.headers())
+    response._content = exchange.body()
+    # Streamed reads iterate over the recorded body
+    response._content_consumed = True
+    return response
+
+
+@contextlib.contextmanager
+def _patched(urlopen, session_request):
+    """Route urllib.request.urlopen and requests.Session.request, used by caldav, through hooks"""
+    import urllib.request
+    import requests
+    original_urlopen = urllib.request.urlopen
+    original_request = requests.Session.request
+    urllib.request.urlopen = urlopen
+    requests.Session.request = session_request
+    try:
+        yield original_urlopen, original_request
+    finally:
+        urllib.request.urlopen = original_urlopen
+        requests.Session.request = original_request
+
+
+@contextlib.contextmanager
+def recording(path: str):
+    """
+    Record every upstream exchange of the enclosed block to a cassette file
+    :param path: Cassette file, written when the block exits
+    :return: context manager yielding the Cassette
+    """
+    import urllib.error
+    cassette = Cassette()
+    originals = {}
+
+    def urlopen(url, data=None, *args, **kwargs):
+        method, full_url, body = _urllib_request(url, data)
+        start = time.perf_counter()
+        try:
+            with originals['urlopen'](url, data, *args, **kwargs) as response:
+                content = response.read()
+                status, reason, headers = response.getcode(), response.reason, response.headers.items()
+        except urllib.error.HTTPError as error:
+            content = error.read()
+            status, reason, headers = error.code, error.reason, error.headers.items()
+        exchange = Exchange(method, full_url, hash_body(body), status, reason, list(headers), content,
+                            time.perf_counter() - start)
+        cassette.add(exchange)
+        _raise_for_status(exchange)
+        return _ReplayedResponse(exchange)
+
+    def session_request(session, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        response = originals['request'](session, method, url, *args, **kwargs)
+        body = kwargs.get('data', args[1] if len(args) > 1 else None)
+        cassette.add(Exchange(method.upper(), url, hash_body(body), response.status_code, response.reason,
+                              list(response.headers.items()), response.content,
+                              time.perf_counter() - start))
+        return response
+
+    with _patched(urlopen, session_request) as (originals['urlopen'], originals['request']):
+        try:
+            yield cassette
+        finally:
+            cassette.save(path)
+
+
+class _RealInstances(type):
+    """Metaclass of the shifted classes, real dates and datetimes still pass isinstance checks"""
+    def __instancecheck__(cls, instance):
+        return isinstance(instance, cls.__mro__[1])
+
+
+@contextlib.contextmanager
+def pinned_today(day: datetime.date):
+    """
+    Make datetime.date.today() return a given day in the enclosed block, datetime.datetime.now() is
+    shifted by the same number of days and keeps the time of day
+    :param day: Day returned as today
+    :return: context manager
+    """
+    real_date, real_datetime = datetime.date, datetime.datetime
+    offset = day - real_date.today()
+
+    class ShiftedDate(real_date, metaclass=_RealInstances):
+        @classmethod
+        def today(cls):
+            return real_date.today() + offset
+
+    class ShiftedDatetime(real_datetime, metaclass=_RealInstances):
+        @classmethod
+        def now(cls, tz=None):
+            return real_datetime.now(tz) + offset
+
+        @classmethod
+        def today(cls):
+            return real_datetime.today() + offset
+
+    # The modules call datetime.date.today() and datetime.datetime.now() through the module
+    datetime.date, datetime.datetime = ShiftedDate, ShiftedDatetime
+    try:
+        yield
+    finally:
+        datetime.date, datetime.datetime = real_date, real_datetime
+
+
+@contextlib.contextmanager
+def replaying(path: str, latency: str = 'original'):
+    """
+    Serve the upstream exchanges of the enclosed block from a cassette file, unrecorded
+    requests fail as unreachable upstreams. Today is the day of the recording in the block, so that
+    the recorded events, date and ephemeris are rendered again.
+    :param path: Cassette file
+    :param latency: 'original' to wait as long as the recorded exchange, 'zero' to answer at once
+    :return: context manager yielding the Cassette
+    """
+    if latency not in LATENCIES:
+        raise ValueError(f'Unknown replay latency {latency}, expected one of {", ".join(LATENCIES)}')
+    import urllib.error
+    import requests
+    cassette = Cassette.load(path)
+
+    def serve(method: str, url: str, body) -> Exchange:
+        exchange = cassette.find(method, url, body)
+        if exchange is not None and latency == 'original':
+            time.sleep(exchange.elapsed())
+        return exchange
+
+    def urlopen(url, data=None, *args, **kwargs):
+        method, full_url, body = _urllib_request(url, data)
+        exchange = serve(method, full_url, body)
+        if exchange is None:
+            raise urllib.error.URLError(f'No recorded response for {method} {full_url}')
+        _raise_for_status(exchange)
+        return _ReplayedResponse(exchange)
+
+    def session_request(session, method, url, *args, **kwargs):
+        body = kwargs.get('data', args[1] if len(args) > 1 else None)
+        exchange = serve(method.upper(), url, body)
+        if exchange is None:
+            raise requests.exceptions.ConnectionError(f'No recorded response for {method} {url}')
+        return _requests_response(exchange)
+
+    recorded = datetime.datetime.fromisoformat(cassette.recorded()).date()
+    with _patched(urlopen, session_request), pinned_today(recorded):
+        yield cassette
+
+
+def main():
+    """
+    List the exchanges of a cassette
+    """
+    parser = argparse.ArgumentParser(description='List the exchanges of a Daily Commute cassette')
+    parser.add_argument('cassette', help='Cassette file')
+    args = parser.parse_args()
+
+    cassette = Cassette.load(args.cassette)
+    print(f'Recorded {cassette.recorded()}')
+    for exchange in cassette.exchanges():
+        print(f'{exchange.status()} {exchange.method():8} {len(exchange.body()):>9}B '
+              f'{exchange.elapsed() * 1000:8.1f}ms  {exchange.url()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Skip upstreams which keep failing, with a state shared by successive runs"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+# Values of the tdc_circuit_state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+DEFAULT_THRESHOLD = 3
+DEFAULT_COOL_DOWN = 600
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+
+class CircuitBreaker:
+    """Breaker of one upstream: opens after repeated failures, then lets a single probe through"""
+    def __init__(self, name: str, threshold: int = DEFAULT_THRESHOLD,
+                 cool_down: float = DEFAULT_COOL_DOWN, state: dict = None, on_change=None, clock=time.time):
+        """
+        Constructor for a breaker
+        :param name: Upstream name
+        :param threshold: Number of consecutive failures opening the breaker
+        :param cool_down: Seconds during which an open breaker skips the upstream
+        :param state: State written by to_dict, closed if not given
+        :param on_change: Function called with the breaker after every state change, optional
+        :param clock: Function returning the current timestamp, wall time since the state outlives the run
+        """
+        state = state or {}
+        self._name = name
+        self._threshold = threshold
+        self._cool_down = cool_down
+        self._state = state.get('state', CLOSED)
+        self._failures = state.get('failures', 0)
+        self._opened_at = state.get('opened_at', 0.)
+        self._probe_at = state.get('probe_at', 0.)
+        self._on_change = on_change
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def name(self) -> str:
+        """
+        Get the upstream name
+        :return: name
+        """
+        return self._name
+
+    def state(self) -> str:
+        """
+        Get the state of the breaker
+        :return: 'closed', 'open' or 'half-open'
+        """
+        return self._state
+
+    def failures(self) -> int:
+        """
+        Get the number of consecutive failures
+        :return: count
+        """
+        return self._failures
+
+    def allow(self) -> bool:
+        """
+        Check if the upstream may be called, an open breaker past its cool-down lets one probe
+        through, and another one if that probe never reported back within a cool-down
+        :return: bool
+        """
+        with self._lock:
+            now = self._clock()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and now - self._opened_at < self._cool_down:
+                return False
+            if self._state == HALF_OPEN and now - self._probe_at < self._cool_down:
+                return False
+            logging.info(f'Probing {self._name}')
+            self._state = HALF_OPEN
+            self._probe_at = now
+        self._changed()
+        return True
+
+    def record_success(self):
+        """
+        Close the breaker after a successful call
+        """
+        with self._lock:
+            if self._state == CLOSED and self._failures == 0:
+                return
+            if self._state != CLOSED:
+                logging.info(f'Closing the breaker of {self._name}')
+            self._state = CLOSED
+            self._failures = 0
+        self._changed()
+
+    def record_failure(self):
+        """
+        Count a failed call, opening the breaker at the threshold or if the probe failed
+        """
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self._threshold:
+                logging.warning(f'Opening the breaker of {self._name} for {self._cool_down}s '
+                                f'after {self._failures} failure(s)')
+                self._state = OPEN
+                self._opened_at = self._clock()
+        self._changed()
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call an upstream through the breaker
+        :param function: Function calling the upstream, an exception counts as a failure
+        :param args: Arguments of the function
+        :param kwargs: Keyword arguments of the function
+        :return: result of the function
+        """
+        if not self.allow():
+            raise CircuitOpenError(f'Skipping {self._name}, its breaker is open')
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        Convert the state of the breaker to a JSON serializable dictionary
+        :return: dictionary
+        """
+        with self._lock:
+            return {'state': self._state, 'failures': self._failures,
+                    'opened_at': self._opened_at, 'probe_at': self._probe_at}
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self)
+
+
+class BreakerBoard:
+    """Breakers of every upstream, persisted as JSON after every state change"""
+    def __init__(self, path: str = None, threshold: int = DEFAULT_THRESHOLD,
+                 cool_down: float = DEFAULT_COOL_DOWN, clock=time.time):
+        """
+        Constructor for the board
+        :param path: JSON file holding the breaker states, None to keep them in memory only
+        :param threshold: Number of consecutive failures opening a breaker
+        :param cool_down: Seconds during which an open breaker skips its upstream
+        :param clock: Function returning the current timestamp of the breakers
+        """
+        self._path = path
+        self._threshold = threshold
+        self._cool_down = cool_down
+        self._clock = clock
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._states = self._read()
+
+    def _read(self) -> dict:
+        if self._path is None or not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as exc:
+            logging.warning(f'Ignoring unreadable breaker states {self._path}: {exc}')
+            return {}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        """
+        Get the breaker of an upstream
+        :param name: Upstream name
+        :return: CircuitBreaker
+        """
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name, self._threshold, self._cool_down,
+                                                      self._states.get(name), self._save, self._clock)
+            return self._breakers[name]
+
+    def call(self, name: str, function, *args, **kwargs):
+        """
+        Call an upstream through its breaker
+        :param name: Upstream name
+        :param function: Function calling the upstream
+        :param args: Arguments of the function
+        :param kwargs: Keyword arguments of the function
+        :return: result of the function
+        """
+        return self.breaker(name).call(function, *args, **kwargs)
+
+    def _save(self, breaker: CircuitBreaker):
+        if self._path is None:
+            return
+        with self._lock:
+            # Merge with the file, another run may have updated other breakers meanwhile
+            states = self._read()
+            states[breaker.name()] = breaker.to_dict()
+            tmp_path = f'{self._path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(states, file, indent=2)
+            os.replace(tmp_path, self._path)
+
+    def export(self, metrics):
+        """
+        Record the state and failure count of every used breaker as gauges
+        :param metrics: RunMetrics receiving the gauges
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        for breaker in breakers:
+            labels = {'upstream': breaker.name()}
+            metrics.gauge('circuit_state', STATE_VALUES[breaker.state()], labels)
+            metrics.gauge('circuit_failures', breaker.failures(), labels)
@@ -0,0 +1,256 @@
+"""Keep the Daily Commute warm and publish editions on schedule"""
+
+import datetime
+import logging
+import sched
+import time
+
+import get_quote
+from circuit_breaker import BreakerBoard
+from deadline import Deadline, DEFAULT_DEADLINE
+from section_store import SectionStore
+from daily_commute import ConfigDailyCommute, fetch_weather, fetch_events, publish, archive_edition, \
+    prune_archive, publish_archive_site, breaker_name
+from run_metrics import RunMetrics
+
+SOURCES = ('weather', 'events', 'qotd', 'ron')
+DEFAULT_LEAD_TIMES = {'weather': 10, 'events': 5, 'qotd': 30, 'ron': 30}
+DEFAULT_REFRESH_INTERVALS = {'weather': 60, 'events': 30}
+
+
+def parse_minutes(values: list, defaults: dict) -> dict:
+    """
+    Parse 'source=minutes' command line values on top of defaults
+    :param values: List of 'source=minutes' strings, can be None
+    :param defaults: Default minutes per source
+    :return: dictionary of source name to minutes
+    """
+    minutes = dict(defaults)
+    for value in values or []:
+        source, _, amount = value.partition('=')
+        if source not in SOURCES:
+            raise ValueError(f'Unknown source "{source}", expect one of {", ".join(SOURCES)}')
+        minutes[source] = int(amount)
+    return minutes
+
+
+def parse_time(value: str) -> datetime.time:
+    """
+    Parse a HH:MM time of day
+    :param value: time string
+    :return: time of day
+    """
+    return datetime.datetime.strptime(value, '%H:%M').time()
+
+
+class CommuteDaemon:
+    """Prefetch every source ahead of publish time and refresh volatile sections during the day"""
+    def __init__(self, daily_config: ConfigDailyCommute, publish_at: datetime.time,
+                 lead_times: dict = None, refresh_intervals: dict = None, out: str = 'tdc.html',
+                 assets=None, metrics_paths: tuple = (None, None), breakers=None,
+                 archive=None, subscriber: str = 'default', retention: int = 400, config_store=None,
+                 site=None, deadline: float = DEFAULT_DEADLINE, budgets: dict = None, store=None,
+                 parse_pool=None):
+        """
+        Constructor for the daemon
+        :param daily_config: Daily Commute configuration
+        :param publish_at: Time of day at which the edition is published
+        :param lead_times: Minutes before publish time at which each source is prefetched
+        :param refresh_intervals: Minutes between two refreshes of volatile sources after publication
+        :param out: Path to the temporary HTML file
+        :param assets: LinkedAssets or InlineAssets, linked by default
+        :param metrics_paths: JSON-lines and Prometheus files written after every publication
+        :param breakers: BreakerBoard of the upstreams, kept in memory if not given
+        :param archive: EditionArchive receiving every publication, optional
+        :param subscriber: Subscriber name of the editions in the archive
+        :param retention: Days of editions kept in the archive
+        :param config_store: ConfigStore holding the subscriber profile, checked for changes before
+        every fetch, optional
+        :param site: ArchiveSite rebuilt and uploaded after every publication, optional
+        :param deadline: Seconds allowed to a prefetch, and to a publication to fetch the sources missing
+        at publish time and upload the edition
+        :param budgets: Seconds allowed to each source fetch, DEFAULT_BUDGETS if not given
+        :param store: SectionStore of the last good data, kept in memory if not given
+        :param parse_pool: ParsePool of the events, the parsing is cancelled if they miss their budget, optional
+        """
+        self._config = daily_config
+        self._publish_at = publish_at
+        self._lead_times = dict(DEFAULT_LEAD_TIMES if lead_times is None else lead_times)
+        self._refresh_intervals = dict(DEFAULT_REFRESH_INTERVALS if refresh_intervals is None
+                                       else refresh_intervals)
+        self._out = out
+        self._scheduler = sched.scheduler(time.time, time.sleep)
+        self._data = {}
+        # Imported on first use, rendering is the only stage needing dominate
+        import write_page
+        self._fragments = write_page.FragmentCache()
+        self._assets = assets
+        self._metrics_paths = metrics_paths
+        self._metrics = RunMetrics()
+        self._breakers = BreakerBoard() if breakers is None else breakers
+        self._archive = archive
+        self._subscriber = subscriber
+        self._retention = retention
+        self._pruned_on = None
+        self._config_store = config_store
+        self._site = site
+        self._deadline = deadline
+        self._budgets = budgets
+        self._store = SectionStore() if store is None else store
+        self._parse_pool = parse_pool
+
+    def reload_config(self) -> bool:
+        """
+        Switch to the subscriber profile if its configuration file changed
+        :return: True if the profile changed
+        """
+        if self._config_store is None or self._subscriber not in self._config_store.reload():
+            return False
+        daily_config = self._config_store.configs().get(self._subscriber)
+        if daily_config is None:
+            logging.error(f'Profile {self._subscriber} is now missing or invalid, keeping the previous one')
+            return False
+        logging.info(f'Profile {self._subscriber} changed, reloading it')
+        self._config = daily_config
+        return True
+
+    def _fetch(self, source: str, span, timeout: float = 30, parse_job=None):
+        return self._breakers.call(breaker_name(source, self._config), self._fetch_source, source, span,
+                                   timeout, parse_job)
+
+    def _fetch_source(self, source: str, span, timeout: float, parse_job=None):
+        if source == 'weather':
+            return fetch_weather(self._config, span, timeout)
+        if source == 'events':
+            return fetch_events(self._config, span, timeout, parse_job or self._parse_pool)
+        if source == 'qotd':
+            return get_quote.get_quote_of_the_day(url=self._config.endpoints().qotd_url(), timeout=timeout)
+        if source == 'ron':
+            return get_quote.get_ron_swanson_quote(self._config.endpoints().ron_url(), timeout)
+        raise ValueError(f'Unknown source "{source}"')
+
+    def prefetch(self, source: str) -> bool:
+        """
+        Fetch a source and keep it for the next publication
+        :param source: Source name
+        :return: bool
+        """
+        logging.info(f'Prefetching {source}')
+        self.reload_config()
+        return source in self._fetch_within([source], Deadline(self._deadline, self._budgets))
+
+    def _fetch_within(self, sources: list, deadline: Deadline) -> list:
+        # A hung upstream must not hold the scheduler, its late fetch is abandoned and the section
+        # falls back on the last good data at publish time
+        parse_job = self._parse_pool.job() if self._parse_pool is not None else None
+        fetches = {source: lambda span, source=source: self._fetch(source, span, deadline.budget(source),
+                                                                   parse_job)
+                   for source in sources}
+        fetched = []
+        for source, value in deadline.fetch(fetches, self._metrics).items():
+            if value is not None:
+                self._data[source] = value
+                fetched.append(source)
+            elif source == 'events' and parse_job is not None:
+                # An abandoned events fetch would keep the processes busy
+                parse_job.cancel()
+        return fetched
+
+    def publish(self) -> bool:
+        """
+        Render the edition from prefetched data and upload it, then export the metrics
+        :return: bool
+        """
+        with self._metrics.span('edition') as span:
+            published = self._publish()
+            if not published:
+                span.outcome('error')
+        self._breakers.export(self._metrics)
+        self._metrics.write(*self._metrics_paths)
+        self._metrics = RunMetrics()
+        return published
+
+    def _publish(self) -> bool:
+        # Sources whose prefetch failed are fetched again within their budget, then fall back on the
+        # last good data like a single run
+        deadline = Deadline(self._deadline, self._budgets)
+        missing = [source for source in SOURCES if self._data.get(source) is None]
+        if missing:
+            logging.info(f'Fetching {", ".join(missing)} at publish time')
+            self._fetch_within(missing, deadline)
+        today = datetime.date.today()
+        data, stale = {}, {}
+        for source in SOURCES:
+            data[source], since = self._store.keep_or_load(source, self._data.get(source), today)
+            if since is not None:
+                stale[source] = since
+        import write_page
+        try:
+            with self._metrics.span('render') as span:
+                variants = write_page.write_html(data['weather'], data['events'] or [], self._out,
+                                                 data['qotd'] or get_quote.Quote('', ''),
+                                                 data['ron'] or get_quote.Quote('', ''),
+                                                 self._fragments, self._assets, stale)
+                span.set('stale', sorted(stale))
+        except Exception as exc:
+            logging.exception(exc)
+            return False
+        logging.info('The current issue of the Daily Commute is printed')
+        if self._archive is not None:
+            archive_edition(self._archive, today, self._subscriber, self._out, data['weather'],
+                            data['events'], data['qotd'], data['ron'], self._metrics)
+        with self._metrics.span('upload') as span:
+            published = publish(self._config, self._out, variants, span, deadline.upload_timeout())
+        # Once a day, refreshes do not need it
+        if self._archive is not None and self._pruned_on != today:
+            prune_archive(self._archive, self._retention, self._metrics)
+            self._pruned_on = today
+        if published and self._site is not None:
+            publish_archive_site(self._config, self._site, self._metrics, deadline.upload_timeout())
+        return published
+
+    def refresh(self, source: str):
+        """
+        Fetch a volatile source again and republish if it succeeded
+        :param source: Source name
+        """
+        if self.prefetch(source):
+            self.publish()
+
+    def schedule_day(self, day: datetime.date):
+        """
+        Plan prefetches, publication and refreshes of one day
+        :param day: Day to plan
+        """
+        self._data = {}
+        now = time.time()
+        publish_dt = datetime.datetime.combine(day, self._publish_at)
+        end_of_day = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+
+        for source in SOURCES:
+            prefetch_dt = publish_dt - datetime.timedelta(minutes=self._lead_times.get(source, 0))
+            self._scheduler.enterabs(max(prefetch_dt.timestamp(), now), 1, self.prefetch, (source,))
+        self._scheduler.enterabs(max(publish_dt.timestamp(), now), 2, self.publish)
+
+        for source, interval in self._refresh_intervals.items():
+            if interval <= 0:
+                continue
+            refresh_dt = publish_dt + datetime.timedelta(minutes=interval)
+            while refresh_dt < end_of_day:
+                if refresh_dt.timestamp() > now:
+                    self._scheduler.enterabs(refresh_dt.timestamp(), 3, self.refresh, (source,))
+                refresh_dt += datetime.timedelta(minutes=interval)
+
+        next_day = day + datetime.timedelta(days=1)
+        next_plan_dt = datetime.datetime.combine(next_day, self._publish_at) - \
+            datetime.timedelta(minutes=max(self._lead_times.values(), default=0))
+        self._scheduler.enterabs(max(next_plan_dt.timestamp(), end_of_day.timestamp() - 1), 0,
+                                 self.schedule_day, (next_day,))
+        logging.info(f'Edition of {day} scheduled at {publish_dt}')
+
+    def run(self):
+        """
+        Run the daemon forever, publishing right away if today's publish time is already past
+        """
+        self.schedule_day(datetime.date.today())
+        self._scheduler.run()
@@ -0,0 +1,262 @@
+"""Parse and validate the subscriber profiles once, and parse files again only when they change"""
+
+import argparse
+import configparser
+import glob
+import json
+import logging
+import os
+
+from get_events import parse_precedence
+from get_quote import RON_SWANSON_URL
+from get_weather import DARKSKY_URL
+
+SECTION = 'TheDailyCommute'
+ENDPOINTS = 'Endpoints'
+# Sections of the profiles of a file holding several subscribers, e.g. [Subscriber alice]
+PROFILE_PREFIX = 'Subscriber '
+REQUIRED_OPTIONS = ('darksky_key', 'lat', 'lon', 'fastmail_usr', 'fastmail_pwd', 'fastmail_url',
+                    'ftp_url', 'ftp_usr', 'ftp_pwd', 'ftp_dir')
+# Bump it when the compiled profiles change to parse every file again
+CACHE_VERSION = 1
+
+
+class ConfigError(ValueError):
+    """Raised for an unreadable file, a missing option or an invalid value"""
+
+
+def _number(where: str, option: str, value: str, convert, low, high):
+    try:
+        number = convert(value)
+    except ValueError:
+        raise ConfigError(f'{where}: "{option}" must be a number, not "{value}"') from None
+    if not low <= number <= high:
+        raise ConfigError(f'{where}: "{option}" must be between {low} and {high}, not {number}')
+    return number
+
+
+def _profile_values(parser: configparser.RawConfigParser, section: str, where: str) -> dict:
+    def get(option: str, fallback=None):
+        # A profile section overrides the options shared in [TheDailyCommute]
+        for name in (section, SECTION):
+            if parser.has_option(name, option):
+                return parser.get(name, option).strip()
+        return fallback
+
+    values = {}
+    for option in REQUIRED_OPTIONS:
+        value = get(option)
+        if not value:
+            raise ConfigError(f'{where}: missing option "{option}"')
+        values[option] = value
+    values['lat'] = _number(where, 'lat', values['lat'], float, -90., 90.)
+    values['lon'] = _number(where, 'lon', values['lon'], float, -180., 180.)
+
+    precedence = get('event_precedence')
+    try:
+        values['event_precedence'] = list(parse_precedence(precedence)) if precedence else None
+    except ValueError as exc:
+        raise ConfigError(f'{where}: {exc}') from None
+    values['parse_workers'] = _number(where, 'parse_workers', get('parse_workers', '0'), int, 0, 256)
+
+    # Optional section, defaults are the public services
+    values['darksky_url'] = parser.get(ENDPOINTS, 'darksky_url', fallback=DARKSKY_URL)
+    values['qotd_url'] = parser.get(ENDPOINTS, 'qotd_url', fallback=None)
+    values['ron_url'] = parser.get(ENDPOINTS, 'ron_url', fallback=RON_SWANSON_URL)
+    values['ftp_port'] = _number(where, 'ftp_port', parser.get(ENDPOINTS, 'ftp_port', fallback='21'),
+                                 int, 1, 65535)
+    return values
+
+
+def parse_file(path: str) -> dict:
+    """
+    Parse and validate the profiles of a configuration file. A file without [Subscriber NAME]
+    sections holds a single profile named after the file
+    :param path: INI file
+    :return: dictionary of profile name to dictionary of typed values
+    """
+    parser = configparser.RawConfigParser()
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            parser.read_file(file, path)
+    except (OSError, configparser.Error) as exc:
+        raise ConfigError(f'Cannot read config {path}: {exc}') from None
+
+    sections = {section[len(PROFILE_PREFIX):].strip(): section for section in parser.sections()
+                if section.startswith(PROFILE_PREFIX)}
+    if not sections:
+        if not parser.has_section(SECTION):
+            raise ConfigError(f'Missing "{SECTION}" section in config {path}')
+        sections = {os.path.splitext(os.path.basename(path))[0]: SECTION}
+    return {name: _profile_values(parser, section, f'{path} [{section}]')
+            for name, section in sections.items()}
+
+
+def parse_single(path: str) -> dict:
+    """
+    Parse and validate a configuration file holding a single profile
+    :param path: INI file
+    :return: dictionary of typed values
+    """
+    profiles = parse_file(path)
+    if len(profiles) != 1:
+        raise ConfigError(f'Config {path} holds {len(profiles)} profiles, pick one of '
+                          f'{", ".join(profiles)}')
+    return next(iter(profiles.values()))
+
+
+class ConfigStore:
+    """Profiles of configuration files and directories, compiled once and cached by file mtime"""
+    def __init__(self, paths: list, cache_path: str = None):
+        """
+        Constructor for the store, call reload to read the profiles
+        :param paths: Configuration files, and directories whose *.ini files are read
+        :param cache_path: JSON file keeping the compiled profiles across runs, passwords included,
+        created readable by the owner only, optional
+        """
+        self._paths = list(paths)
+        self._cache_path = cache_path
+        self._files = {}
+        self._values = {}
+        self._configs = {}
+        self._errors = {}
+
+    def files(self) -> list:
+        """
+        Get the configuration files, in reading order
+        :return: list of absolute paths
+        """
+        files = []
+        for path in self._paths:
+            if os.path.isdir(path):
+                files.extend(sorted(glob.glob(os.path.join(path, '*.ini'))))
+            else:
+                files.append(path)
+        return [os.path.abspath(path) for path in files]
+
+    def _read_cache(self) -> dict:
+        if self._cache_path is None or not os.path.exists(self._cache_path):
+            return {}
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as file:
+                cache = json.load(file)
+        except (OSError, ValueError) as exc:
+            logging.warning(f'Ignoring unreadable config cache {self._cache_path}: {exc}')
+            return {}
+        return cache.get('files', {}) if cache.get('version') == CACHE_VERSION else {}
+
+    def _write_cache(self):
+        tmp_path = f'{self._cache_path}.{os.getpid()}.tmp'
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        # Holds the passwords of the profiles, only the owner may ever read it
+        fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        try:
+            with open(fd, 'w', encoding='utf-8') as file:
+                json.dump({'version': CACHE_VERSION, 'files': self._files}, file, ensure_ascii=False)
+            os.replace(tmp_path, self._cache_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _compile(self, path: str, key: list, cache: dict) -> dict:
+        if key is not None and cache.get(path, {}).get('key') == key:
+            return cache[path]
+        logging.info(f'Parsing config {path}')
+        try:
+            if key is None:
+                raise ConfigError(f'Cannot read config {path}: no such file')
+            return {'key': key, 'profiles': parse_file(path)}
+        except ConfigError as exc:
+            logging.error(exc)
+            return {'key': key, 'error': str(exc)}
+
+    def reload(self) -> list:
+        """
+        Parse the files changed since the last call, or since the cached run for the first one
+        :return: sorted names of the profiles added, changed or removed
+        """
+        from daily_commute import ConfigDailyCommute
+        cache = None
+        files = self.files()
+        updated = False
+        for path in files:
+            try:
+                stat = os.stat(path)
+                key = [stat.st_mtime_ns, stat.st_size]
+            except OSError:
+                key = None
+            if path in self._files and self._files[path]['key'] == key:
+                continue
+            if cache is None:
+                cache = self._read_cache()
+            self._files[path] = self._compile(path, key, cache)
+            updated = True
+        for path in set(self._files) - set(files):
+            del self._files[path]
+            updated = True
+        if not updated:
+            return []
+
+        values, errors = {}, {}
+        for path in files:
+            entry = self._files[path]
+            if 'error' in entry:
+                errors[path] = entry['error']
+            for name, profile in entry.get('profiles', {}).items():
+                if name in values:
+                    errors[path] = f'Profile "{name}" of {path} is already defined'
+                    logging.error(errors[path])
+                    continue
+                values[name] = profile
+        changed = sorted(name for name in set(values) | set(self._values)
+                         if values.get(name) != self._values.get(name))
+        for name in changed:
+            if name in values:
+                self._configs[name] = ConfigDailyCommute(values=values[name])
+            else:
+                del self._configs[name]
+        self._values = values
+        self._errors = errors
+        if self._cache_path is not None:
+            self._write_cache()
+        return changed
+
+    def configs(self) -> dict:
+        """
+        Get the valid profiles
+        :return: dictionary of profile name to ConfigDailyCommute, in reading order
+        """
+        return {name: self._configs[name] for name in self._values}
+
+    def errors(self) -> dict:
+        """
+        Get the files which could not be read or hold an invalid profile
+        :return: dictionary of path to error message
+        """
+        return dict(self._errors)
+
+
+def main():
+    """
+    Validate configuration files and list their profiles
+    :return: status code 0 if every file is valid, 1 otherwise
+    """
+    parser = argparse.ArgumentParser(description='Check Daily Commute configurations')
+    parser.add_argument('paths', nargs='+', help='Configuration files or directories')
+    parser.add_argument('--cache', dest='cache', help='Compiled profile cache to update')
+    args = parser.parse_args()
+
+    store = ConfigStore(args.paths, args.cache)
+    store.reload()
+    for name, daily_config in store.configs().items():
+        print(f'{name}: {daily_config.lat()}, {daily_config.lon()}')
+    for path, error in store.errors().items():
+        print(f'{path}: {error}')
+    return 1 if store.errors() else 0
+
+
+if __name__ == '__main__':
+    main()
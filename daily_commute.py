@@ -2,13 +2,12 @@
 
 import argparse
 import logging
-import configparser
 import os
 
-from get_events import FastMailCalendar
-from get_weather import DarkSkyApi, WeatherReport, WeatherLocation
-from upload_page import FtpConfig, upload_to
-import write_page
+from get_events import FastMailCalendar, ParsePool, DEFAULT_TYPE_PRECEDENCE
+from get_weather import DarkSkyApi, WeatherReport, WeatherLocation, DARKSKY_URL
+from get_quote import RON_SWANSON_URL
+from upload_page import FtpConfig, upload_to, upload_files
 
 
 class FastmailConfig:
@@ -40,29 +39,59 @@ class FastmailConfig:
         return self._url
 
 
+class EndpointsConfig:
+    """Stores the upstream endpoints, overridable to run against local stand-in servers"""
+    def __init__(self, darksky_url: str = DARKSKY_URL, qotd_url: str = None,
+                 ron_url: str = RON_SWANSON_URL):
+        self._darksky_url = darksky_url
+        self._qotd_url = qotd_url
+        self._ron_url = ron_url
+
+    def darksky_url(self) -> str:
+        """
+        Get the DarkSky forecast endpoint
+        :return: url
+        """
+        return self._darksky_url
+
+    def qotd_url(self) -> str:
+        """
+        Get the quote of the day endpoint
+        :return: url, None to use Wikiquote
+        """
+        return self._qotd_url
+
+    def ron_url(self) -> str:
+        """
+        Get the Ron Swanson quotes endpoint
+        :return: url
+        """
+        return self._ron_url
+
+
 class ConfigDailyCommute:
     """Store the whole configuration needed for running the Daily Commute"""
-    def __init__(self, config_name: str):
-        parser = configparser.RawConfigParser()
-        parser.read(config_name)
-        section = 'TheDailyCommute'
-        if not parser.has_section(section):
-            raise KeyError(f'Missing "{section}" section in config {config_name}')
-
-        options = ('darksky_key', 'lat', 'lon',
-                   'fastmail_usr', 'fastmail_pwd', 'fastmail_url',
-                   'ftp_url', 'ftp_usr', 'ftp_pwd', 'ftp_dir')
-        values = []
-        for option in options:
-            # Will raise an exception if option doesn't exist, which is what we want
-            value = parser.get(section, option)
-            values.append(value)
-
-        self._darsky_key = values[0]
-        self._lat = values[1]
-        self._lon = values[2]
-        self._fastmail_config = FastmailConfig(values[3], values[4], values[5])
-        self._ftp_config = FtpConfig(values[6], values[7], values[8], values[9])
+    def __init__(self, config_name: str = None, values: dict = None):
+        """
+        Constructor for a configuration, parsed and validated by config_store
+        :param config_name: Configuration file holding a single subscriber profile
+        :param values: Typed values of a profile compiled by config_store, instead of a file
+        """
+        if values is None:
+            from config_store import parse_single
+            values = parse_single(config_name)
+
+        self._darsky_key = values['darksky_key']
+        self._lat = values['lat']
+        self._lon = values['lon']
+        self._fastmail_config = FastmailConfig(values['fastmail_usr'], values['fastmail_pwd'],
+                                               values['fastmail_url'])
+        precedence = values['event_precedence']
+        self._event_precedence = tuple(precedence) if precedence else DEFAULT_TYPE_PRECEDENCE
+        self._parse_workers = values['parse_workers']
+        self._endpoints = EndpointsConfig(values['darksky_url'], values['qotd_url'], values['ron_url'])
+        self._ftp_config = FtpConfig(values['ftp_url'], values['ftp_usr'], values['ftp_pwd'],
+                                     values['ftp_dir'], values['ftp_port'])
 
     def darsky_key(self) -> str:
         """
@@ -106,6 +135,27 @@ class ConfigDailyCommute:
         """
         return self._fastmail_config.url()
 
+    def event_precedence(self) -> tuple:
+        """
+        Get the event types in precedence order, for events found in several calendars
+        :return: tuple of event types
+        """
+        return self._event_precedence
+
+    def parse_workers(self) -> int:
+        """
+        Get the number of processes parsing the events
+        :return: count, 0 to parse them in the running process
+        """
+        return self._parse_workers
+
+    def endpoints(self) -> EndpointsConfig:
+        """
+        Get the upstream endpoints
+        :return: endpoints configuration
+        """
+        return self._endpoints
+
     def get_ftp_config(self) -> FtpConfig:
         """
         Get the FTP configuration
@@ -114,6 +164,293 @@ class ConfigDailyCommute:
         return self._ftp_config
 
 
+def breaker_name(source: str, daily_config: ConfigDailyCommute) -> str:
+    """
+    Get the circuit breaker of a source for a configuration, keyed by endpoint and credentials
+    so that the bad credentials of a subscriber do not skip the source for the others
+    :param source: Source name, 'weather', 'events', 'qotd' or 'ron'
+    :param daily_config: Daily Commute configuration
+    :return: breaker name
+    """
+    endpoints = daily_config.endpoints()
+    if source == 'weather':
+        import hashlib
+        # The name ends up in the breaker file and the metrics, not the API key itself
+        key = hashlib.sha256(daily_config.darsky_key().encode()).hexdigest()[:8]
+        return f'weather {endpoints.darksky_url()} {key}'
+    if source == 'events':
+        return f'events {daily_config.fastmail_url()} {daily_config.fastmail_usr()}'
+    if source == 'qotd':
+        return f'qotd {endpoints.qotd_url() or "wikiquote"}'
+    if source == 'ron':
+        return f'ron {endpoints.ron_url()}'
+    raise ValueError(f'Unknown source "{source}"')
+
+
+def location_key(daily_config: ConfigDailyCommute) -> tuple:
+    """
+    Get the key under which a configuration's weather report is shared
+    :param daily_config: Daily Commute configuration
+    :return: (latitude, longitude) tuple
+    """
+    return daily_config.lat(), daily_config.lon()
+
+
+def fetch_weather(daily_config: ConfigDailyCommute, span=None, timeout: float = 30) -> WeatherReport:
+    """
+    Fetch the weather report for the location of a configuration
+    :param daily_config: Daily Commute configuration
+    :param span: Metrics span accounting for the received bytes, optional
+    :param timeout: Socket timeout in seconds
+    :return: weather report
+    """
+    api = DarkSkyApi(daily_config.darsky_key(), daily_config.endpoints().darksky_url())
+    loc = WeatherLocation(daily_config.lat(), daily_config.lon())
+    report = WeatherReport(api, loc)
+    if not report.get_report(timeout):
+        raise RuntimeError('Failed to get report')
+    if span is not None:
+        span.add_bytes(report.bytes_received())
+    return report
+
+
+def fetch_events(daily_config: ConfigDailyCommute, span=None, timeout: float = 30,
+                 parse_pool=None) -> list:
+    """
+    Fetch today's events from the Fastmail calendars of a configuration
+    :param daily_config: Daily Commute configuration
+    :param span: Metrics span receiving the byte and event counts, optional
+    :param timeout: Socket timeout in seconds
+    :param parse_pool: ParsePool of the entry point, or a ParseJob of it to cancel this fetch alone, used
+    if the profile sets parse_workers, optional
+    :return: sorted list of events
+    """
+    cal = FastMailCalendar(daily_config.fastmail_usr(), daily_config.fastmail_pwd(),
+                           daily_config.fastmail_url(), timeout, daily_config.event_precedence(),
+                           parse_pool=parse_pool if daily_config.parse_workers() > 0 else None)
+    events = cal.get_today_events()
+    if span is not None:
+        span.add_bytes(cal.bytes_received())
+        span.set('events_parsed', cal.events_parsed())
+        span.set('events_duplicates', cal.duplicates())
+        span.set('events_kept', len(events))
+    return events
+
+
+def publish(daily_config: ConfigDailyCommute, html_path: str, variants=(), span=None,
+            timeout: float = 30) -> bool:
+    """
+    Upload an edition and remove the temporary HTML files
+    :param daily_config: Daily Commute configuration
+    :param html_path: Path to the rendered edition
+    :param variants: Suffixes of the precompressed variants of the edition
+    :param span: Metrics span accounting for the sent bytes, optional
+    :param timeout: Socket timeout in seconds
+    :return: bool
+    """
+    if not upload_to(daily_config.get_ftp_config(), html_path, variants, timeout):
+        if span is not None:
+            span.outcome('error')
+        return False
+    if span is not None:
+        span.add_bytes(sum(os.path.getsize(html_path + suffix) for suffix in ('',) + tuple(variants)))
+    os.remove(html_path)
+    for suffix in variants:
+        os.remove(html_path + suffix)
+    return True
+
+
+def archive_edition(archive, day, subscriber: str, html_path: str, report, events, qotd, ron_quote,
+                    metrics, edition: str = None):
+    """
+    Store a rendered edition and its inputs, a failing archive does not stop the publication
+    :param archive: EditionArchive
+    :param day: Day of the edition
+    :param subscriber: Subscriber name
+    :param html_path: Path to the rendered edition
+    :param report: Weather report, can be None
+    :param events: List of events, can be None
+    :param qotd: Quote of the day, can be None
+    :param ron_quote: Ron Swanson quote, can be None
+    :param metrics: RunMetrics receiving the archive span
+    :param edition: Edition name of the span, optional
+    """
+    import sqlite3
+    try:
+        with metrics.span('archive', edition) as span:
+            with open(html_path, 'r') as file:
+                html = file.read()
+            archive.store(day, subscriber, html, report, events, qotd, ron_quote)
+            span.add_bytes(len(html))
+    except (OSError, sqlite3.Error) as exc:
+        logging.exception(exc)
+
+
+def prune_archive(archive, retention: int, metrics) -> int:
+    """
+    Apply the retention policy of the archive, a failing archive does not stop the run
+    :param archive: EditionArchive
+    :param retention: Days of editions kept
+    :param metrics: RunMetrics receiving the prune span
+    :return: number of editions dropped, 0 on failure
+    """
+    import sqlite3
+    try:
+        with metrics.span('archive_prune') as span:
+            dropped = archive.prune(retention)
+            span.set('dropped', dropped)
+            return dropped
+    except sqlite3.Error as exc:
+        logging.exception(exc)
+        return 0
+
+
+def publish_archive_site(daily_config: ConfigDailyCommute, site, metrics, timeout: float = 30,
+                         edition: str = None) -> bool:
+    """
+    Rebuild the archive pages listing the new edition and upload only those, a failing
+    archive site does not fail the already published edition
+    :param daily_config: Daily Commute configuration
+    :param site: ArchiveSite of the subscriber
+    :param metrics: RunMetrics receiving the archive site span
+    :param timeout: Socket timeout in seconds
+    :param edition: Edition name of the span, optional
+    :return: bool
+    """
+    import sqlite3
+    try:
+        with metrics.span('archive_site', edition) as span:
+            changed = site.build()
+            span.set('pages', len(changed))
+            if not changed:
+                return True
+            if not upload_files(daily_config.get_ftp_config(), site.site_dir(), changed, timeout):
+                # Uploaded again by the next build
+                site.invalidate(changed)
+                span.outcome('error')
+                return False
+            span.add_bytes(sum(os.path.getsize(os.path.join(site.site_dir(), *path.split('/')))
+                               for path in changed))
+    except (OSError, sqlite3.Error) as exc:
+        logging.exception(exc)
+        return False
+    return True
+
+
+def make_parse_pool(configs) -> ParsePool:
+    """
+    Create the event parsing processes of an entry point, sized for the most demanding profile
+    :param configs: Iterable of Daily Commute configurations
+    :return: ParsePool, None if no profile sets parse_workers
+    """
+    workers = max((daily_config.parse_workers() for daily_config in configs), default=0)
+    return ParsePool(workers) if workers > 0 else None
+
+
+def make_assets(inline_assets_dir: str):
+    """
+    Get the asset mode of the editions
+    :param inline_assets_dir: Directory of style.css and Icons to inline, None to link them
+    :return: LinkedAssets or InlineAssets
+    """
+    from inline_assets import LinkedAssets, InlineAssets
+    if inline_assets_dir is None:
+        return LinkedAssets()
+    return InlineAssets(inline_assets_dir)
+
+
+def run_edition(daily_config: ConfigDailyCommute, metrics, assets=None, profiler=None,
+                out: str = 'tdc.html', upload: bool = True, deadline=None, store=None,
+                breakers=None, archive=None, subscriber: str = 'default', site=None,
+                parse_pool=None) -> int:
+    """
+    Fetch, render and upload one edition, timing every stage. Sources missing their budget are
+    rendered from the last good data of the store with a stale marker, or omitted.
+    :param daily_config: Daily Commute configuration
+    :param metrics: RunMetrics receiving the spans
+    :param assets: LinkedAssets or InlineAssets, linked by default
+    :param profiler: Profiler of the stages, optional
+    :param out: Path to the temporary HTML file
+    :param upload: Upload the edition, if False the HTML file is kept
+    :param deadline: Deadline of the edition, default budgets started now if not given
+    :param store: SectionStore of the last good data, kept in memory if not given
+    :param breakers: BreakerBoard of the upstreams, kept in memory if not given
+    :param archive: EditionArchive receiving the edition and its inputs, optional
+    :param subscriber: Subscriber name of the edition in the archive
+    :param site: ArchiveSite updated and uploaded after the edition, requires the archive, optional
+    :param parse_pool: ParsePool of the events, the parsing is cancelled if they miss their budget, optional
+    :return: status code 0 or 1
+    """
+    import datetime
+    import get_quote
+    from circuit_breaker import BreakerBoard
+    from deadline import Deadline
+    from profiling import Profiler
+    from section_store import SectionStore
+    if profiler is None:
+        profiler = Profiler()
+    if deadline is None:
+        deadline = Deadline()
+    if store is None:
+        store = SectionStore()
+    if breakers is None:
+        breakers = BreakerBoard()
+
+    # Fetch every source within its budget through its breaker, profiled stages run one after the other
+    endpoints = daily_config.endpoints()
+    parse_job = parse_pool.job() if parse_pool is not None else None
+    fetches = {
+        'weather': lambda span: breakers.call(breaker_name('weather', daily_config), fetch_weather,
+                                              daily_config, span, deadline.budget('weather')),
+        'events': lambda span: breakers.call(breaker_name('events', daily_config), fetch_events,
+                                             daily_config, span, deadline.budget('events'), parse_job),
+        'qotd': lambda span: breakers.call(breaker_name('qotd', daily_config), get_quote.get_quote_of_the_day,
+                                           url=endpoints.qotd_url(), timeout=deadline.budget('qotd')),
+        'ron': lambda span: breakers.call(breaker_name('ron', daily_config), get_quote.get_ron_swanson_quote,
+                                          endpoints.ron_url(), deadline.budget('ron'))}
+    data = deadline.fetch(fetches, metrics, profiler, concurrent=not profiler.enabled())
+    breakers.export(metrics)
+    if data['events'] is None and parse_job is not None:
+        # An abandoned events fetch would keep the processes busy
+        parse_job.cancel()
+
+    # Fall back on the last good data
+    today = datetime.date.today()
+    stale = {}
+    for section in data:
+        data[section], since = store.keep_or_load(section, data[section], today)
+        if since is not None:
+            stale[section] = since
+    report, events = data['weather'], data['events']
+    quotes = {name: data[name] for name in ('qotd', 'ron')}
+
+    # HTML
+    import write_page
+    with metrics.span('render') as span, profiler.stage('render'):
+        variants = write_page.write_html(report, events or [], out,
+                                         quotes['qotd'] or get_quote.Quote('', ''),
+                                         quotes['ron'] or get_quote.Quote('', ''),
+                                         assets=assets, stale=stale)
+        span.add_bytes(os.path.getsize(out))
+        span.set('stale', sorted(stale))
+
+    logging.info('The current issue of the Daily Commute is printed')
+    if archive is not None:
+        archive_edition(archive, today, subscriber, out, report, events, quotes['qotd'], quotes['ron'],
+                        metrics)
+    if not upload:
+        return 0
+
+    # Send to FTP
+    with metrics.span('upload') as span, profiler.stage('upload'):
+        if not publish(daily_config, out, variants, span, deadline.upload_timeout()):
+            return 1
+
+    if site is not None:
+        publish_archive_site(daily_config, site, metrics, deadline.upload_timeout())
+    return 0
+
+
 def main():
     """
     Main function for creating and uploading a Daily Commute edition
@@ -124,50 +461,149 @@ def main():
     logging.basicConfig(format=log_format, filename='tdc.log', filemode='a')
     parser = argparse.ArgumentParser(description='Create the Daily Commute')
     parser.add_argument('--config', dest='config', required=True,
-                        help='Configuration file for The Daily Commute')
+                        help='Configuration file for The Daily Commute, or directory of *.ini files')
+    parser.add_argument('--subscriber', dest='subscriber',
+                        help='Subscriber profile of the configuration, required if it holds several')
+    parser.add_argument('--inline-assets', dest='inline_assets', metavar='DIR',
+                        help='Inline style.css and an icon sprite from DIR and write '
+                             'precompressed variants, making the edition a single request')
+    parser.add_argument('--daemon', dest='daemon', action='store_true',
+                        help='Stay running and publish every day at the publish time')
+    parser.add_argument('--publish-at', dest='publish_at', default='07:00',
+                        help='Daemon mode: time of day of the publication (HH:MM)')
+    parser.add_argument('--lead', dest='lead', action='append', metavar='SOURCE=MINUTES',
+                        help='Daemon mode: prefetch a source (weather, events, qotd, ron) '
+                             'MINUTES before publish time')
+    parser.add_argument('--refresh', dest='refresh', action='append', metavar='SOURCE=MINUTES',
+                        help='Daemon mode: refresh a source and republish every MINUTES '
+                             'after publication, 0 to disable')
+    parser.add_argument('--metrics', dest='metrics', default='tdc-metrics.jsonl',
+                        help='JSON-lines file receiving the stage spans of every run')
+    parser.add_argument('--prometheus', dest='prometheus', default='tdc.prom',
+                        help='Prometheus textfile-collector file of the last run')
+    parser.add_argument('--profile', dest='profile', metavar='DIR',
+                        help='Write a cProfile dump per stage to DIR and print the hot spots')
+    parser.add_argument('--deadline', dest='deadline', type=float, default=60,
+                        help='Seconds allowed to the whole edition, upload included')
+    parser.add_argument('--budget', dest='budget', action='append', metavar='SOURCE=SECONDS',
+                        help='Seconds allowed to a source (weather, events, qotd, ron) before '
+                             'its section falls back on the last good data')
+    parser.add_argument('--sections', dest='sections', default='tdc-sections.json',
+                        help='File keeping the last good data of every section')
+    parser.add_argument('--breakers', dest='breakers', default='tdc-breakers.json',
+                        help='File keeping the circuit breaker state of every upstream across runs')
+    parser.add_argument('--cool-down', dest='cool_down', type=float, default=600,
+                        help='Seconds during which an upstream is skipped after repeated failures')
+    parser.add_argument('--archive', dest='archive', default='tdc-archive.db',
+                        help='SQLite archive of the editions and their inputs, empty to disable')
+    parser.add_argument('--retention', dest='retention', type=int, default=400,
+                        help='Days of editions kept in the archive')
+    parser.add_argument('--archive-site', dest='archive_site', metavar='DIR',
+                        help='Build the archive pages in DIR and upload the changed ones next to '
+                             'the edition')
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', dest='record', metavar='CASSETTE',
+                                help='Record every upstream response of the run to CASSETTE')
+    cassette_group.add_argument('--replay', dest='replay', metavar='CASSETTE',
+                                help='Serve upstream responses from CASSETTE and keep the edition '
+                                     'in tdc.html instead of uploading it')
+    parser.add_argument('--replay-latency', dest='replay_latency', choices=('original', 'zero'),
+                        default='original', help='Replay mode: wait as long as the recorded '
+                                                 'responses or answer at once')
     args = parser.parse_args()
 
+    from deadline import Deadline, parse_budgets
     try:
-        daily_config = ConfigDailyCommute(args.config)
-    except Exception as exc:
+        budgets = parse_budgets(args.budget)
+        deadline = Deadline(args.deadline, budgets)
+    except ValueError as exc:
         logging.exception(exc)
         return 1
 
-    # Weather
-    try:
-        api = DarkSkyApi(daily_config.darsky_key())
-        loc = WeatherLocation(daily_config.lat(), daily_config.lon())
-        report = WeatherReport(api, loc)
-    except Exception as exc:
-        logging.exception(exc)
-        return 1
+    from circuit_breaker import BreakerBoard
+    # A replayed run must not open the breakers of the real upstreams, nor report to monitoring
+    breakers = BreakerBoard(args.breakers if args.replay is None else None, cool_down=args.cool_down)
+    metrics_paths = (args.metrics, args.prometheus) if args.replay is None else (None, None)
 
-    if not report.get_report():
-        logging.error('Failed to get report')
-        return 1
-
-    # Calendar
+    from run_metrics import RunMetrics
+    metrics = RunMetrics()
+    from config_store import ConfigStore, ConfigError
+    config_store = ConfigStore([args.config])
     try:
-        cal = FastMailCalendar(daily_config.fastmail_usr(), daily_config.fastmail_pwd(),
-                               daily_config.fastmail_url())
-        events = cal.get_today_events()
-    except Exception as exc:
+        with metrics.span('config') as span:
+            config_store.reload()
+            configs = config_store.configs()
+            span.set('profiles', len(configs))
+            subscriber = args.subscriber
+            if subscriber is None and len(configs) == 1:
+                subscriber = next(iter(configs))
+            if subscriber not in configs:
+                message = f'No valid profile "{subscriber}" in {args.config}' if subscriber else \
+                    f'{args.config} holds {len(configs)} valid profiles, pick one with --subscriber'
+                raise ConfigError('; '.join([message, *config_store.errors().values()]))
+            daily_config = configs[subscriber]
+    except ConfigError as exc:
         logging.exception(exc)
+        metrics.write(*metrics_paths)
         return 1
 
-    # HTML
-    write_page.write_html(report, events, 'tdc.html')
-
-    logging.info('The current issue of the Daily Commute is printed')
-
-    # Send to FTP
-    if not upload_to(daily_config.get_ftp_config(), 'tdc.html'):
-        return 1
+    # Replayed editions are not archived
+    archive = None
+    if args.archive and args.replay is None:
+        from archive import EditionArchive
+        archive = EditionArchive(args.archive)
+    site = None
+    if archive is not None and args.archive_site:
+        from archive_site import ArchiveSite
+        site = ArchiveSite(archive, subscriber, args.archive_site)
 
-    # Clean tmp file
-    os.remove('tdc.html')
+    from section_store import SectionStore
+    # Created once here, fetches run in threads which must not start processes themselves
+    parse_pool = make_parse_pool([daily_config])
+    if args.daemon:
+        import commute_daemon
+        try:
+            daemon = commute_daemon.CommuteDaemon(
+                daily_config, commute_daemon.parse_time(args.publish_at),
+                commute_daemon.parse_minutes(args.lead, commute_daemon.DEFAULT_LEAD_TIMES),
+                commute_daemon.parse_minutes(args.refresh, commute_daemon.DEFAULT_REFRESH_INTERVALS),
+                assets=make_assets(args.inline_assets),
+                metrics_paths=(args.metrics, args.prometheus), breakers=breakers,
+                archive=archive, subscriber=subscriber, retention=args.retention,
+                config_store=config_store, site=site, deadline=args.deadline, budgets=budgets,
+                store=SectionStore(args.sections), parse_pool=parse_pool)
+        except ValueError as exc:
+            logging.exception(exc)
+            return 1
+        daemon.run()
+        return 0
 
-    return 0
+    import contextlib
+    from profiling import Profiler
+    profiler = Profiler(args.profile)
+    # A replay neither reads nor replaces the last good data of production
+    store = SectionStore(args.sections if args.replay is None else None)
+    tape = contextlib.nullcontext()
+    if args.record is not None or args.replay is not None:
+        import cassette
+        tape = cassette.recording(args.record) if args.record is not None \
+            else cassette.replaying(args.replay, args.replay_latency)
+    with tape, metrics.span('edition') as span:
+        status = run_edition(daily_config, metrics, make_assets(args.inline_assets), profiler,
+                             upload=args.replay is None, deadline=deadline,
+                             store=store, breakers=breakers,
+                             archive=archive, subscriber=subscriber, site=site, parse_pool=parse_pool)
+        if status != 0:
+            span.outcome('error')
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    if archive is not None:
+        prune_archive(archive, args.retention, metrics)
+        archive.close()
+    metrics.write(*metrics_paths)
+    if profiler.enabled():
+        print(profiler.summary())
+    return status
 
 
 if __name__ == '__main__':
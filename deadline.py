@@ -0,0 +1,172 @@
+"""Bound the time spent fetching the sources of an edition"""
+
+import logging
+import threading
+import time
+
+from circuit_breaker import CircuitOpenError
+from run_metrics import Span
+
+SOURCES = ('weather', 'events', 'qotd', 'ron')
+DEFAULT_DEADLINE = 60
+DEFAULT_BUDGETS = {'weather': 10, 'events': 30, 'qotd': 5, 'ron': 5}
+# Time left to the upload even when the deadline is already passed
+MIN_UPLOAD_TIMEOUT = 5
+
+
+def parse_budgets(values: list, defaults: dict = None) -> dict:
+    """
+    Parse 'source=seconds' command line values on top of defaults
+    :param values: List of 'source=seconds' strings, can be None
+    :param defaults: Default seconds per source, DEFAULT_BUDGETS if not given
+    :return: dictionary of source name to seconds
+    """
+    budgets = dict(DEFAULT_BUDGETS if defaults is None else defaults)
+    for value in values or []:
+        source, _, amount = value.partition('=')
+        if source not in SOURCES:
+            raise ValueError(f'Unknown source "{source}", expect one of {", ".join(SOURCES)}')
+        budgets[source] = float(amount)
+    return budgets
+
+
+class SourceFetch:
+    """Fetch of one source in a daemon thread, abandoned if it overruns its budget"""
+    def __init__(self, source: str, fetch, profiler=None, edition: str = None):
+        """
+        Constructor for a fetch
+        :param source: Source name
+        :param fetch: Function receiving the Span and returning the fetched data
+        :param profiler: Profiler of the stage, optional
+        :param edition: Edition name of the span, optional
+        """
+        self._source = source
+        self._fetch = fetch
+        self._profiler = profiler
+        self._edition = edition
+        self._span = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._value = None
+        self._abandoned = False
+        self._thread = threading.Thread(target=self._run, name=f'fetch-{source}', daemon=True)
+
+    def _run(self):
+        value = None
+        try:
+            if self._profiler is not None:
+                with self._profiler.stage(f'fetch.{self._source}'):
+                    value = self._fetch(self._span)
+            else:
+                value = self._fetch(self._span)
+        except CircuitOpenError as exc:
+            logging.warning(exc)
+            self._span.outcome('skipped')
+        except Exception as exc:
+            logging.exception(exc)
+            self._span.outcome('error')
+        with self._lock:
+            if self._abandoned:
+                logging.warning(f'Late {self._source} fetch discarded')
+                return
+            self._value = value
+            self._span.stop()
+            self._done.set()
+
+    def start(self):
+        """
+        Start fetching
+        """
+        self._span = Span(f'fetch.{self._source}', self._edition)
+        self._thread.start()
+
+    def wait(self, timeout: float):
+        """
+        Wait for the fetched data, giving up on the source once the timeout is over
+        :param timeout: Seconds
+        :return: fetched data, None if the fetch failed or timed out
+        """
+        self._done.wait(max(timeout, 0))
+        with self._lock:
+            if not self._done.is_set():
+                self._abandoned = True
+                self._span.stop()
+                self._span.outcome('timeout')
+                logging.error(f'Fetching {self._source} took more than its budget')
+            return self._value
+
+    def span(self) -> Span:
+        """
+        Get the span of the fetch
+        :return: Span
+        """
+        return self._span
+
+
+class Deadline:
+    """Deadline of an edition and latency budget of every source"""
+    def __init__(self, seconds: float = DEFAULT_DEADLINE, budgets: dict = None):
+        """
+        Constructor for a deadline, started at once
+        :param seconds: Time allowed to the whole edition
+        :param budgets: Seconds allowed to each source, DEFAULT_BUDGETS if not given
+        """
+        self._end = time.monotonic() + seconds
+        self._budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+
+    def remaining(self) -> float:
+        """
+        Get the time left before the deadline
+        :return: seconds, negative once passed
+        """
+        return self._end - time.monotonic()
+
+    def budget(self, source: str) -> float:
+        """
+        Get the time a source may still take
+        :param source: Source name
+        :return: seconds, capped by the deadline
+        """
+        return max(min(self._budgets[source], self.remaining()), 0)
+
+    def wait_timeout(self, source: str, started: float) -> float:
+        """
+        Get the time left to a fetch of a source
+        :param source: Source name
+        :param started: time.monotonic() value when the fetch started
+        :return: seconds, negative once the budget or the deadline is passed
+        """
+        return min(self._budgets[source] - (time.monotonic() - started), self.remaining())
+
+    def upload_timeout(self) -> float:
+        """
+        Get the socket timeout of the upload
+        :return: seconds
+        """
+        return max(self.remaining(), MIN_UPLOAD_TIMEOUT)
+
+    def fetch(self, fetches: dict, metrics, profiler=None, concurrent: bool = True,
+              edition: str = None) -> dict:
+        """
+        Fetch sources within their budget, the late ones are abandoned
+        :param fetches: Dictionary of source name to function receiving the Span and returning data
+        :param metrics: RunMetrics receiving one span per source
+        :param profiler: Profiler of the stages, optional
+        :param concurrent: Fetch every source at once, else one after the other
+        :param edition: Edition name of the spans, optional
+        :return: dictionary of source name to fetched data, None for failed or late sources
+        """
+        started = time.monotonic()
+        sources = {source: SourceFetch(source, fetch, profiler, edition)
+                   for source, fetch in fetches.items()}
+        values = {}
+        if concurrent:
+            for source_fetch in sources.values():
+                source_fetch.start()
+        for source, source_fetch in sources.items():
+            if not concurrent:
+                started = time.monotonic()
+                source_fetch.start()
+            values[source] = source_fetch.wait(self.wait_timeout(source, started))
+            metrics.add(source_fetch.span())
+        return values
@@ -2,6 +2,8 @@
 
 import json
 import datetime
+import functools
+import os
 
 
 class Ephemeris:
@@ -48,11 +50,21 @@ class Ephemeris:
         return self.get_ephemeris_for(now.month, now.day)
 
 
+@functools.lru_cache(maxsize=None)
+def load_ephemeris(json_path: str) -> Ephemeris:
+    """
+    Load an ephemeris file once and share it between editions
+    :param json_path: Path to the ephemeris json file
+    :return: Ephemeris
+    """
+    return Ephemeris(json_path)
+
+
 def main():
     """
     Examples for using ephemeris
     """
-    ephemeris = Ephemeris('data\\ephemeris-fr.json')
+    ephemeris = Ephemeris(os.path.join('data', 'ephemeris-fr.json'))
     print(ephemeris.get_ephemeris_for(3, 18))
     print(ephemeris.get_today_ephemeris())
     try:
@@ -0,0 +1,401 @@
+"""Local stand-in CalDAV, DarkSky, quote and FTP servers serving fixture data"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import fixtures
+
+DAV_ROOT = '/dav/'
+PRINCIPAL = '/dav/principal/'
+CALENDAR_HOME = '/dav/calendars/'
+
+
+class Conditions:
+    """Network conditions applied by a fake server to every request"""
+    def __init__(self, latency: float = 0., jitter: float = 0., error_rate: float = 0.,
+                 bandwidth: int = 0, seed: int = None):
+        """
+        Constructor for network conditions
+        :param latency: Delay before answering, in seconds
+        :param jitter: Maximum random deviation of the delay, in seconds
+        :param error_rate: Probability between 0 and 1 of answering with an error
+        :param bandwidth: Maximum bytes per second sent, 0 for unlimited
+        :param seed: Random seed, optional
+        """
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._bandwidth = bandwidth
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """
+        Wait for the configured latency and jitter
+        """
+        with self._lock:
+            deviation = self._rng.uniform(-self._jitter, self._jitter)
+        time.sleep(max(0., self._latency + deviation))
+
+    def should_fail(self) -> bool:
+        """
+        Draw whether the current request fails
+        :return: bool
+        """
+        with self._lock:
+            return self._rng.random() < self._error_rate
+
+    def send(self, write, data: bytes):
+        """
+        Send data, throttled to the configured bandwidth
+        :param write: Function writing bytes to the client
+        :param data: Data to send
+        """
+        if not self._bandwidth:
+            write(data)
+            return
+        chunk_size = max(1, self._bandwidth // 10)
+        for start in range(0, len(data), chunk_size):
+            write(data[start:start + chunk_size])
+            time.sleep(len(data[start:start + chunk_size]) / self._bandwidth)
+
+    def receive(self, read) -> bytes:
+        """
+        Receive data until the end of stream, throttled to the configured bandwidth
+        :param read: Function reading at most n bytes from the client
+        :return: received data
+        """
+        chunks = []
+        chunk_size = max(1, self._bandwidth // 10) if self._bandwidth else 65536
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if self._bandwidth:
+                time.sleep(len(chunk) / self._bandwidth)
+        return b''.join(chunks)
+
+
+class FixtureData:
+    """Data served by the fake HTTP server"""
+    def __init__(self, events_per_calendar: int = 50, seed: int = 0):
+        """
+        Constructor for fixture data
+        :param events_per_calendar: Number of events in each calendar
+        :param seed: Random seed of the fixtures
+        """
+        self.calendars = {name: fixtures.make_calendar(events_per_calendar, seed + index)
+                          for index, name in enumerate(fixtures.CALENDAR_NAMES)}
+        self.forecast = json.dumps(fixtures.make_darksky_response(seed)).encode()
+        self.qotd = json.dumps(['Le temps est un grand maître.', 'Pierre Corneille']).encode()
+        self.ron = json.dumps(['There has never been a sadness that can’t be cured by breakfast food.'],
+                              ensure_ascii=False).encode()
+
+
+def _multistatus(responses: list) -> bytes:
+    body = ''.join(f'<d:response><d:href>{href}</d:href><d:propstat><d:prop>{props}</d:prop>'
+                   f'<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>'
+                   for href, props in responses)
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<d:multistatus xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+            f'{body}</d:multistatus>').encode()
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """Answer DarkSky, quote and CalDAV requests from fixture data"""
+    protocol_version = 'HTTP/1.1'
+    data = None
+    conditions = Conditions()
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+    def _reply(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.command == 'OPTIONS':
+            self.send_header('DAV', '1, 2, 3, calendar-access')
+            self.send_header('Allow', 'OPTIONS, GET, PROPFIND, REPORT')
+        self.end_headers()
+        self.conditions.send(self.wfile.write, body)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request_body = self.rfile.read(length) if length else b''
+        self.conditions.delay()
+        if self.conditions.should_fail():
+            self._reply(503, b'{"error": "injected failure"}')
+            return
+
+        path = self.path.split('?')[0]
+        if self.command == 'GET' and path.startswith('/forecast/'):
+            self._reply(200, self.data.forecast)
+        elif self.command == 'GET' and path == '/qotd':
+            self._reply(200, self.data.qotd)
+        elif self.command == 'GET' and path == '/ron':
+            self._reply(200, self.data.ron)
+        elif self.command == 'OPTIONS':
+            self._reply(200, b'')
+        elif self.command == 'PROPFIND' and path.startswith(DAV_ROOT):
+            self._reply(207, self._propfind(path), 'application/xml; charset=utf-8')
+        elif self.command == 'REPORT' and path.startswith(CALENDAR_HOME):
+            self._reply(207, self._report(path, request_body), 'application/xml; charset=utf-8')
+        else:
+            self._reply(404, b'{"error": "not found"}')
+
+    def _calendar_names(self) -> list:
+        return list(self.data.calendars)
+
+    def _calendar_props(self, index: int) -> str:
+        name = escape(self._calendar_names()[index])
+        return (f'<d:displayname>{name}</d:displayname>'
+                '<d:resourcetype><d:collection/><c:calendar/></d:resourcetype>'
+                '<c:supported-calendar-component-set><c:comp name="VEVENT"/>'
+                '</c:supported-calendar-component-set>')
+
+    def _propfind(self, path: str) -> bytes:
+        principal_props = (f'<d:current-user-principal><d:href>{PRINCIPAL}</d:href></d:current-user-principal>'
+                           f'<c:calendar-home-set><d:href>{CALENDAR_HOME}</d:href></c:calendar-home-set>'
+                           '<d:displayname>Fake user</d:displayname>')
+        if path in (DAV_ROOT, PRINCIPAL):
+            return _multistatus([(path, principal_props + '<d:resourcetype><d:principal/></d:resourcetype>')])
+
+        if path == CALENDAR_HOME:
+            responses = [(path, '<d:resourcetype><d:collection/></d:resourcetype>')]
+            if self.headers.get('Depth', '0') != '0':
+                responses += [(f'{CALENDAR_HOME}{index}/', self._calendar_props(index))
+                              for index in range(len(self._calendar_names()))]
+            return _multistatus(responses)
+
+        match = re.fullmatch(f'{CALENDAR_HOME}(\\d+)/', path)
+        if match and int(match.group(1)) < len(self._calendar_names()):
+            return _multistatus([(path, self._calendar_props(int(match.group(1))))])
+        return _multistatus([])
+
+    def _report(self, path: str, request_body: bytes) -> bytes:
+        match = re.fullmatch(f'{CALENDAR_HOME}(\\d+)/', path)
+        if not match or int(match.group(1)) >= len(self._calendar_names()):
+            return _multistatus([])
+        objects = self.data.calendars[self._calendar_names()[int(match.group(1))]]
+        hrefs = re.findall(rb'<(?:\w+:)?href>([^<]+)</(?:\w+:)?href>', request_body)
+        if hrefs:
+            wanted = {href.decode() for href in hrefs}
+            indexes = [index for index in range(len(objects)) if f'{path}{index}.ics' in wanted]
+        else:
+            indexes = range(len(objects))
+        return _multistatus([(f'{path}{index}.ics',
+                              f'<d:getetag>"{index}"</d:getetag>'
+                              f'<c:calendar-data>{escape(objects[index])}</c:calendar-data>')
+                             for index in indexes])
+
+    do_GET = _handle
+    do_OPTIONS = _handle
+    do_PROPFIND = _handle
+    do_REPORT = _handle
+
+
+class FakeFtpHandler(socketserver.StreamRequestHandler):
+    """Accept uploads with the subset of FTP used by ftplib.storbinary and mkd"""
+    conditions = Conditions()
+    uploads = {}
+    uploads_lock = threading.Lock()
+
+    def _send(self, line: str):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        self._send('220 Fake FTP ready')
+        passive = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command, _, argument = line.decode().strip().partition(' ')
+            command = command.upper()
+            if command == 'USER':
+                self._send('331 Password required')
+            elif command == 'PASS':
+                self._send('230 Logged in')
+            elif command in ('CWD', 'TYPE'):
+                self._send('250 OK' if command == 'CWD' else '200 OK')
+            elif command == 'PWD':
+                self._send('257 "/"')
+            elif command == 'MKD':
+                self._send(f'257 "{argument}" created')
+            elif command in ('PASV', 'EPSV'):
+                passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                passive.bind((self.server.server_address[0], 0))
+                passive.listen(1)
+                port = passive.getsockname()[1]
+                if command == 'EPSV':
+                    self._send(f'229 Entering Extended Passive Mode (|||{port}|)')
+                else:
+                    host = self.server.server_address[0].replace('.', ',')
+                    self._send(f'227 Entering Passive Mode ({host},{port >> 8},{port & 0xff})')
+            elif command == 'STOR' and passive is not None:
+                self._send('150 Ready to receive')
+                connection, _ = passive.accept()
+                with connection:
+                    data = self.conditions.receive(connection.recv)
+                passive.close()
+                passive = None
+                self.conditions.delay()
+                if self.conditions.should_fail():
+                    self._send('451 Injected failure')
+                    continue
+                with self.uploads_lock:
+                    self.uploads[argument] = self.uploads.get(argument, 0) + len(data)
+                self._send('226 Transfer complete')
+            elif command == 'QUIT':
+                self._send('221 Bye')
+                break
+            else:
+                self._send('502 Command not implemented')
+
+
+class ThreadingFtpServer(socketserver.ThreadingTCPServer):
+    """Threaded TCP server for the fake FTP"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeUpstreams:
+    """Run the fake HTTP and FTP servers in background threads"""
+    def __init__(self, host: str = '127.0.0.1', http_port: int = 0, ftp_port: int = 0,
+                 data: FixtureData = None, http_conditions: Conditions = None,
+                 ftp_conditions: Conditions = None):
+        """
+        Constructor for the fake upstreams, port 0 picks a free port
+        :param host: Address the servers listen on
+        :param http_port: Port of the DarkSky, quote and CalDAV server
+        :param ftp_port: Port of the FTP server
+        :param data: Fixture data, generated if not provided
+        :param http_conditions: Network conditions of the HTTP server
+        :param ftp_conditions: Network conditions of the FTP server
+        """
+        http_handler = type('Handler', (FakeUpstreamHandler,),
+                            {'data': data or FixtureData(),
+                             'conditions': http_conditions or Conditions()})
+        ftp_handler = type('Handler', (FakeFtpHandler,),
+                           {'conditions': ftp_conditions or Conditions(), 'uploads': {}})
+        self._http = ThreadingHTTPServer((host, http_port), http_handler)
+        self._http.daemon_threads = True
+        self._ftp = ThreadingFtpServer((host, ftp_port), ftp_handler)
+        self._ftp_handler = ftp_handler
+        self._threads = []
+
+    def start(self):
+        """
+        Start serving in background threads
+        """
+        for server in (self._http, self._ftp):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the servers
+        """
+        for server in (self._http, self._ftp):
+            server.shutdown()
+            server.server_close()
+
+    def http_url(self) -> str:
+        """
+        Get the base URL of the HTTP server
+        :return: url without trailing slash
+        """
+        host, port = self._http.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def ftp_address(self) -> tuple:
+        """
+        Get the address of the FTP server
+        :return: (host, port)
+        """
+        return self._ftp.server_address[:2]
+
+    def uploads(self) -> dict:
+        """
+        Get the bytes received by the FTP server per file name
+        :return: dictionary
+        """
+        return dict(self._ftp_handler.uploads)
+
+    def config_text(self) -> str:
+        """
+        Get a Daily Commute configuration pointing at the fake servers
+        :return: INI text
+        """
+        ftp_host, ftp_port = self.ftp_address()
+        return '\n'.join(['[TheDailyCommute]', 'darksky_key=fake', 'lat=48.8566', 'lon=2.3522',
+                          'fastmail_usr=fake', 'fastmail_pwd=fake',
+                          f'fastmail_url={self.http_url()}{DAV_ROOT}',
+                          f'ftp_url={ftp_host}', 'ftp_usr=fake', 'ftp_pwd=fake', 'ftp_dir=/',
+                          '', '[Endpoints]', f'darksky_url={self.http_url()}/forecast/',
+                          f'qotd_url={self.http_url()}/qotd', f'ron_url={self.http_url()}/ron',
+                          f'ftp_port={ftp_port}', ''])
+
+
+def add_condition_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the network condition options to a command line parser
+    :param parser: Argument parser
+    """
+    parser.add_argument('--latency', type=float, default=0., help='Delay per request in seconds')
+    parser.add_argument('--jitter', type=float, default=0., help='Maximum delay deviation in seconds')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.,
+                        help='Probability of failing a request, between 0 and 1')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Bytes per second, 0 for unlimited')
+    parser.add_argument('--events', type=int, default=50, help='Number of events per calendar')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the fixtures')
+
+
+def conditions_from(args) -> Conditions:
+    """
+    Build network conditions from parsed command line options
+    :param args: Parsed arguments
+    :return: conditions
+    """
+    return Conditions(args.latency, args.jitter, args.error_rate, args.bandwidth, args.seed)
+
+
+def main():
+    """
+    Serve the fake upstreams until interrupted
+    """
+    logging.getLogger().setLevel(logging.INFO)
+    logging.basicConfig(format='[%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description='Run local stand-in upstream servers')
+    parser.add_argument('--host', default='127.0.0.1', help='Listening address')
+    parser.add_argument('--http-port', dest='http_port', type=int, default=8080, help='HTTP port')
+    parser.add_argument('--ftp-port', dest='ftp_port', type=int, default=2121, help='FTP port')
+    add_condition_arguments(parser)
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(args.host, args.http_port, args.ftp_port,
+                              FixtureData(args.events, args.seed),
+                              conditions_from(args), conditions_from(args))
+    upstreams.start()
+    print(upstreams.config_text())
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstreams.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Generate synthetic calendars and DarkSky responses for benchmarks and load tests"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+
+CALENDAR_NAMES = ('Agenda', 'Work', 'Sports', 'Jours fériés en France')
+TIMEZONES = ('Europe/Paris', 'Europe/London', 'America/New_York')
+ICONS = ('clear-day', 'clear-night', 'rain', 'snow', 'sleet', 'wind', 'fog', 'cloudy',
+         'partly-cloudy-day', 'partly-cloudy-night')
+
+VTIMEZONE = {
+    'Europe/Paris': ('+0100', '+0200', 'CET', 'CEST'),
+    'Europe/London': ('+0000', '+0100', 'GMT', 'BST'),
+    'America/New_York': ('-0500', '-0400', 'EST', 'EDT'),
+}
+
+
+def make_vtimezone(tz_id: str) -> list:
+    """
+    Write the VTIMEZONE block of a timezone, as sent by Fastmail
+    :param tz_id: Timezone id
+    :return: list of ICS lines
+    """
+    standard, daylight, standard_name, daylight_name = VTIMEZONE[tz_id]
+    return ['BEGIN:VTIMEZONE', f'TZID:{tz_id}',
+            'BEGIN:DAYLIGHT', f'TZOFFSETFROM:{standard}', f'TZOFFSETTO:{daylight}',
+            f'TZNAME:{daylight_name}', 'DTSTART:19700329T020000',
+            'RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU', 'END:DAYLIGHT',
+            'BEGIN:STANDARD', f'TZOFFSETFROM:{daylight}', f'TZOFFSETTO:{standard}',
+            f'TZNAME:{standard_name}', 'DTSTART:19701025T030000',
+            'RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU', 'END:STANDARD',
+            'END:VTIMEZONE']
+
+
+def make_vevent(rng: random.Random, index: int, day: datetime.date, spread_days: int = 30) -> list:
+    """
+    Write a VEVENT, either all-day, with a TZID or in UTC, around a day
+    :param rng: Random generator
+    :param index: Event index, used for the UID
+    :param day: Day around which the event happens
+    :param spread_days: Maximum distance in days between the event and the day
+    :return: list of ICS lines, VTIMEZONE excluded
+    """
+    start_day = day + datetime.timedelta(days=rng.randint(-spread_days, spread_days))
+    lines = ['BEGIN:VEVENT', f'UID:{index:08d}-{rng.getrandbits(64):016x}@tdc.test',
+             f'DTSTAMP:{start_day:%Y%m%d}T000000Z',
+             f'SUMMARY:Event {index} {rng.choice(("Réunion", "Footing", "Dentiste", "Déjeuner"))}']
+    if rng.random() < 0.5:
+        lines.append(f'LOCATION:Salle {rng.randint(1, 99)}')
+
+    kind = rng.random()
+    if kind < 0.2:
+        end_day = start_day + datetime.timedelta(days=rng.randint(1, 3))
+        lines += [f'DTSTART;VALUE=DATE:{start_day:%Y%m%d}', f'DTEND;VALUE=DATE:{end_day:%Y%m%d}']
+    else:
+        start = datetime.datetime.combine(start_day, datetime.time(rng.randint(0, 22),
+                                                                   rng.choice((0, 15, 30, 45))))
+        end = start + datetime.timedelta(minutes=rng.choice((15, 30, 60, 90, 120, 600)))
+        if kind < 0.9:
+            tz_id = rng.choice(TIMEZONES)
+            lines += [f'DTSTART;TZID={tz_id}:{start:%Y%m%dT%H%M%S}',
+                      f'DTEND;TZID={tz_id}:{end:%Y%m%dT%H%M%S}']
+        else:
+            lines += [f'DTSTART:{start:%Y%m%dT%H%M%S}Z', f'DTEND:{end:%Y%m%dT%H%M%S}Z']
+    lines.append('END:VEVENT')
+    return lines
+
+
+def _tz_id_of(vevent: list) -> str:
+    for line in vevent:
+        if line.startswith('DTSTART;TZID='):
+            return line[len('DTSTART;TZID='):].split(':')[0]
+    return None
+
+
+def make_calendar(count: int, seed: int = 0, day: datetime.date = None) -> list:
+    """
+    Generate calendar objects as returned by CalDAV, one VCALENDAR per event
+    :param count: Number of events
+    :param seed: Random seed, the same seed gives the same calendar
+    :param day: Day around which events happen, today by default
+    :return: list of ICS strings
+    """
+    rng = random.Random(seed)
+    day = day or datetime.date.today()
+    objects = []
+    for index in range(count):
+        vevent = make_vevent(rng, index, day)
+        tz_id = _tz_id_of(vevent)
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//TheDailyCommute//Fixtures//EN']
+        if tz_id is not None:
+            lines += make_vtimezone(tz_id)
+        lines += vevent + ['END:VCALENDAR']
+        objects.append('\n'.join(lines) + '\n')
+    return objects
+
+
+def make_ics(count: int, seed: int = 0, day: datetime.date = None) -> str:
+    """
+    Generate a single ICS file holding many events
+    :param count: Number of events
+    :param seed: Random seed
+    :param day: Day around which events happen, today by default
+    :return: ICS text
+    """
+    rng = random.Random(seed)
+    day = day or datetime.date.today()
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//TheDailyCommute//Fixtures//EN']
+    for tz_id in TIMEZONES:
+        lines += make_vtimezone(tz_id)
+    for index in range(count):
+        lines += make_vevent(rng, index, day)
+    lines.append('END:VCALENDAR')
+    return '\n'.join(lines) + '\n'
+
+
+def split_ics(ics: str) -> list:
+    """
+    Split an ICS file into VEVENT texts, the unit parsed by get_events.Event
+    :param ics: ICS text
+    :return: list of VEVENT strings
+    """
+    events = []
+    start = ics.find('BEGIN:VEVENT')
+    while start != -1:
+        end = ics.index('END:VEVENT', start) + len('END:VEVENT')
+        events.append(ics[start:end])
+        start = ics.find('BEGIN:VEVENT', end)
+    return events
+
+
+def make_darksky_response(seed: int = 0, start: datetime.datetime = None,
+                          minutes: int = 61, hours: int = 49) -> dict:
+    """
+    Generate a DarkSky forecast response with full minutely and hourly blocks
+    :param seed: Random seed
+    :param start: Time of the forecast, now by default
+    :param minutes: Number of minutely data points
+    :param hours: Number of hourly data points
+    :return: decoded JSON response
+    """
+    rng = random.Random(seed)
+    start = (start or datetime.datetime.now()).replace(second=0, microsecond=0)
+    timestamp = int(start.timestamp())
+    base_temp = rng.uniform(-5, 25)
+
+    def point(time_offset: int, temp: float) -> dict:
+        precip = round(rng.random(), 2)
+        return {'time': timestamp + time_offset, 'summary': 'Nuageux', 'icon': rng.choice(ICONS),
+                'precipIntensity': round(precip * 2, 4), 'precipProbability': precip,
+                'precipType': 'rain', 'temperature': round(temp, 2),
+                'apparentTemperature': round(temp - 1.5, 2), 'dewPoint': round(temp - 4, 2),
+                'humidity': round(rng.uniform(.3, 1), 2), 'pressure': round(rng.uniform(990, 1030), 1),
+                'windSpeed': round(rng.uniform(0, 15), 2), 'windGust': round(rng.uniform(0, 25), 2),
+                'windBearing': rng.randint(0, 359), 'cloudCover': round(rng.random(), 2),
+                'uvIndex': rng.randint(0, 8), 'visibility': 16.09, 'ozone': round(rng.uniform(250, 350), 1)}
+
+    hourly = [point(3600 * hour, base_temp + rng.uniform(-4, 4)) for hour in range(hours)]
+    minutely = [{'time': timestamp + 60 * minute, 'precipIntensity': round(rng.random(), 4),
+                 'precipProbability': round(rng.random(), 2)} for minute in range(minutes)]
+    return {'latitude': 48.8566, 'longitude': 2.3522, 'timezone': 'Europe/Paris', 'offset': 1,
+            'currently': point(0, base_temp),
+            'minutely': {'summary': 'Pluie légère', 'icon': 'rain', 'data': minutely},
+            'hourly': {'summary': 'Pluie dans la journée', 'icon': 'rain', 'data': hourly},
+            'flags': {'sources': ['meteofrance'], 'units': 'si'}}
+
+
+def main():
+    """
+    Write fixture files to a directory
+    """
+    parser = argparse.ArgumentParser(description='Generate Daily Commute fixtures')
+    parser.add_argument('out_dir', help='Directory receiving the fixture files')
+    parser.add_argument('--sizes', dest='sizes', default='100,10000,100000',
+                        help='Comma separated numbers of events of the ICS corpora')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for size in (int(size) for size in args.sizes.split(',')):
+        with open(os.path.join(args.out_dir, f'calendar-{size}.ics'), 'w', encoding='utf-8') as file:
+            file.write(make_ics(size, args.seed))
+    with open(os.path.join(args.out_dir, 'darksky.json'), 'w', encoding='utf-8') as file:
+        json.dump(make_darksky_response(args.seed), file)
+
+
+if __name__ == '__main__':
+    main()
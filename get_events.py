@@ -1,10 +1,44 @@
-import caldav
-from requests.auth import HTTPBasicAuth
+import collections
+import concurrent.futures
 import datetime
-import dateutil
+import functools
 import locale
 import logging
 import argparse
+import threading
+
+FRENCH_LOCALES = ('fr-FR', 'fr_FR.UTF-8', 'fr_FR')
+CALDAV_NS = 'urn:ietf:params:xml:ns:caldav'
+# Same query as caldav's Calendar.events(), every VEVENT with its data
+CALENDAR_QUERY = ('<?xml version="1.0" encoding="utf-8"?>'
+                  f'<C:calendar-query xmlns:D="DAV:" xmlns:C="{CALDAV_NS}">'
+                  '<D:prop><D:getetag/><C:calendar-data/></D:prop>'
+                  '<C:filter><C:comp-filter name="VCALENDAR"><C:comp-filter name="VEVENT"/>'
+                  '</C:comp-filter></C:filter></C:calendar-query>')
+STREAM_CHUNK_SIZE = 16384
+# Events sent at once to a parsing process
+DEFAULT_PARSE_CHUNK = 2000
+
+
+@functools.lru_cache(maxsize=None)
+def _french_locale_name():
+    for name in FRENCH_LOCALES:
+        try:
+            locale.setlocale(locale.LC_ALL, name)
+            return name
+        except locale.Error:
+            continue
+    logging.warning('No French locale installed, dates are written with the current locale')
+    return None
+
+
+def use_french_locale():
+    """
+    Switch to the French locale for writing dates, keep the current locale if none is installed
+    """
+    name = _french_locale_name()
+    if name is not None:
+        locale.setlocale(locale.LC_ALL, name)
 
 
 class Event:
@@ -16,6 +50,7 @@ class Event:
 
     def __init__(self, data: str, type_):
         details = data.split('\n')
+        self._data = data
         self._summary = None
         self._location = None
         self._utc_start = None
@@ -27,8 +62,15 @@ class Event:
         self._date_end = None
         self._all_day = False
         self._type = type_
+        self._uid = None
+        self._recurrence_id = None
 
         for detail in details:
+            if detail.startswith('UID:') and self._uid is None:
+                # The first one, alarms can have their own
+                self._uid = detail[4:].strip()
+            if detail.startswith('RECURRENCE-ID'):
+                self._recurrence_id = detail.rpartition(':')[2].strip()
             if detail.startswith('SUMMARY:'):
                 self._summary = detail[8:]
             if detail.startswith('LOCATION:'):
@@ -80,10 +122,11 @@ class Event:
             self._get_utc_times()
 
     def _get_utc_times(self):
+        from dateutil import tz as dateutil_tz
         if self._utc_start is not None and self._utc_end is not None:
             return None
-        from_zone = dateutil.tz.gettz(self._tz_id)
-        to_zone = dateutil.tz.tzutc()
+        from_zone = dateutil_tz.gettz(self._tz_id)
+        to_zone = dateutil_tz.tzutc()
         start = self._local_start
         end = self._local_end
         start = start.replace(tzinfo=from_zone)
@@ -91,9 +134,53 @@ class Event:
         self._utc_start = start.astimezone(to_zone)
         self._utc_end = end.astimezone(to_zone)
 
+    def to_record(self) -> tuple:
+        """
+        Convert the parsed event to a tuple of plain values, cheap to send between processes
+        :return: tuple read by from_record
+        """
+        return (self._data, self._type, self._summary, self._location, self._utc_start, self._utc_end,
+                self._date_start, self._date_end, self._all_day, self._uid, self._recurrence_id)
+
+    @staticmethod
+    def from_record(record: tuple):
+        """
+        Rebuild an event from a record without parsing it again
+        :param record: Tuple written by to_record
+        :return: Event
+        """
+        event = Event.__new__(Event)
+        (event._data, event._type, event._summary, event._location, event._utc_start, event._utc_end,
+         event._date_start, event._date_end, event._all_day, event._uid, event._recurrence_id) = record
+        event._local_start = event._local_end = event._tz_id = None
+        return event
+
     def is_all_day_event(self):
         return self._all_day
 
+    def data(self):
+        return self._data
+
+    def uid(self):
+        return self._uid
+
+    def recurrence_id(self):
+        return self._recurrence_id
+
+    def dedup_keys(self):
+        """
+        Get the keys identifying copies of this event: UID and RECURRENCE-ID if there is a UID,
+        else a fingerprint of the normalised summary, start and end. Two events with different UIDs
+        are never copies, even with the same title and time.
+        :return: list of hashable keys
+        """
+        if self._uid is not None:
+            return [('uid', self._uid, self._recurrence_id)]
+        start, end = self.get_start(), self.get_end()
+        return [('fingerprint', ' '.join(self.summary().casefold().split()),
+                 start.replace(tzinfo=None) if start is not None else None,
+                 end.replace(tzinfo=None) if end is not None else None)]
+
     def type(self):
         return self._type
 
@@ -112,6 +199,11 @@ class Event:
             return self._date_start
         return self._utc_start
 
+    def get_end(self):
+        if self.is_all_day_event():
+            return self._date_end
+        return self._utc_end
+
     def is_happening_today(self):
         now = datetime.datetime.now()
         day_start = datetime.datetime(year=now.year, month=now.month, day=now.day, hour=0, minute=0, second=1)
@@ -122,8 +214,9 @@ class Event:
             min_end = day_end if day_end < self._date_end else self._date_end
             return max_start < min_end
 
-        from_zone = dateutil.tz.tzutc()
-        to_zone = dateutil.tz.tzlocal()
+        from dateutil import tz as dateutil_tz
+        from_zone = dateutil_tz.tzutc()
+        to_zone = dateutil_tz.tzlocal()
         day_start = day_start.replace(tzinfo=to_zone)
         day_end = day_end.replace(tzinfo=to_zone)
         utc_start = self._utc_start.replace(tzinfo=from_zone)
@@ -139,11 +232,12 @@ class Event:
         if self.is_all_day_event():
             return self.summary(), self.location(), ''
 
+        from dateutil import tz as dateutil_tz
         now = datetime.datetime.now()
         day_start = datetime.datetime(year=now.year, month=now.month, day=now.day, hour=0, minute=0, second=1)
         day_end = datetime.datetime(year=now.year, month=now.month, day=now.day, hour=23, minute=59, second=59)
-        from_zone = dateutil.tz.tzutc()
-        to_zone = dateutil.tz.tzlocal()
+        from_zone = dateutil_tz.tzutc()
+        to_zone = dateutil_tz.tzlocal()
         day_start = day_start.replace(tzinfo=to_zone)
         day_end = day_end.replace(tzinfo=to_zone)
         utc_start = self._utc_start.replace(tzinfo=from_zone)
@@ -151,7 +245,7 @@ class Event:
         cur_start = utc_start.astimezone(to_zone)
         cur_end = utc_end.astimezone(to_zone)
 
-        locale.setlocale(locale.LC_ALL, 'fr-FR')
+        use_french_locale()
         if cur_start < day_start:
             start_info = str(datetime.datetime.strftime(cur_start, '%A %d %B @ %H:%M'))
         else:
@@ -165,10 +259,11 @@ class Event:
         return self.summary(), self.location(), start_info + ' - ' + end_info
 
     def __lt__(self, other):
+        from dateutil import tz as dateutil_tz
         start = self.get_start()
         o_start = other.get_start()
-        start = start.replace(tzinfo=dateutil.tz.tzutc())
-        o_start = o_start.replace(tzinfo=dateutil.tz.tzutc())
+        start = start.replace(tzinfo=dateutil_tz.tzutc())
+        o_start = o_start.replace(tzinfo=dateutil_tz.tzutc())
         return start < o_start
 
     def __repr__(self):
@@ -178,14 +273,294 @@ class Event:
         return f'Event {self.summary()} @ {self.location()}'
 
 
+# Types of the calendars, first one wins when an event is in several calendars
+DEFAULT_TYPE_PRECEDENCE = (Event.WORK, Event.PERSO, Event.SPORT, Event.BIRTHDAY, Event.HOLIDAY)
+EVENT_TYPE_NAMES = {'perso': Event.PERSO, 'work': Event.WORK, 'sport': Event.SPORT,
+                    'birthday': Event.BIRTHDAY, 'holiday': Event.HOLIDAY}
+
+
+def parse_precedence(value: str) -> tuple:
+    """
+    Parse a comma separated list of event type names, e.g. 'work,perso'
+    :param value: Type names, the ones left out keep their default order after them
+    :return: tuple of event types
+    """
+    names = [name.strip().lower() for name in value.split(',') if name.strip()]
+    for name in names:
+        if name not in EVENT_TYPE_NAMES:
+            raise ValueError(f'Unknown event type "{name}", expect one of {", ".join(EVENT_TYPE_NAMES)}')
+    types = tuple(EVENT_TYPE_NAMES[name] for name in names)
+    return types + tuple(type_ for type_ in DEFAULT_TYPE_PRECEDENCE if type_ not in types)
+
+
+class EventIndex:
+    """Collapse the copies of an event found in several calendars with one hash lookup per event"""
+    def __init__(self, precedence=DEFAULT_TYPE_PRECEDENCE):
+        """
+        Constructor for the index
+        :param precedence: Event types, the copy of the first type is kept
+        """
+        self._rank = {type_: rank for rank, type_ in enumerate(precedence)}
+        self._events = []
+        self._slots = {}
+        self._duplicates = 0
+
+    def add(self, event: Event) -> bool:
+        """
+        Add an event, replacing its copy if it has precedence over it
+        :param event: Event
+        :return: True if the event is not a copy of an added one
+        """
+        keys = event.dedup_keys()
+        slot = next((self._slots[key] for key in keys if key in self._slots), None)
+        new = slot is None
+        if new:
+            slot = len(self._events)
+            self._events.append(event)
+        else:
+            self._duplicates += 1
+            if self._rank_of(event) < self._rank_of(self._events[slot]):
+                self._events[slot] = event
+        for key in keys:
+            self._slots.setdefault(key, slot)
+        return new
+
+    def _rank_of(self, event: Event) -> int:
+        return self._rank.get(event.type(), len(self._rank))
+
+    def events(self) -> list:
+        """
+        Get the deduplicated events
+        :return: list of events, in the order they were first added
+        """
+        return list(self._events)
+
+    def duplicates(self) -> int:
+        """
+        Get the number of collapsed copies
+        :return: count
+        """
+        return self._duplicates
+
+
+def deduplicate(events, precedence=DEFAULT_TYPE_PRECEDENCE) -> list:
+    """
+    Collapse the copies of events
+    :param events: Iterable of events
+    :param precedence: Event types, the copy of the first type is kept
+    :return: list of events
+    """
+    index = EventIndex(precedence)
+    for event in events:
+        index.add(event)
+    return index.events()
+
+
+def _parse_chunk(datas: list, type_) -> list:
+    return [event.to_record() for event in (Event(data, type_) for data in datas)
+            if event.is_happening_today()]
+
+
+def _chunked(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ParsePool:
+    """Processes parsing chunks of events, created once by the entry point and shared by its fetches"""
+    def __init__(self, workers: int):
+        """
+        Constructor for the pool, the processes start with the first chunk
+        :param workers: Number of processes
+        """
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def workers(self) -> int:
+        """
+        Get the number of processes
+        :return: count
+        """
+        return self._workers
+
+    def submit(self, function, *args):
+        """
+        Parse in a process, starting the processes if needed
+        :param function: Picklable function
+        :return: Future of the result
+        """
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Fetches run in threads, forking this process could copy a lock held by one of them
+                methods = multiprocessing.get_all_start_methods()
+                method = 'forkserver' if 'forkserver' in methods else 'spawn'
+                self._executor = ProcessPoolExecutor(self._workers, multiprocessing.get_context(method))
+            return self._executor.submit(function, *args)
+
+    def job(self):
+        """
+        Get a handle submitting the chunks of one fetch, which can be cancelled alone
+        :return: ParseJob
+        """
+        return ParseJob(self)
+
+    def shutdown(self):
+        """
+        Stop the processes once their chunks are parsed
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+class ParseJob:
+    """Chunks of one fetch parsed by a shared ParsePool"""
+    def __init__(self, pool: ParsePool):
+        """
+        Constructor for the job
+        :param pool: Pool parsing the chunks
+        """
+        self._pool = pool
+        self._futures = set()
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """
+        Parse in a process of the pool
+        :param function: Picklable function
+        :return: Future of the result
+        """
+        with self._lock:
+            if self._cancelled:
+                raise concurrent.futures.CancelledError('Event parsing cancelled')
+            future = self._pool.submit(function, *args)
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def cancel(self):
+        """
+        Drop the queued chunks of this fetch, e.g. once its deadline is over, and refuse new ones. The
+        chunk being parsed ends on its own, the chunks of the other fetches are left alone.
+        """
+        with self._lock:
+            self._cancelled = True
+            futures = list(self._futures)
+        if futures:
+            logging.warning(f'Cancelling {len(futures)} event chunk(s) of a late fetch')
+        for future in futures:
+            future.cancel()
+
+
+def parse_today_events(datas, type_, pool=None, chunk_size: int = DEFAULT_PARSE_CHUNK, in_flight: int = 8):
+    """
+    Parse events and keep the ones happening today
+    :param datas: Iterable of ICS texts
+    :param type_: Type of the events
+    :param pool: ParsePool or ParseJob parsing chunks of events, None to parse in this process
+    :param chunk_size: Number of events per chunk sent to the pool
+    :param in_flight: Number of chunks queued in the pool at once, bounds the memory
+    :return: generator of events, in the order of the texts
+    """
+    if pool is None:
+        for data in datas:
+            event = Event(data, type_)
+            if event.is_happening_today():
+                yield event
+        return
+
+    pending = collections.deque()
+    for chunk in _chunked(datas, chunk_size):
+        pending.append(pool.submit(_parse_chunk, chunk, type_))
+        while len(pending) > in_flight or (pending and pending[0].done()):
+            yield from map(Event.from_record, pending.popleft().result())
+    while pending:
+        yield from map(Event.from_record, pending.popleft().result())
+
+
+def stream_calendar_data(chunks):
+    """
+    Parse a CalDAV multistatus incrementally, dropping every response once read
+    :param chunks: Iterable of bytes of the response body
+    :return: generator of the calendar-data texts with LF line endings, each one yielded as soon as
+    its element ends
+    """
+    from xml.etree.ElementTree import XMLPullParser
+    parser = XMLPullParser(events=('start', 'end'))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for kind, element in parser.read_events():
+            if kind == 'start':
+                root = element if root is None else root
+            elif element.tag == f'{{{CALDAV_NS}}}calendar-data' and element.text:
+                # Some servers escape CR as &#13;, the parser expects bare LF line endings like
+                # caldav's vcal.fix leaves them
+                yield element.text.replace('\r\n', '\n').replace('\r', '\n')
+            elif element.tag == '{DAV:}response':
+                # The multistatus only holds finished responses
+                root.clear()
+    parser.close()
+
+
 class FastMailCalendar:
-    def __init__(self, username, pwd, discovery_url):
+    def __init__(self, username, pwd, discovery_url, timeout=30, precedence=DEFAULT_TYPE_PRECEDENCE,
+                 stream=True, parse_pool=None):
+        import caldav
+        from requests.auth import HTTPBasicAuth
         auth = HTTPBasicAuth(username=username, password=pwd)
-        client = caldav.DAVClient(discovery_url, auth=auth)
-        self._principal = client.principal()
+        self._client = caldav.DAVClient(discovery_url, auth=auth, timeout=timeout)
+        self._principal = self._client.principal()
+        self._stream = stream
+        # Only worth it for calendars of tens of thousands of events, see bench_commute
+        self._parse_pool = parse_pool
+        self._bytes_received = 0
+        self._events_parsed = 0
+        self._precedence = precedence
+        self._duplicates = 0
+
+    def _calendar_data(self, cal):
+        """
+        Get the ICS text of every event of a calendar, parsed while the response downloads
+        :param cal: caldav Calendar
+        :return: generator of strings
+        """
+        if not self._stream:
+            for event in cal.events():
+                self._bytes_received += len(event.data)
+                yield event.data
+            return
+
+        client = self._client
+        headers = {**client.headers, 'Depth': '1', 'Content-Type': 'application/xml; charset=utf-8'}
+        with client.session.request('REPORT', str(cal.url), data=CALENDAR_QUERY.encode(), headers=headers,
+                                    auth=client.auth, timeout=client.timeout, stream=True) as response:
+            response.raise_for_status()
+            yield from stream_calendar_data(self._count(response.iter_content(STREAM_CHUNK_SIZE)))
+
+    def _count(self, chunks):
+        for chunk in chunks:
+            self._bytes_received += len(chunk)
+            yield chunk
 
     def get_today_events(self):
-        events = []
+        import caldav
+        index = EventIndex(self._precedence)
         for cal in self._principal.calendars():
             prop = cal.get_properties([caldav.dav.DisplayName()])
             name = prop['{DAV:}displayname']
@@ -202,12 +577,25 @@ class FastMailCalendar:
                 continue
 
             logging.info(f'Processing calendar {name}')
-            for event in cal.events():
-                e = Event(event.data, t)
-                if e.is_happening_today():
+            for e in parse_today_events(self._count_events(self._calendar_data(cal)), t, self._parse_pool):
+                if index.add(e):
                     logging.info(f'{e.summary()} is happening today')
-                    events.append(e)
-        return sorted(events)
+        self._duplicates = index.duplicates()
+        return sorted(index.events())
+
+    def _count_events(self, datas):
+        for data in datas:
+            self._events_parsed += 1
+            yield data
+
+    def bytes_received(self):
+        return self._bytes_received
+
+    def events_parsed(self):
+        return self._events_parsed
+
+    def duplicates(self):
+        return self._duplicates
 
 
 def main():
@@ -218,13 +606,29 @@ def main():
     parser.add_argument('-u', '--user', dest='usr', required=True, help='User login')
     parser.add_argument('-p', '--password', dest='pwd', required=True, help='User password')
     parser.add_argument('--url', dest='url', required=True, help='CalDAV discovery URL')
+    parser.add_argument('--profile', dest='profile', metavar='DIR',
+                        help='Write a cProfile dump per stage to DIR and print the hot spots')
+    parser.add_argument('--no-stream', dest='stream', action='store_false',
+                        help='Let caldav download whole calendars before parsing them')
+    parser.add_argument('--parse-workers', dest='parse_workers', type=int, default=0,
+                        help='Parse the events in this many processes, for very large calendars')
     args = parser.parse_args()
-    my_calendar = FastMailCalendar(username=args.usr, pwd=args.pwd, discovery_url=args.url)
-
-    events = my_calendar.get_today_events()
+    from profiling import Profiler
+    profiler = Profiler(args.profile)
+    parse_pool = ParsePool(args.parse_workers) if args.parse_workers > 0 else None
+    with profiler.stage('connect'):
+        my_calendar = FastMailCalendar(username=args.usr, pwd=args.pwd, discovery_url=args.url,
+                                       stream=args.stream, parse_pool=parse_pool)
+
+    with profiler.stage('events'):
+        events = my_calendar.get_today_events()
+    if parse_pool is not None:
+        parse_pool.shutdown()
     for event in events:
         s, l, t = event.get_display_strings()
         print(s, l, t)
+    if profiler.enabled():
+        print(profiler.summary())
 
 
 if __name__ == '__main__':
@@ -1,8 +1,8 @@
 """Retrieve quotes from different services"""
-import urllib.request
 import logging
 import json
-import wikiquote
+
+RON_SWANSON_URL = 'https://ron-swanson-quotes.herokuapp.com/v2/quotes'
 
 
 class Quote:
@@ -43,12 +43,20 @@ class Quote:
         return len(self.text()) > 0 or len(self.author()) > 0
 
 
-def get_quote_of_the_day(lang: str = 'fr') -> Quote:
+def get_quote_of_the_day(lang: str = 'fr', url: str = None, timeout: float = 30) -> Quote:
     """
     Get the quote of the day from Wikiquote
     :param lang: Language parameters, can be 'en', 'fr', 'it', 'de' or 'es'
+    :param url: Endpoint returning a [text, author] JSON list, used instead of Wikiquote if set
+    :param timeout: Socket timeout in seconds of the endpoint, Wikiquote has none
     :return: Quote, can be empty
     """
+    if url is not None:
+        import urllib.request
+        with urllib.request.urlopen(url, timeout=timeout) as request:
+            data = json.loads(request.read())
+            return Quote(data[0], data[1])
+    import wikiquote
     try:
         qotd = wikiquote.quote_of_the_day(lang)
         return Quote(qotd[0], qotd[1])
@@ -57,16 +65,17 @@ def get_quote_of_the_day(lang: str = 'fr') -> Quote:
         return Quote('', '')
 
 
-def get_ron_swanson_quote() -> Quote:
+def get_ron_swanson_quote(url: str = RON_SWANSON_URL, timeout: float = 30) -> Quote:
     """
     Get a quote from Ron Swanson
-    :return: Quote, can be empty
+    :param url: Ron Swanson quotes endpoint
+    :param timeout: Socket timeout in seconds
+    :return: Quote
     """
-    url = 'https://ron-swanson-quotes.herokuapp.com/v2/quotes'
-    with urllib.request.urlopen(url) as request:
+    import urllib.request
+    with urllib.request.urlopen(url, timeout=timeout) as request:
         if request.getcode() != 200:
-            logging.error(f'Failed to reach DarkSky, error code = {request.getcode()}')
-            return Quote('', '')
+            raise RuntimeError(f'Failed to reach the Ron Swanson quotes, error code = {request.getcode()}')
         data = json.loads(request.read())
         return Quote(data[0], 'Ron Swanson')
 
@@ -80,11 +89,10 @@ def main():
         print(qotd)
     else:
         print('Quote of the day unreachable')
-    quote = get_ron_swanson_quote()
-    if quote:
-        print(quote)
-    else:
-        print('Ron Swanson is unavailable')
+    try:
+        print(get_ron_swanson_quote())
+    except (OSError, RuntimeError, ValueError) as exc:
+        print(f'Ron Swanson is unavailable: {exc}')
 
     quote = Quote('', '')
     if quote:
@@ -2,15 +2,20 @@
 
 import logging
 import argparse
-import urllib.request
 import json
+from array import array
 from enum import Enum
 
+DARKSKY_URL = 'https://api.darksky.net/forecast/'
+# Hours of the hourly forecast kept for the timeline
+TIMELINE_HOURS = 24
+
 
 class DarkSkyApi:
-    """Store the DarkSky API key"""
-    def __init__(self, key: str):
+    """Store the DarkSky API key and endpoint"""
+    def __init__(self, key: str, url: str = DARKSKY_URL):
         self._key = key
+        self._url = url
 
     def key(self, k: str = None) -> str:
         """
@@ -22,6 +27,13 @@ class DarkSkyApi:
             self._key = k
         return self._key
 
+    def url(self) -> str:
+        """
+        Get the forecast endpoint, the key and location are appended to it
+        :return: url ending with a slash
+        """
+        return self._url
+
     def __str__(self):
         return f'DarSkyAPI key: {self.key()}'
 
@@ -70,11 +82,6 @@ class Weather(Enum):
     FOG = 9
     CLOUDY = 10
 
-    _translation = {'clear-day': DAY_CLEAR, 'clear-night': NIGHT_CLEAR, 'rain': RAIN,
-                    'sleet': SLEET, 'wind': WIND, 'fog': FOG, 'cloudy': CLOUDY,
-                    'partly-cloudy-day': DAY_PARTLY_CLOUDY,
-                    'partly-cloudy-night': NIGHT_PARTLY_CLOUDY}
-
     @staticmethod
     def get_from_string(weather_str: str):
         """
@@ -82,9 +89,14 @@ class Weather(Enum):
         :param weather_str: DarkSky icon string
         :return: type of weather
         """
-        if weather_str in Weather._translation:
-            return Weather._translation[weather_str]
-        return Weather.UNKNOWN
+        return _ICON_TRANSLATION.get(weather_str, Weather.UNKNOWN)
+
+
+_ICON_TRANSLATION = {'clear-day': Weather.DAY_CLEAR, 'clear-night': Weather.NIGHT_CLEAR,
+                     'rain': Weather.RAIN, 'snow': Weather.SNOW, 'sleet': Weather.SLEET,
+                     'wind': Weather.WIND, 'fog': Weather.FOG, 'cloudy': Weather.CLOUDY,
+                     'partly-cloudy-day': Weather.DAY_PARTLY_CLOUDY,
+                     'partly-cloudy-night': Weather.NIGHT_PARTLY_CLOUDY}
 
 
 class Temperature:
@@ -138,6 +150,11 @@ class WeatherReport:
         self._summary = ''
         self._risk_of_rain = 0.
         self._temp = Temperature(None, None, None)
+        self._bytes_received = 0
+        # Hourly forecast: timestamps, temperatures and precipitation probabilities
+        self._hourly_times = array('d')
+        self._hourly_temps = array('d')
+        self._hourly_rain = array('d')
 
     def temp(self):
         return self._temp
@@ -151,6 +168,57 @@ class WeatherReport:
     def summary(self):
         return self._summary
 
+    def bytes_received(self) -> int:
+        """
+        Get the size of the last response from DarkSky
+        :return: bytes
+        """
+        return self._bytes_received
+
+    def hourly(self) -> tuple:
+        """
+        Get the hourly forecast of the next hours
+        :return: arrays of timestamps, temperatures and precipitation probabilities
+        """
+        return self._hourly_times, self._hourly_temps, self._hourly_rain
+
+    def timeline(self) -> tuple:
+        """
+        Get the hourly forecast as tuples, usable as a cache key
+        :return: tuple of timestamps, temperatures and precipitation probabilities tuples
+        """
+        return tuple(self._hourly_times), tuple(self._hourly_temps), tuple(self._hourly_rain)
+
+    def snapshot(self) -> tuple:
+        """
+        Get the values displayed from the report, usable as a cache key. The hourly forecast changes
+        more often and is kept apart, see timeline
+        :return: tuple of weather, summary, temperatures and risk of rain
+        """
+        return (self._weather.value, self._summary, self._temp.cur(), self._temp.min(),
+                self._temp.max(), self._risk_of_rain)
+
+    @staticmethod
+    def from_snapshot(snapshot, timeline=None):
+        """
+        Rebuild a report from the values returned by snapshot and timeline
+        :param snapshot: tuple of weather, summary, temperatures and risk of rain, followed by the
+        hourly forecast in the snapshots of the first timeline version
+        :param timeline: timestamps, temperatures and precipitation probabilities, optional
+        :return: WeatherReport without API nor location
+        """
+        report = WeatherReport(None, None)
+        weather, report._summary, t_cur, t_min, t_max, report._risk_of_rain, *hourly = snapshot
+        report._weather = Weather(weather)
+        report._temp = Temperature(t_cur, t_max, t_min)
+        hourly = timeline or hourly
+        if hourly:
+            times, temps, rain = hourly
+            report._hourly_times.extend(times)
+            report._hourly_temps.extend(temps)
+            report._hourly_rain.extend(rain)
+        return report
+
     def lang(self, lang=None):
         if lang:
             self._language = lang
@@ -183,6 +251,12 @@ class WeatherReport:
                         mean_weather[weather] = 1
                 self._risk_of_rain /= hours_span
 
+                for hour in data['hourly']['data'][:TIMELINE_HOURS]:
+                    if 'time' in hour and 'temperature' in hour:
+                        self._hourly_times.append(hour['time'])
+                        self._hourly_temps.append(hour['temperature'])
+                        self._hourly_rain.append(hour.get('precipProbability', 0.))
+
                 # Find the average weather of the day
                 best_weather_count = 0
                 for key, value in mean_weather.items():
@@ -204,17 +278,19 @@ class WeatherReport:
         self.temp().min(int(self.temp().min()))
         self.temp().max(int(self.temp().max()))
 
-    def get_report(self):
-        url = 'https://api.darksky.net/forecast/' + self._api.key() + '/' + \
-              self._location.lat() + ',' + self._location.lon() + \
-              '?lang=' + self.lang() + '&units=si&exclude=daily'
+    def get_report(self, timeout: float = 30):
+        url = f'{self._api.url()}{self._api.key()}/{self._location.lat()},{self._location.lon()}' \
+              f'?lang={self.lang()}&units=si&exclude=daily'
         logging.info(f'Contacting DarkSky...')
+        import urllib.request
 
-        with urllib.request.urlopen(url) as request:
+        with urllib.request.urlopen(url, timeout=timeout) as request:
             if request.getcode() != 200:
                 logging.error(f'Failed to reach DarkSky, error code = {request.getcode()}')
                 return False
-            data = json.loads(request.read())
+            raw_data = request.read()
+            self._bytes_received = len(raw_data)
+            data = json.loads(raw_data)
             logging.info('Data retrieved from DarkSky')
 
         self._read_json(data)
@@ -231,14 +307,22 @@ def main():
     logging.basicConfig(format=log_format)
     parser = argparse.ArgumentParser(description='Get weather information from DarkSky API')
     parser.add_argument('-k', '--key', dest='key', required=True, help='DarkSky API key')
-    parser.add_argument('--lat', dest='lat', required=True, help='Latitude')
-    parser.add_argument('--lon', dest='lon', required=True, help='Longitude')
+    parser.add_argument('--lat', dest='lat', type=float, required=True, help='Latitude')
+    parser.add_argument('--lon', dest='lon', type=float, required=True, help='Longitude')
+    parser.add_argument('--profile', dest='profile', metavar='DIR',
+                        help='Write a cProfile dump to DIR and print the hot spots')
     args = parser.parse_args()
+    from profiling import Profiler
+    profiler = Profiler(args.profile)
     api = DarkSkyApi(args.key)
     location = WeatherLocation(args.lat, args.lon)
     report = WeatherReport(api, location)
-    if report.get_report():
+    with profiler.stage('report'):
+        success = report.get_report()
+    if success:
         print(report)
+    if profiler.enabled():
+        print(profiler.summary())
 
 
 if __name__ == '__main__':
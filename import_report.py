@@ -0,0 +1,190 @@
+"""Report the import cost of the Daily Commute entry points and check the startup budget"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('caldav', 'requests', 'niquests', 'dominate', 'wikiquote', 'dateutil')
+# Maximum cold import time of an entry point
+DEFAULT_BUDGET_MS = 100.
+
+# Entry point module -> heavy modules it is allowed to load at import time
+ENTRY_POINTS = {
+    'daily_commute': (),
+    'get_weather': (),
+    'get_events': (),
+    'get_quote': (),
+    'batch_commute': (),
+    'commute_daemon': (),
+}
+
+
+class ModuleCost:
+    """Import cost of a single module, as reported by python -X importtime"""
+    def __init__(self, name: str, self_us: int, cumulative_us: int, depth: int):
+        self._name = name
+        self._self_us = self_us
+        self._cumulative_us = cumulative_us
+        self._depth = depth
+
+    def name(self) -> str:
+        """
+        Get the module name
+        :return: dotted module name
+        """
+        return self._name
+
+    def self_ms(self) -> float:
+        """
+        Get the time spent importing the module itself
+        :return: milliseconds
+        """
+        return self._self_us / 1000
+
+    def cumulative_ms(self) -> float:
+        """
+        Get the time spent importing the module and its dependencies
+        :return: milliseconds
+        """
+        return self._cumulative_us / 1000
+
+    def depth(self) -> int:
+        """
+        Get the nesting level of the import, 0 for a top-level import
+        :return: depth
+        """
+        return self._depth
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Parse the stderr of python -X importtime
+    :param output: stderr text
+    :return: list of ModuleCost, in the order they were reported
+    """
+    costs = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        costs.append(ModuleCost(name.strip(), int(self_us), int(cumulative_us), depth))
+    return costs
+
+
+def measure(entry_point: str) -> list:
+    """
+    Import an entry point in a fresh interpreter
+    :param entry_point: Module name
+    :return: list of ModuleCost of the modules imported by the entry point, itself last
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {entry_point}'],
+                            capture_output=True, text=True, check=True)
+    costs = parse_importtime(result.stderr)
+    for index, cost in enumerate(costs):
+        if cost.depth() == 0 and cost.name() == entry_point:
+            start = index
+            while start > 0 and costs[start - 1].depth() > 0:
+                start -= 1
+            return costs[start:index + 1]
+    raise RuntimeError(f'{entry_point} was not imported')
+
+
+class ImportReport:
+    """Import cost of one entry point over several cold starts"""
+    def __init__(self, entry_point: str, repeat: int = 3):
+        runs = [measure(entry_point) for _ in range(repeat)]
+        self._entry_point = entry_point
+        self._total_ms = statistics.median(run[-1].cumulative_ms() for run in runs)
+        self._modules = runs[-1]
+
+    def entry_point(self) -> str:
+        """
+        Get the measured entry point
+        :return: module name
+        """
+        return self._entry_point
+
+    def total_ms(self) -> float:
+        """
+        Get the median cold import time of the entry point
+        :return: milliseconds
+        """
+        return self._total_ms
+
+    def modules(self) -> list:
+        """
+        Get the modules imported by the entry point
+        :return: list of ModuleCost
+        """
+        return self._modules
+
+    def heavy_modules(self) -> list:
+        """
+        Get the heavy dependencies loaded by the entry point
+        :return: list of top-level package names
+        """
+        loaded = {cost.name().split('.')[0] for cost in self._modules}
+        return [name for name in HEAVY_MODULES if name in loaded]
+
+    def violations(self, budget_ms: float) -> list:
+        """
+        Check the entry point against the startup budget
+        :param budget_ms: Maximum cold import time in milliseconds
+        :return: list of violation descriptions, empty if the budget is met
+        """
+        violations = []
+        if self._total_ms > budget_ms:
+            violations.append(f'{self._entry_point} imports in {self._total_ms:.1f}ms, '
+                              f'budget is {budget_ms:.1f}ms')
+        allowed = ENTRY_POINTS.get(self._entry_point, ())
+        for name in self.heavy_modules():
+            if name not in allowed:
+                violations.append(f'{self._entry_point} eagerly imports {name}')
+        return violations
+
+    def format(self, top: int = 10) -> str:
+        """
+        Format the most expensive modules of the entry point
+        :param top: Number of modules to list
+        :return: report text
+        """
+        lines = [f'{self._entry_point}: {self._total_ms:.1f}ms']
+        for cost in sorted(self._modules, key=lambda c: c.self_ms(), reverse=True)[:top]:
+            lines.append(f'  {cost.self_ms():8.2f}ms self {cost.cumulative_ms():8.2f}ms cumulative'
+                         f'  {cost.name()}')
+        return '\n'.join(lines)
+
+
+def main():
+    """
+    Print the import report of the entry points
+    :return: status code 0, or 1 if --check is given and the budget is exceeded
+    """
+    parser = argparse.ArgumentParser(description='Report the import cost of the entry points')
+    parser.add_argument('entry_points', nargs='*', default=list(ENTRY_POINTS),
+                        help='Modules to measure, all entry points by default')
+    parser.add_argument('--budget-ms', dest='budget_ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Maximum cold import time of an entry point')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='Number of cold starts per entry point, the median is kept')
+    parser.add_argument('--top', dest='top', type=int, default=10,
+                        help='Number of modules listed per entry point')
+    parser.add_argument('--check', dest='check', action='store_true',
+                        help='Fail if an entry point exceeds the budget or loads a heavy module')
+    args = parser.parse_args()
+
+    violations = []
+    for entry_point in args.entry_points:
+        report = ImportReport(entry_point, args.repeat)
+        print(report.format(args.top))
+        violations.extend(report.violations(args.budget_ms))
+
+    for violation in violations:
+        print(f'BUDGET EXCEEDED: {violation}')
+    return 1 if args.check and violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
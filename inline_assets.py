@@ -0,0 +1,195 @@
+"""Reference or inline the stylesheet and icons of the Daily Commute"""
+
+import gzip
+import logging
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+
+from dominate import svg, tags
+from dominate.util import raw
+
+SVG_NAMESPACE = 'http://www.w3.org/2000/svg'
+ElementTree.register_namespace('', SVG_NAMESPACE)
+
+
+def icon_id(path: str) -> str:
+    """
+    Get the sprite symbol id of an icon
+    :param path: Icon path, e.g. 'Icons/Cloud-Rain.svg'
+    :return: symbol id, e.g. 'icon-cloud-rain'
+    """
+    return 'icon-' + os.path.splitext(os.path.basename(path))[0].lower()
+
+
+def minify_css(css: str) -> str:
+    """
+    Remove comments and unneeded whitespace from a stylesheet
+    :param css: Stylesheet text
+    :return: minified stylesheet
+    """
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{}:;,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def svg_to_symbol(svg_text: str, symbol_id: str) -> str:
+    """
+    Convert a standalone SVG document into a sprite symbol
+    :param svg_text: SVG document
+    :param symbol_id: Id of the symbol
+    :return: symbol element as text
+    """
+    root = ElementTree.fromstring(svg_text)
+    view_box = root.get('viewBox')
+    if view_box is None:
+        width = re.sub(r'[^\d.]', '', root.get('width', '0'))
+        height = re.sub(r'[^\d.]', '', root.get('height', '0'))
+        view_box = f'0 0 {width} {height}'
+
+    for element in root.iter():
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    for attribute in ('width', 'height', 'x', 'y', 'version', 'viewBox', 'enable-background'):
+        root.attrib.pop(attribute, None)
+    root.tag = f'{{{SVG_NAMESPACE}}}symbol'
+    root.set('id', symbol_id)
+    root.set('viewBox', view_box)
+
+    symbol = ElementTree.tostring(root, encoding='unicode')
+    return symbol.replace(f' xmlns="{SVG_NAMESPACE}"', '')
+
+
+class LinkedAssets:
+    """Reference style.css and the icons as separate files"""
+    @staticmethod
+    def mode() -> str:
+        """
+        Get the asset mode, part of the fragment cache keys
+        :return: 'linked'
+        """
+        return 'linked'
+
+    @staticmethod
+    def write_head(doc):
+        """
+        Link the stylesheet, requires the dominate document
+        :param doc: Dominate document
+        """
+        with doc.head:
+            tags.link(rel='stylesheet', href='style.css')
+
+    @staticmethod
+    def icon(path: str, alt: str):
+        """
+        Write an icon, requires an open dominate tag
+        :param path: Icon path
+        :param alt: Alternative text
+        """
+        tags.img(src=path, alt=alt, cls='icon')
+
+    @staticmethod
+    def sprite(body: str) -> str:
+        """
+        Get the sprite needed by a rendered body
+        :param body: Rendered body
+        :return: empty string, icons are linked
+        """
+        return ''
+
+
+class InlineAssets:
+    """Inline the minified stylesheet and the icons used, as a single SVG sprite"""
+    def __init__(self, assets_dir: str):
+        """
+        Constructor for inline assets
+        :param assets_dir: Directory containing style.css and the Icons folder
+        """
+        self._assets_dir = assets_dir
+        self._css = None
+        self._icon_paths = None
+        self._symbols = {}
+
+    @staticmethod
+    def mode() -> str:
+        """
+        Get the asset mode, part of the fragment cache keys
+        :return: 'inline'
+        """
+        return 'inline'
+
+    def css(self) -> str:
+        """
+        Get the minified stylesheet, read once
+        :return: stylesheet text
+        """
+        if self._css is None:
+            with open(os.path.join(self._assets_dir, 'style.css'), 'r', encoding='utf-8') as file:
+                self._css = minify_css(file.read())
+        return self._css
+
+    def write_head(self, doc):
+        """
+        Inline the stylesheet, requires the dominate document
+        :param doc: Dominate document
+        """
+        with doc.head:
+            tags.style(raw(self.css()))
+
+    def icon(self, path: str, alt: str):
+        """
+        Write a reference to a sprite icon, requires an open dominate tag
+        :param path: Icon path
+        :param alt: Alternative text
+        """
+        svg.svg(svg.use(href='#' + icon_id(path)), cls='icon', role='img', aria_label=alt)
+
+    def _symbol(self, symbol_id: str) -> str:
+        if self._icon_paths is None:
+            icons_dir = os.path.join(self._assets_dir, 'Icons')
+            self._icon_paths = {icon_id(name): os.path.join(icons_dir, name)
+                                for name in os.listdir(icons_dir) if name.endswith('.svg')}
+        if symbol_id not in self._symbols:
+            if symbol_id not in self._icon_paths:
+                logging.error(f'No icon file for {symbol_id}')
+                return ''
+            with open(self._icon_paths[symbol_id], 'r', encoding='utf-8') as file:
+                self._symbols[symbol_id] = svg_to_symbol(file.read(), symbol_id)
+        return self._symbols[symbol_id]
+
+    def sprite(self, body: str) -> str:
+        """
+        Get the sprite containing only the icons referenced by a rendered body
+        :param body: Rendered body
+        :return: hidden SVG element with one symbol per icon
+        """
+        used = sorted(set(re.findall(r'href="#(icon-[\w-]+)"', body)))
+        symbols = ''.join(self._symbol(symbol_id) for symbol_id in used)
+        return f'<svg xmlns="{SVG_NAMESPACE}" style="display:none">{symbols}</svg>'
+
+
+def write_precompressed(path: str) -> list:
+    """
+    Write gzip and, if the brotli module is installed, brotli variants next to a file
+    :param path: Path to the file to compress
+    :return: list of suffixes of the written variants
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    suffixes = ['.gz']
+    with open(path + '.gz', 'wb') as file:
+        file.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+    try:
+        import brotli
+    except ImportError:
+        logging.info('brotli is not installed, skipping the .br variant')
+    else:
+        with open(path + '.br', 'wb') as file:
+            file.write(brotli.compress(data, mode=brotli.MODE_TEXT, quality=11))
+        suffixes.append('.br')
+    return suffixes
@@ -0,0 +1,139 @@
+"""Run many editions against the local stand-in upstreams and report throughput and latency"""
+
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_upstreams
+from daily_commute import ConfigDailyCommute, run_edition
+from run_metrics import RunMetrics
+
+
+def percentiles(values: list) -> tuple:
+    """
+    Compute the 50th, 95th and 99th percentiles
+    :param values: List of numbers
+    :return: (p50, p95, p99), zeros for an empty list
+    """
+    if not values:
+        return 0., 0., 0.
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+class LoadReport:
+    """Outcome of a load test"""
+    def __init__(self, wall_time: float, runs: list):
+        """
+        Constructor for a load report
+        :param wall_time: Duration of the whole test in seconds
+        :param runs: List of (status, RunMetrics) per edition
+        """
+        self._wall_time = wall_time
+        self._runs = runs
+
+    def throughput(self) -> float:
+        """
+        Get the number of editions completed per second
+        :return: editions per second
+        """
+        return len(self._runs) / self._wall_time if self._wall_time else 0.
+
+    def failures(self) -> int:
+        """
+        Get the number of failed editions
+        :return: count
+        """
+        return sum(1 for status, _ in self._runs if status != 0)
+
+    def stage_durations(self) -> dict:
+        """
+        Get the durations of every stage over all editions
+        :return: dictionary of stage name to list of seconds
+        """
+        durations = {}
+        for _, metrics in self._runs:
+            for span in metrics.spans():
+                durations.setdefault(span.name(), []).append(span.duration())
+        return durations
+
+    def __str__(self):
+        lines = [f'{len(self._runs)} editions in {self._wall_time:.2f}s: '
+                 f'{self.throughput():.2f} editions/s, {self.failures()} failed']
+        for stage, values in sorted(self.stage_durations().items()):
+            p50, p95, p99 = percentiles(values)
+            lines.append(f'  {stage:16} p50 {p50 * 1000:9.1f}ms  p95 {p95 * 1000:9.1f}ms  '
+                         f'p99 {p99 * 1000:9.1f}ms')
+        return '\n'.join(lines)
+
+
+def run_load(daily_config: ConfigDailyCommute, editions: int, concurrency: int) -> LoadReport:
+    """
+    Run editions concurrently
+    :param daily_config: Configuration pointing at the upstreams
+    :param editions: Number of editions
+    :param concurrency: Number of editions running at the same time
+    :return: load report
+    """
+    def edition(index: int, out_dir: str) -> tuple:
+        metrics = RunMetrics()
+        with metrics.span('edition') as span:
+            status = run_edition(daily_config, metrics, out=os.path.join(out_dir, f'tdc-{index}.html'))
+            if status != 0:
+                span.outcome('error')
+        return status, metrics
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            runs = list(pool.map(edition, range(editions), [out_dir] * editions))
+        return LoadReport(time.perf_counter() - start, runs)
+
+
+def main():
+    """
+    Start the fake upstreams, unless a configuration is given, and run the load test
+    :return: status code 0
+    """
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.CRITICAL)
+    parser = argparse.ArgumentParser(description='Load test the Daily Commute')
+    parser.add_argument('-n', '--editions', dest='editions', type=int, default=100,
+                        help='Number of editions')
+    parser.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=8,
+                        help='Number of concurrent editions')
+    parser.add_argument('--config', dest='config',
+                        help='Configuration pointing at already running upstreams')
+    fake_upstreams.add_condition_arguments(parser)
+    args = parser.parse_args()
+
+    config_name = os.path.abspath(args.config) if args.config else None
+    # The ephemeris is loaded relatively to the repository
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    upstreams = None
+    if config_name is None:
+        conditions = fake_upstreams.conditions_from(args)
+        upstreams = fake_upstreams.FakeUpstreams(data=fake_upstreams.FixtureData(args.events, args.seed),
+                                                 http_conditions=conditions, ftp_conditions=conditions)
+        upstreams.start()
+        with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as file:
+            file.write(upstreams.config_text())
+        config_name = file.name
+
+    try:
+        report = run_load(ConfigDailyCommute(config_name), args.editions, args.concurrency)
+        print(report)
+    finally:
+        if upstreams is not None:
+            upstreams.stop()
+            os.remove(config_name)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
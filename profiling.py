@@ -0,0 +1,152 @@
+"""Profile the CPU and memory hot spots of the Daily Commute stages"""
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import tracemalloc
+
+# (file name suffix, function name) of the functions always listed in the summary when called
+WATCHED_FUNCTIONS = (('get_events.py', '__init__'), ('get_events.py', '_process_times'),
+                     ('get_events.py', 'is_happening_today'), ('get_events.py', '__lt__'),
+                     ('dom_tag.py', 'render'), (os.path.join('json', '__init__.py'), 'loads'),
+                     ('get_weather.py', '_read_json'))
+
+
+class StageProfile:
+    """CPU profile and memory usage of one stage"""
+    def __init__(self, name: str, stats: pstats.Stats, peak_bytes: int, top_allocators: list):
+        self._name = name
+        self._stats = stats
+        self._peak_bytes = peak_bytes
+        self._top_allocators = top_allocators
+
+    def name(self) -> str:
+        """
+        Get the stage name
+        :return: name
+        """
+        return self._name
+
+    def stats(self) -> pstats.Stats:
+        """
+        Get the CPU profile of the stage
+        :return: pstats.Stats
+        """
+        return self._stats
+
+    def peak_bytes(self) -> int:
+        """
+        Get the peak of traced memory during the stage
+        :return: bytes
+        """
+        return self._peak_bytes
+
+    def top_allocators(self) -> list:
+        """
+        Get the source lines which allocated the most memory during the stage
+        :return: list of tracemalloc.StatisticDiff
+        """
+        return self._top_allocators
+
+
+class Profiler:
+    """Capture a cProfile dump and tracemalloc statistics per stage, disabled without out_dir"""
+    def __init__(self, out_dir: str = None, top: int = 5):
+        """
+        Constructor for the profiler
+        :param out_dir: Directory receiving one <stage>.prof dump per stage, None to disable
+        :param top: Number of allocators kept per stage
+        """
+        self._out_dir = out_dir
+        self._top = top
+        self._stages = []
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def enabled(self) -> bool:
+        """
+        Check if stages are profiled
+        :return: bool
+        """
+        return self._out_dir is not None
+
+    def stages(self) -> list:
+        """
+        Get the profiled stages
+        :return: list of StageProfile
+        """
+        return list(self._stages)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Profile the enclosed block
+        :param name: Stage name, also the dump file name
+        :return: context manager
+        """
+        if not self.enabled():
+            yield
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            allocators = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+
+            profile.dump_stats(os.path.join(self._out_dir, f'{name}.prof'))
+            stats = pstats.Stats(profile, stream=io.StringIO())
+            self._stages.append(StageProfile(name, stats, peak, allocators[:self._top]))
+
+    def summary(self, top: int = 10) -> str:
+        """
+        Summarize the hottest functions and the memory usage of every stage
+        :param top: Number of functions listed
+        :return: summary text
+        """
+        if not self._stages:
+            return ''
+
+        lines = ['Stages:']
+        for stage in self._stages:
+            lines.append(f'  {stage.name():16} {stage.stats().total_tt:8.3f}s CPU '
+                         f'{stage.peak_bytes() / 1024:10.1f} KiB peak')
+            for allocator in stage.top_allocators():
+                lines.append(f'      {allocator.size_diff / 1024:+10.1f} KiB  {allocator.traceback}')
+
+        merged = pstats.Stats(stream=io.StringIO())
+        merged.add(*(stage.stats() for stage in self._stages))
+        entries = merged.stats
+        lines.append(f'Hottest functions (own time, {top} first):')
+        hottest = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        for function, (_, calls, own_time, cumulative_time, _) in hottest:
+            lines.append(f'  {own_time:8.3f}s own {cumulative_time:8.3f}s cumulative '
+                         f'{calls:>9} calls  {_format_function(function)}')
+
+        watched = [(function, values) for function, values in entries.items()
+                   if any(function[0].endswith(suffix) and function[2] == function_name
+                          for suffix, function_name in WATCHED_FUNCTIONS)]
+        if watched:
+            lines.append('Watched functions:')
+            for function, (_, calls, own_time, cumulative_time, _) in sorted(watched):
+                lines.append(f'  {own_time:8.3f}s own {cumulative_time:8.3f}s cumulative '
+                             f'{calls:>9} calls  {_format_function(function)}')
+        return '\n'.join(lines)
+
+
+def _format_function(function: tuple) -> str:
+    filename, line, name = function
+    if filename == '~':
+        return name
+    return f'{os.path.basename(filename)}:{line}({name})'
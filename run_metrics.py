@@ -0,0 +1,267 @@
+"""Time the stages of a Daily Commute run and export them as metrics"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+
+
+class Span:
+    """Duration, transferred bytes and outcome of one stage of a run"""
+    def __init__(self, name: str, edition: str = None):
+        self._name = name
+        self._edition = edition
+        self._start = time.time()
+        self._perf_start = time.perf_counter()
+        self._duration = 0.
+        self._bytes = 0
+        self._outcome = 'ok'
+        self._attributes = {}
+
+    def name(self) -> str:
+        """
+        Get the stage name
+        :return: name, e.g. 'fetch.weather'
+        """
+        return self._name
+
+    def edition(self) -> str:
+        """
+        Get the edition the stage belongs to
+        :return: edition name, None for a single edition run
+        """
+        return self._edition
+
+    def duration(self) -> float:
+        """
+        Get the duration of the stage
+        :return: seconds
+        """
+        return self._duration
+
+    def stop(self):
+        """
+        Mark the end of the stage
+        """
+        self._duration = time.perf_counter() - self._perf_start
+
+    def bytes(self) -> int:
+        """
+        Get the number of bytes transferred by the stage
+        :return: bytes
+        """
+        return self._bytes
+
+    def add_bytes(self, count: int):
+        """
+        Account for transferred bytes
+        :param count: Number of bytes
+        """
+        self._bytes += count
+
+    def outcome(self, outcome: str = None) -> str:
+        """
+        Getter/setter for the outcome of the stage
+        :param outcome: 'ok', 'error' or any other short status, optional
+        :return: outcome
+        """
+        if outcome is not None:
+            self._outcome = outcome
+        return self._outcome
+
+    def set(self, key: str, value):
+        """
+        Attach a value to the span, e.g. an event count
+        :param key: Attribute name
+        :param value: JSON serializable value
+        """
+        self._attributes[key] = value
+
+    def attributes(self) -> dict:
+        """
+        Get the values attached to the span
+        :return: dictionary
+        """
+        return self._attributes
+
+    def to_dict(self) -> dict:
+        """
+        Convert the span to a JSON serializable dictionary
+        :return: dictionary
+        """
+        return {'stage': self._name, 'edition': self._edition, 'start': self._start,
+                'duration': self._duration, 'bytes': self._bytes, 'outcome': self._outcome,
+                **self._attributes}
+
+
+class RunMetrics:
+    """Collect the spans of a run"""
+    def __init__(self):
+        self._run_id = uuid.uuid4().hex
+        self._start = time.time()
+        self._spans = []
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def run_id(self) -> str:
+        """
+        Get the unique id of the run
+        :return: hexadecimal id
+        """
+        return self._run_id
+
+    @contextlib.contextmanager
+    def span(self, name: str, edition: str = None):
+        """
+        Time a stage, an exception escaping the block marks it as failed
+        :param name: Stage name
+        :param edition: Edition name, optional
+        :return: context manager yielding the Span
+        """
+        span = Span(name, edition)
+        try:
+            yield span
+        except BaseException:
+            span.outcome('error')
+            raise
+        finally:
+            span.stop()
+            with self._lock:
+                self._spans.append(span)
+
+    def add(self, span: Span):
+        """
+        Add a span timed outside of the span context manager, e.g. in another thread
+        :param span: Stopped Span
+        """
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self) -> list:
+        """
+        Get the finished spans
+        :return: list of Span
+        """
+        return list(self._spans)
+
+    def gauge(self, name: str, value: float, labels: dict = None):
+        """
+        Record a value exported as is, e.g. the state of a component
+        :param name: Metric name, without the tdc_ prefix
+        :param value: Numeric value
+        :param labels: Prometheus labels, optional
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def write_jsonl(self, path: str):
+        """
+        Append the spans to a JSON-lines file, one line per span
+        :param path: Path to the metrics file
+        """
+        with open(path, 'a') as file:
+            for span in self.spans():
+                file.write(json.dumps({'run': self._run_id, **span.to_dict()}) + '\n')
+
+    def write_prometheus(self, path: str):
+        """
+        Write the run as a Prometheus textfile-collector file, atomically replaced. Spans of the same
+        stage and edition, e.g. the weather of every location or a prefetch and its retry, are
+        exported as one series: durations, bytes and counts are summed, success needs every one ok.
+        :param path: Path to the .prom file
+        """
+        lines = ['# TYPE tdc_last_run_timestamp_seconds gauge',
+                 f'tdc_last_run_timestamp_seconds {self._start:.3f}']
+        # The textfile collector rejects a file holding the same series twice
+        series = {}
+        for span in self.spans():
+            key = (span.name(), span.edition() or '')
+            duration, count, bytes_, success = series.get(key, (0., 0, 0, 1))
+            series[key] = (duration + span.duration(), count + 1, bytes_ + span.bytes(),
+                           success & int(span.outcome() == 'ok'))
+        families = (('stage_duration_seconds', lambda values: f'{values[0]:.6f}'),
+                    ('stage_count', lambda values: values[1]),
+                    ('stage_bytes', lambda values: values[2]),
+                    ('stage_success', lambda values: values[3]))
+        for family, value in families:
+            lines.append(f'# TYPE tdc_{family} gauge')
+            for (stage, edition), values in series.items():
+                labels = _format_labels({'stage': stage, 'edition': edition})
+                lines.append(f'tdc_{family}{labels} {value(values)}')
+
+        previous = None
+        for (name, labels), value in sorted(self._gauges.items()):
+            if name != previous:
+                lines.append(f'# TYPE tdc_{name} gauge')
+                previous = name
+            lines.append(f'tdc_{name}{_format_labels(dict(labels))} {value}')
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def write(self, jsonl_path: str = None, prometheus_path: str = None):
+        """
+        Export the run to the given files, skipping the ones set to None
+        :param jsonl_path: Path to the JSON-lines file
+        :param prometheus_path: Path to the .prom file
+        """
+        if jsonl_path:
+            self.write_jsonl(jsonl_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+
+def _format_labels(labels: dict) -> str:
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def summarize(path: str) -> dict:
+    """
+    Compute latency percentiles per stage from a JSON-lines metrics file
+    :param path: Path to the metrics file
+    :return: dictionary of stage to (count, p50, p95, failures)
+    """
+    durations = {}
+    failures = {}
+    with open(path, 'r') as file:
+        for line in file:
+            span = json.loads(line)
+            durations.setdefault(span['stage'], []).append(span['duration'])
+            if span['outcome'] != 'ok':
+                failures[span['stage']] = failures.get(span['stage'], 0) + 1
+
+    summary = {}
+    for stage, values in durations.items():
+        if len(values) > 1:
+            cuts = statistics.quantiles(values, n=100, method='inclusive')
+            p50, p95 = cuts[49], cuts[94]
+        else:
+            p50 = p95 = values[0]
+        summary[stage] = (len(values), p50, p95, failures.get(stage, 0))
+    return summary
+
+
+def main():
+    """
+    Print p50/p95 latency per stage of a metrics file
+    """
+    parser = argparse.ArgumentParser(description='Summarize Daily Commute run metrics')
+    parser.add_argument('metrics', help='JSON-lines metrics file')
+    args = parser.parse_args()
+    for stage, (count, p50, p95, failed) in sorted(summarize(args.metrics).items()):
+        print(f'{stage:24} n={count:<5} p50={p50:7.3f}s p95={p95:7.3f}s failures={failed}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Keep the last good data of every section to render them when a source is late"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+
+from get_events import Event
+from get_quote import Quote
+from get_weather import WeatherReport
+
+
+# Sections whose empty data counts as missing
+QUOTES = ('qotd', 'ron')
+
+
+def _name(section: str, key: str = None) -> str:
+    # Sections of several subscribers or locations share the file, e.g. 'events alice'
+    return section if key is None else f'{section} {key}'
+
+
+class SectionStore:
+    """Last good data per section with the time it was fetched, persisted as JSON"""
+    def __init__(self, path: str = None, autoflush: bool = True):
+        """
+        Constructor for the store
+        :param path: JSON file holding the sections, None to keep them in memory only
+        :param autoflush: Write the file after every save, else only on flush
+        """
+        self._path = path
+        self._autoflush = autoflush
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._sections = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    self._sections = json.load(file)
+            except (OSError, ValueError) as exc:
+                logging.warning(f'Ignoring unreadable section store {path}: {exc}')
+
+    def _save(self, section: str, data):
+        with self._lock:
+            self._sections[section] = {'since': datetime.datetime.now().isoformat(timespec='seconds'),
+                                       'data': data}
+            self._dirty = True
+        if self._autoflush:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the sections saved since the last flush to the file, if any
+        """
+        with self._lock:
+            if self._path is None or not self._dirty:
+                return
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(self._sections, file, ensure_ascii=False)
+            os.replace(tmp_path, self._path)
+            self._dirty = False
+
+    def _load(self, section: str) -> tuple:
+        with self._lock:
+            entry = self._sections.get(section)
+        if entry is None:
+            return None, None
+        return entry['data'], datetime.datetime.fromisoformat(entry['since'])
+
+    def save_weather(self, report: WeatherReport, key: str = None):
+        """
+        Keep a weather report
+        :param report: Weather report
+        :param key: Location of the report when the store is shared, optional
+        """
+        self._save(_name('weather', key), {'snapshot': list(report.snapshot()),
+                                          'timeline': list(report.timeline())})
+
+    def load_weather(self, key: str = None) -> tuple:
+        """
+        Get the last good weather report
+        :param key: Location of the report when the store is shared, optional
+        :return: (WeatherReport, fetch datetime), (None, None) if never stored
+        """
+        data, since = self._load(_name('weather', key))
+        if data is None:
+            return None, None
+        if isinstance(data, list):
+            # Stored before the timeline was kept apart
+            return WeatherReport.from_snapshot(tuple(data)), since
+        return WeatherReport.from_snapshot(tuple(data['snapshot']), data['timeline']), since
+
+    def save_events(self, events: list, day: datetime.date, key: str = None):
+        """
+        Keep the events of a day
+        :param events: List of events happening that day
+        :param day: Day of the events
+        :param key: Subscriber of the events when the store is shared, optional
+        """
+        self._save(_name('events', key), {'day': day.isoformat(),
+                              'events': [[event.type(), event.data()] for event in events]})
+
+    def load_events(self, day: datetime.date, key: str = None) -> tuple:
+        """
+        Get the last good events, only if they were fetched for the same day
+        :param day: Day of the edition
+        :param key: Subscriber of the events when the store is shared, optional
+        :return: (sorted list of events, fetch datetime), (None, None) if none for that day
+        """
+        data, since = self._load(_name('events', key))
+        if data is None or data['day'] != day.isoformat():
+            return None, None
+        return sorted(Event(event_data, type_) for type_, event_data in data['events']), since
+
+    def save_quote(self, section: str, quote: Quote, key: str = None):
+        """
+        Keep a quote
+        :param section: 'qotd' or 'ron'
+        :param quote: Quote
+        :param key: Endpoint of the quote when the store is shared, optional
+        """
+        self._save(_name(section, key), [quote.text(), quote.author()])
+
+    def load_quote(self, section: str, key: str = None) -> tuple:
+        """
+        Get the last good quote of a section
+        :param section: 'qotd' or 'ron'
+        :param key: Endpoint of the quote when the store is shared, optional
+        :return: (Quote, fetch datetime), (None, None) if never stored
+        """
+        data, since = self._load(_name(section, key))
+        if data is None:
+            return None, None
+        return Quote(data[0], data[1]), since
+
+    def keep_or_load(self, section: str, data, day: datetime.date, key: str = None) -> tuple:
+        """
+        Keep the freshly fetched data of a section, or get its last good data if the fetch failed
+        :param section: 'weather', 'events', 'qotd' or 'ron'
+        :param data: Fetched data, None or an empty quote if the fetch failed or timed out
+        :param day: Day of the edition
+        :param key: Location, subscriber or endpoint of the section when the store is shared, optional
+        :return: (data, None) if fresh, (last good data, fetch datetime) if stale, (None, None) if omitted
+        """
+        fresh = bool(data) if section in QUOTES else data is not None
+        if fresh:
+            if section == 'weather':
+                self.save_weather(data, key)
+            elif section == 'events':
+                self.save_events(data, day, key)
+            else:
+                self.save_quote(section, data, key)
+            return data, None
+
+        if section == 'weather':
+            data, since = self.load_weather(key)
+        elif section == 'events':
+            data, since = self.load_events(day, key)
+        else:
+            data, since = self.load_quote(section, key)
+        if since is None:
+            logging.warning(f'Section {_name(section, key)} omitted')
+        else:
+            logging.warning(f'Section {_name(section, key)} rendered from data of {since}')
+        return data, since
@@ -0,0 +1,388 @@
+"""Serve the Daily Commute of many subscribers over HTTP, rendered on request from cached sources"""
+
+import argparse
+import datetime
+import email.utils
+import hashlib
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import get_quote
+from circuit_breaker import BreakerBoard
+from config_store import ConfigStore
+from daily_commute import fetch_weather, fetch_events, make_assets, breaker_name, location_key, \
+    make_parse_pool
+import write_page
+
+# Minutes a source is served before being fetched again, quotes change with the day
+DEFAULT_TTLS = {'weather': 60, 'events': 30}
+
+
+class SingleFlight:
+    """Run a function once for concurrent callers of the same key, they all get its result"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._coalesced = 0
+
+    def do(self, key, function):
+        """
+        Call a function, or wait for the call already running for the key
+        :param key: Hashable key identifying identical calls
+        :param function: Function without arguments
+        :return: result of the function, its exception is raised to every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'value': None, 'error': None}
+            else:
+                self._coalesced += 1
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['value']
+
+        try:
+            call['value'] = function()
+        except Exception as exc:
+            call['error'] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['value']
+
+    def coalesced(self) -> int:
+        """
+        Get the number of calls which waited for another one instead of running
+        :return: count
+        """
+        return self._coalesced
+
+
+class SourceCache:
+    """Fetched source data, kept while fresh and served stale when a refresh fails"""
+    def __init__(self, breakers: BreakerBoard, flights: SingleFlight):
+        """
+        Constructor for the cache
+        :param breakers: BreakerBoard of the upstreams
+        :param flights: SingleFlight coalescing concurrent fetches of the same source
+        """
+        self._breakers = breakers
+        self._flights = flights
+        self._lock = threading.Lock()
+        # key -> (value, monotonic fetch time, fetch datetime, version)
+        self._entries = {}
+        self._versions = 0
+
+    def get(self, key: tuple, ttl: float, fetch, breaker: str = None) -> tuple:
+        """
+        Get the data of a source, fetching it if missing or older than its time to live
+        :param key: Source key, its first item is the upstream name
+        :param ttl: Seconds the data is fresh
+        :param fetch: Function without arguments returning the data
+        :param breaker: Name of the circuit breaker of the fetch, the upstream name by default
+        :return: (data, version, stale since datetime or None), data is None if never fetched
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] < ttl:
+            return entry[0], entry[3], None
+        try:
+            return self._flights.do(('fetch',) + key, lambda: self._refresh(key, fetch, breaker or key[0]))
+        except Exception as exc:
+            logging.error(f'Fetching {key} failed: {exc}')
+            if entry is None:
+                return None, None, None
+            return entry[0], entry[3], entry[2]
+
+    def _refresh(self, key: tuple, fetch, breaker: str) -> tuple:
+        value = self._breakers.call(breaker, fetch)
+        with self._lock:
+            self._versions += 1
+            self._entries[key] = (value, time.monotonic(), datetime.datetime.now(), self._versions)
+        return value, self._versions, None
+
+
+class RenderedEdition:
+    """Rendered page of a subscriber with its validators"""
+    def __init__(self, key: tuple, body: bytes, last_modified: float):
+        """
+        Constructor for a rendered edition
+        :param key: Versions of the inputs the page was rendered from
+        :param body: UTF-8 page
+        :param last_modified: Timestamp of the first render of this body
+        """
+        self._key = key
+        self._body = body
+        self._etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self._last_modified = int(last_modified)
+
+    def key(self) -> tuple:
+        """
+        Get the versions of the inputs of the page
+        :return: tuple
+        """
+        return self._key
+
+    def body(self) -> bytes:
+        """
+        Get the page
+        :return: UTF-8 bytes
+        """
+        return self._body
+
+    def etag(self) -> str:
+        """
+        Get the strong entity tag of the page
+        :return: quoted hash of the body
+        """
+        return self._etag
+
+    def last_modified(self) -> int:
+        """
+        Get the time the body last changed, in whole seconds as sent over HTTP
+        :return: timestamp
+        """
+        return self._last_modified
+
+    def not_modified(self, if_none_match: str, if_modified_since: str) -> bool:
+        """
+        Evaluate the conditional headers of a request, If-None-Match takes precedence
+        :param if_none_match: If-None-Match header, can be None
+        :param if_modified_since: If-Modified-Since header, can be None
+        :return: True if a 304 can be sent
+        """
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or self._etag in tags
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return self._last_modified <= since
+        return False
+
+
+class EditionServer:
+    """Render the edition of a subscriber on request, reusing it until its inputs change"""
+    def __init__(self, configs: dict, assets=None, breakers: BreakerBoard = None, ttls: dict = None,
+                 timeout: float = 10, parse_pool=None):
+        """
+        Constructor for the server
+        :param configs: Dictionary of subscriber name to Daily Commute configuration
+        :param assets: LinkedAssets or InlineAssets, linked by default
+        :param breakers: BreakerBoard of the upstreams, kept in memory if not given
+        :param ttls: Minutes a source is fresh, DEFAULT_TTLS if not given
+        :param timeout: Socket timeout in seconds of the upstream requests
+        :param parse_pool: ParsePool of the events of every subscriber, optional
+        """
+        self._configs = configs
+        self._assets = assets
+        self._ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self._timeout = timeout
+        self._parse_pool = parse_pool
+        self._flights = SingleFlight()
+        self._sources = SourceCache(BreakerBoard() if breakers is None else breakers, self._flights)
+        self._fragments = write_page.FragmentCache()
+        self._lock = threading.Lock()
+        self._editions = {}
+        self._renders = 0
+
+    def subscribers(self) -> list:
+        """
+        Get the served subscribers
+        :return: list of names
+        """
+        return list(self._configs)
+
+    def renders(self) -> int:
+        """
+        Get the number of pages rendered
+        :return: count
+        """
+        return self._renders
+
+    def flights(self) -> SingleFlight:
+        """
+        Get the coalescing of concurrent fetches and renders
+        :return: SingleFlight
+        """
+        return self._flights
+
+    def edition(self, name: str) -> RenderedEdition:
+        """
+        Get the current edition of a subscriber
+        :param name: Subscriber name
+        :return: RenderedEdition
+        """
+        daily_config = self._configs[name]
+        endpoints = daily_config.endpoints()
+        today = datetime.date.today()
+        inputs = {
+            'weather': self._sources.get(('weather',) + location_key(daily_config),
+                                         self._ttls['weather'] * 60,
+                                         lambda: fetch_weather(daily_config, timeout=self._timeout),
+                                         breaker_name('weather', daily_config)),
+            'events': self._sources.get(('events', name, today), self._ttls['events'] * 60,
+                                        lambda: fetch_events(daily_config, timeout=self._timeout,
+                                                             parse_pool=self._parse_pool),
+                                        breaker_name('events', daily_config)),
+            'qotd': self._sources.get(('qotd', today), float('inf'), lambda: get_quote.get_quote_of_the_day(
+                url=endpoints.qotd_url(), timeout=self._timeout), breaker_name('qotd', daily_config)),
+            'ron': self._sources.get(('ron', today), float('inf'), lambda: get_quote.get_ron_swanson_quote(
+                endpoints.ron_url(), self._timeout), breaker_name('ron', daily_config))}
+        key = (today,) + tuple((source, version, since) for source, (_, version, since) in inputs.items())
+
+        with self._lock:
+            edition = self._editions.get(name)
+        if edition is not None and edition.key() == key:
+            return edition
+        return self._flights.do(('render', name, key), lambda: self._render(name, key, inputs))
+
+    def _render(self, name: str, key: tuple, inputs: dict) -> RenderedEdition:
+        stale = {source: since for source, (_, _, since) in inputs.items() if since is not None}
+        body = write_page.render_html(inputs['weather'][0], inputs['events'][0] or [],
+                                      inputs['qotd'][0] or get_quote.Quote('', ''),
+                                      inputs['ron'][0] or get_quote.Quote('', ''),
+                                      self._fragments, self._assets, stale).encode('utf-8')
+        with self._lock:
+            self._renders += 1
+            previous = self._editions.get(name)
+            if previous is not None and previous.body() == body:
+                last_modified = previous.last_modified()
+            else:
+                last_modified = time.time()
+            edition = RenderedEdition(key, body, last_modified)
+            self._editions[name] = edition
+        return edition
+
+
+class EditionRequestHandler(BaseHTTPRequestHandler):
+    """Serve /<subscriber>, / for the first subscriber, and static files if a directory is set"""
+    server_version = 'TheDailyCommute'
+    editions = None
+    static_dir = None
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        path = self.path.split('?', 1)[0].strip('/')
+        subscribers = self.editions.subscribers()
+        name = path or (subscribers[0] if subscribers else None)
+        if name not in subscribers:
+            self._serve_static(path, send_body)
+            return
+
+        edition = self.editions.edition(name)
+        headers = {'ETag': edition.etag(), 'Cache-Control': 'no-cache',
+                   'Last-Modified': email.utils.formatdate(edition.last_modified(), usegmt=True)}
+        if edition.not_modified(self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')):
+            self._respond(304, headers)
+            return
+        headers['Content-Type'] = 'text/html; charset=utf-8'
+        self._respond(200, headers, edition.body() if send_body else None, len(edition.body()))
+
+    def _serve_static(self, path: str, send_body: bool):
+        if self.static_dir is None:
+            self._respond(404, {})
+            return
+        root = os.path.realpath(self.static_dir)
+        file_path = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, file_path]) != root or not os.path.isfile(file_path):
+            self._respond(404, {})
+            return
+        content_type = {'.css': 'text/css', '.svg': 'image/svg+xml'}.get(
+            os.path.splitext(file_path)[1], 'application/octet-stream')
+        with open(file_path, 'rb') as file:
+            body = file.read()
+        self._respond(200, {'Content-Type': content_type, 'Cache-Control': 'max-age=86400'},
+                      body if send_body else None, len(body))
+
+    def _respond(self, status: int, headers: dict, body: bytes = None, length: int = 0):
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        if status != 304:
+            self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f'{self.address_string()} {format % args}')
+
+
+def serve(editions: EditionServer, host: str = '127.0.0.1', port: int = 8080,
+          static_dir: str = None) -> ThreadingHTTPServer:
+    """
+    Create the HTTP server of the editions, call serve_forever to run it
+    :param editions: EditionServer
+    :param host: Listening address
+    :param port: Listening port, 0 picks a free port
+    :param static_dir: Directory of style.css and Icons served next to the editions, optional
+    :return: ThreadingHTTPServer
+    """
+    handler = type('Handler', (EditionRequestHandler,), {'editions': editions, 'static_dir': static_dir})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    """
+    Serve the Daily Commute of every given configuration
+    :return: status code 0 or 1
+    """
+    logging.getLogger().setLevel(logging.INFO)
+    log_format = '(%(asctime)s) [%(levelname)s] %(message)s'
+    logging.basicConfig(format=log_format, filename='tdc.log', filemode='a')
+    parser = argparse.ArgumentParser(description='Serve the Daily Commute over HTTP')
+    parser.add_argument('--config', dest='configs', required=True, nargs='+',
+                        help='Configuration files or directories of *.ini files, every subscriber '
+                             'profile is served at /<profile name>')
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='Listening address')
+    parser.add_argument('--port', dest='port', type=int, default=8080, help='Listening port')
+    parser.add_argument('--inline-assets', dest='inline_assets', metavar='DIR',
+                        help='Inline style.css and an icon sprite from DIR in every edition')
+    parser.add_argument('--static', dest='static', metavar='DIR',
+                        help='Serve style.css and Icons from DIR for linked assets')
+    parser.add_argument('--breakers', dest='breakers', default='tdc-breakers.json',
+                        help='File keeping the circuit breaker state of every upstream across runs')
+    args = parser.parse_args()
+
+    store = ConfigStore(args.configs)
+    store.reload()
+    if store.errors():
+        return 1
+    configs = store.configs()
+
+    parse_pool = make_parse_pool(configs.values())
+    editions = EditionServer(configs, make_assets(args.inline_assets), BreakerBoard(args.breakers),
+                             parse_pool=parse_pool)
+    server = serve(editions, args.host, args.port, args.static)
+    print(f'Serving {", ".join(configs)} on http://{args.host}:{server.server_address[1]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    main()
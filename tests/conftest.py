@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the Daily Commute live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def profile_values() -> dict:
+    """Typed values of a valid subscriber profile"""
+    return {'darksky_key': 'secret', 'lat': 48.85, 'lon': 2.35, 'fastmail_usr': 'alice@example.com',
+            'fastmail_pwd': 'pwd', 'fastmail_url': 'https://caldav.example.com/alice',
+            'ftp_url': 'ftp.example.com', 'ftp_usr': 'alice', 'ftp_pwd': 'pwd', 'ftp_dir': '/www',
+            'event_precedence': None, 'parse_workers': 0, 'darksky_url': 'https://api.example.com/forecast',
+            'qotd_url': None, 'ron_url': 'https://ron.example.com', 'ftp_port': 21}
@@ -0,0 +1,35 @@
+import datetime
+
+from archive import EditionArchive
+from get_quote import Quote
+
+
+def test_prune_frees_blobs_with_missing_inputs(tmp_path):
+    archive = EditionArchive(str(tmp_path / 'archive.db'))
+    today = datetime.date(2026, 10, 18)
+    old = today - datetime.timedelta(days=500)
+    archive.store(old, 'alice', '<html>old</html>', None, [], Quote('Vieux', 'Auteur'), Quote('Meat.', 'Ron'))
+    # No weather nor quotes: NULL columns in the remaining edition
+    archive.store(today, 'alice', '<html>new</html>', None, [], None, None)
+    blobs = archive.stats()['blobs']
+
+    assert archive.prune(400, today) == 1
+    assert archive.editions() == [(today, 'alice')]
+    # The old page and quotes are gone, the shared empty event list is kept
+    assert archive.stats()['blobs'] == blobs - 3
+    assert archive.get(today, 'alice').html() == '<html>new</html>'
+    archive.close()
+
+
+def test_prune_frees_blobs_of_a_republished_edition(tmp_path):
+    archive = EditionArchive(str(tmp_path / 'archive.db'))
+    today = datetime.date(2026, 10, 18)
+    archive.store(today, 'alice', '<html>first</html>', None, [], Quote('Vieux', 'Auteur'), None)
+    blobs = archive.stats()['blobs']
+    archive.store(today, 'alice', '<html>second</html>', None, [], Quote('Neuf', 'Auteur'), None)
+
+    assert archive.prune(400, today) == 0
+    # The first page and quote are no longer referenced by any edition
+    assert archive.stats()['blobs'] == blobs
+    assert archive.get(today, 'alice').html() == '<html>second</html>'
+    archive.close()
@@ -0,0 +1,16 @@
+from archive_site import render_day_page
+
+
+def test_day_page_points_linked_assets_to_the_site_root():
+    html = ('<html><head><link href="style.css" rel="stylesheet"></head>'
+            '<body><img alt="Rain" class="icon" src="Icons/Umbrella.svg"></body></html>')
+    page = render_day_page(html, 'archive/2026/10/18.html')
+    assert 'href="../../../style.css"' in page
+    assert 'src="../../../Icons/Umbrella.svg"' in page
+    assert '<base' not in page
+
+
+def test_day_page_keeps_sprite_references_of_inline_pages():
+    html = ('<html><head><style>p{}</style></head><body><svg><symbol id="icon-sun"></symbol></svg>'
+            '<svg class="icon"><use href="#icon-sun"></use></svg></body></html>')
+    assert render_day_page(html, 'archive/2026/10/18.html') == html
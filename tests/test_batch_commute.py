@@ -0,0 +1,31 @@
+import batch_commute
+from circuit_breaker import BreakerBoard
+from daily_commute import ConfigDailyCommute
+from deadline import Deadline
+from get_quote import Quote
+from run_metrics import RunMetrics
+from section_store import SectionStore
+
+
+def test_quotes_are_shared_by_endpoint(monkeypatch, profile_values):
+    calls = []
+
+    def get_ron_swanson_quote(url, timeout):
+        calls.append(url)
+        return Quote(f'Meat from {url}.', 'Ron')
+
+    monkeypatch.setattr(batch_commute.get_quote, 'get_ron_swanson_quote', get_ron_swanson_quote)
+    monkeypatch.setattr(batch_commute.get_quote, 'get_quote_of_the_day', lambda url, timeout: Quote('Vieux', 'Auteur'))
+    monkeypatch.setattr(batch_commute, 'fetch_weather', lambda *args: None)
+    alice = ConfigDailyCommute(values=profile_values)
+    bob = ConfigDailyCommute(values=dict(profile_values, ron_url='https://bacon.example.com'))
+    carol = ConfigDailyCommute(values=dict(profile_values))
+
+    shared = batch_commute.SharedInputs()
+    shared.fetch([alice, bob, carol], RunMetrics(), BreakerBoard(), Deadline(5), SectionStore())
+    assert sorted(calls) == ['https://bacon.example.com', 'https://ron.example.com']
+    assert shared.ron_quote_for(alice).text() == 'Meat from https://ron.example.com.'
+    assert shared.ron_quote_for(bob).text() == 'Meat from https://bacon.example.com.'
+    assert shared.ron_quote_for(carol).text() == shared.ron_quote_for(alice).text()
+    assert shared.qotd_for(bob).text() == 'Vieux'
+    assert shared.stale_for(bob) == {}
@@ -0,0 +1,10 @@
+from daily_commute import ConfigDailyCommute, breaker_name
+
+
+def test_breakers_are_keyed_by_credentials(profile_values):
+    alice = ConfigDailyCommute(values=profile_values)
+    bob = ConfigDailyCommute(values=dict(profile_values, fastmail_usr='bob@example.com', darksky_key='other'))
+    assert breaker_name('events', alice) != breaker_name('events', bob)
+    assert breaker_name('weather', alice) != breaker_name('weather', bob)
+    assert breaker_name('ron', alice) == breaker_name('ron', bob)
+    assert 'secret' not in breaker_name('weather', alice)
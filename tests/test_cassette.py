@@ -0,0 +1,19 @@
+import datetime
+import urllib.request
+
+import cassette
+
+
+def test_replay_pins_today_to_the_recording(tmp_path):
+    path = str(tmp_path / 'run.cassette')
+    cassette.Cassette([cassette.Exchange('GET', 'https://ron.example.com', cassette.hash_body(None), 200, 'OK',
+                                         [], b'["Meat."]', .5)],
+                      '2025-03-04T06:55:00').save(path)
+    today = datetime.date.today()
+    with cassette.replaying(path, 'zero'):
+        assert datetime.date.today() == datetime.date(2025, 3, 4)
+        assert datetime.datetime.now().date() == datetime.date(2025, 3, 4)
+        assert isinstance(datetime.date(2020, 1, 1), datetime.date)
+        with urllib.request.urlopen('https://ron.example.com') as response:
+            assert response.read() == b'["Meat."]'
+    assert datetime.date.today() == today
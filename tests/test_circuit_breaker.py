@@ -0,0 +1,87 @@
+import pytest
+
+from circuit_breaker import BreakerBoard, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+    """Timestamp moved by hand"""
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def fail():
+    raise OSError('unreachable')
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+def test_opens_after_threshold_and_short_circuits(clock):
+    board = BreakerBoard(threshold=3, cool_down=60, clock=clock)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            board.call('ron', fail)
+    assert board.breaker('ron').state() == CLOSED
+    with pytest.raises(OSError):
+        board.call('ron', fail)
+    assert board.breaker('ron').state() == OPEN
+
+    calls = []
+    clock.now += 59
+    with pytest.raises(CircuitOpenError):
+        board.call('ron', calls.append, 'called')
+    assert calls == []
+
+
+def test_half_open_after_cool_down_then_closes(clock):
+    board = BreakerBoard(threshold=1, cool_down=60, clock=clock)
+    with pytest.raises(OSError):
+        board.call('ron', fail)
+    clock.now += 60
+    breaker = board.breaker('ron')
+    assert breaker.allow()
+    assert breaker.state() == HALF_OPEN
+    # Only one probe per cool-down
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert (breaker.state(), breaker.failures()) == (CLOSED, 0)
+    assert board.call('ron', lambda: 'Meat.') == 'Meat.'
+
+
+def test_failed_probe_opens_again(clock):
+    board = BreakerBoard(threshold=1, cool_down=60, clock=clock)
+    with pytest.raises(OSError):
+        board.call('ron', fail)
+    clock.now += 60
+    with pytest.raises(OSError):
+        board.call('ron', fail)
+    assert board.breaker('ron').state() == OPEN
+    clock.now += 30
+    with pytest.raises(CircuitOpenError):
+        board.call('ron', fail)
+
+
+def test_state_persists_across_boards(tmp_path, clock):
+    path = str(tmp_path / 'breakers.json')
+    board = BreakerBoard(path, threshold=2, cool_down=60, clock=clock)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            board.call('weather', fail)
+    with pytest.raises(OSError):
+        board.call('ron', fail)
+
+    reloaded = BreakerBoard(path, threshold=2, cool_down=60, clock=clock)
+    assert reloaded.breaker('weather').to_dict() == board.breaker('weather').to_dict()
+    assert (reloaded.breaker('weather').state(), reloaded.breaker('weather').failures()) == (OPEN, 2)
+    assert (reloaded.breaker('ron').state(), reloaded.breaker('ron').failures()) == (CLOSED, 1)
+    with pytest.raises(CircuitOpenError):
+        reloaded.call('weather', fail)
+    clock.now += 60
+    assert reloaded.call('weather', lambda: 'report') == 'report'
+    assert reloaded.breaker('weather').state() == CLOSED
@@ -0,0 +1,39 @@
+import datetime
+import threading
+import time
+
+import commute_daemon
+from daily_commute import ConfigDailyCommute
+from deadline import DEFAULT_BUDGETS
+
+
+def test_publishes_without_weather_and_events(tmp_path, monkeypatch, profile_values):
+    def unreachable(source, span, timeout, parse_job=None):
+        raise OSError(f'{source} unreachable')
+
+    uploads = []
+    monkeypatch.setattr(commute_daemon, 'publish', lambda *args: uploads.append(args) or True)
+    daemon = commute_daemon.CommuteDaemon(ConfigDailyCommute(values=profile_values), datetime.time(7),
+                                          out=str(tmp_path / 'tdc.html'),
+                                          budgets={source: 1 for source in DEFAULT_BUDGETS})
+    monkeypatch.setattr(daemon, '_fetch_source', unreachable)
+    assert daemon.publish()
+    assert len(uploads) == 1
+
+
+def test_hung_prefetch_is_abandoned(tmp_path, monkeypatch, profile_values):
+    hang = threading.Event()
+
+    def hung(source, span, timeout, parse_job=None):
+        hang.wait(10)
+
+    daemon = commute_daemon.CommuteDaemon(ConfigDailyCommute(values=profile_values), datetime.time(7),
+                                          out=str(tmp_path / 'tdc.html'),
+                                          budgets={source: .2 for source in DEFAULT_BUDGETS})
+    monkeypatch.setattr(daemon, '_fetch_source', hung)
+    start = time.monotonic()
+    try:
+        assert not daemon.prefetch('qotd')
+    finally:
+        hang.set()
+    assert time.monotonic() - start < 2
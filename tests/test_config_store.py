@@ -0,0 +1,32 @@
+import os
+import stat
+
+from config_store import ConfigStore
+
+PROFILE = """[TheDailyCommute]
+darksky_key = secret
+lat = 48.85
+lon = 2.35
+fastmail_usr = alice@example.com
+fastmail_pwd = pwd
+fastmail_url = https://caldav.example.com/alice
+ftp_url = ftp.example.com
+ftp_usr = alice
+ftp_pwd = pwd
+ftp_dir = /www
+"""
+
+
+def test_cache_is_created_private(tmp_path):
+    config = tmp_path / 'alice.ini'
+    config.write_text(PROFILE)
+    cache = tmp_path / 'cache.json'
+    old_umask = os.umask(0o022)
+    try:
+        store = ConfigStore([str(config)], str(cache))
+        assert store.reload() == ['alice']
+    finally:
+        os.umask(old_umask)
+    assert stat.S_IMODE(os.stat(cache).st_mode) == 0o600
+    assert ConfigStore([str(config)], str(cache)).reload() == ['alice']
+    assert sorted(os.listdir(tmp_path)) == ['alice.ini', 'cache.json']
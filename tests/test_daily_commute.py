@@ -0,0 +1,18 @@
+from daily_commute import ConfigDailyCommute, run_edition
+from run_metrics import RunMetrics
+
+
+def test_run_edition_renders_without_any_source(tmp_path, monkeypatch, profile_values):
+    import daily_commute
+    import get_quote
+
+    def unreachable(*args, **kwargs):
+        raise OSError('unreachable')
+
+    for name in ('fetch_weather', 'fetch_events'):
+        monkeypatch.setattr(daily_commute, name, unreachable)
+    monkeypatch.setattr(get_quote, 'get_quote_of_the_day', unreachable)
+    monkeypatch.setattr(get_quote, 'get_ron_swanson_quote', unreachable)
+    out = tmp_path / 'tdc.html'
+    assert run_edition(ConfigDailyCommute(values=profile_values), RunMetrics(), out=str(out), upload=False) == 0
+    assert out.exists()
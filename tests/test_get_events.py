@@ -0,0 +1,80 @@
+import concurrent.futures
+import datetime
+import threading
+
+import pytest
+
+import fixtures
+from get_events import CALDAV_NS, Event, ParsePool, _parse_chunk, deduplicate, parse_today_events, \
+    stream_calendar_data
+
+
+def test_parse_pool_started_from_a_fetch_thread():
+    calendar = fixtures.make_calendar(200)
+    expected = [event.summary() for event in parse_today_events(calendar, Event.WORK)]
+    results = []
+    pool = ParsePool(2)
+
+    def fetch():
+        results.extend(event.summary() for event in parse_today_events(calendar, Event.WORK, pool, 50))
+
+    try:
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        thread.join()
+    finally:
+        pool.shutdown()
+    assert results == expected
+
+
+def test_cancelled_job_leaves_the_other_jobs_alone():
+    calendar = fixtures.make_calendar(20)
+    expected = len(list(parse_today_events(calendar, Event.WORK)))
+    pool = ParsePool(1)
+    try:
+        late, other = pool.job(), pool.job()
+        late_futures = [late.submit(_parse_chunk, calendar, Event.WORK) for _ in range(20)]
+        other_futures = [other.submit(_parse_chunk, calendar, Event.WORK) for _ in range(3)]
+        late.cancel()
+        assert any(future.cancelled() for future in late_futures)
+        with pytest.raises(concurrent.futures.CancelledError):
+            late.submit(_parse_chunk, calendar, Event.WORK)
+        assert [len(future.result()) for future in other_futures] == [expected] * 3
+        assert len(list(parse_today_events(calendar, Event.WORK, pool.job()))) == expected
+    finally:
+        pool.shutdown()
+
+
+def _ics(uid: str = None) -> str:
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//TheDailyCommute//Tests//EN', 'BEGIN:VEVENT']
+    if uid is not None:
+        lines.append(f'UID:{uid}')
+    lines += ['DTSTAMP:20260101T000000Z', 'DTSTART:20260105T090000Z', 'DTEND:20260105T100000Z',
+              'SUMMARY:Stand-up', 'END:VEVENT', 'END:VCALENDAR']
+    return '\n'.join(lines) + '\n'
+
+
+def test_events_with_different_uids_are_kept():
+    events = deduplicate([Event(_ics('a@tdc.test'), Event.WORK), Event(_ics('b@tdc.test'), Event.WORK)])
+    assert len(events) == 2
+
+
+def test_copies_are_collapsed():
+    same_uid = [Event(_ics('a@tdc.test'), Event.PERSO), Event(_ics('a@tdc.test'), Event.WORK)]
+    assert len(deduplicate(same_uid)) == 1
+    assert len(deduplicate([Event(_ics(), Event.PERSO), Event(_ics(), Event.WORK)])) == 1
+
+
+def test_stream_calendar_data_normalises_escaped_crlf():
+    ics = _ics('a@tdc.test').replace('\n', '&#13;\n')
+    body = ('<?xml version="1.0" encoding="utf-8"?>'
+            f'<d:multistatus xmlns:d="DAV:" xmlns:cal="{CALDAV_NS}"><d:response><d:href>/a.ics</d:href>'
+            f'<d:propstat><d:prop><cal:calendar-data>{ics}</cal:calendar-data></d:prop></d:propstat>'
+            '</d:response></d:multistatus>').encode()
+    # Split inside the data, the way the response arrives
+    datas = list(stream_calendar_data([body[:150], body[150:]]))
+    assert len(datas) == 1
+    assert '\r' not in datas[0]
+    event = Event(datas[0], Event.WORK)
+    assert event.get_start() == datetime.datetime(2026, 1, 5, 9)
+    assert event.get_end() == datetime.datetime(2026, 1, 5, 10)
@@ -0,0 +1,42 @@
+import datetime
+
+import write_page
+from archive import EditionArchive
+from get_quote import Quote
+from get_weather import WeatherReport
+from section_store import SectionStore
+
+SNAPSHOT = (1, 'Clear', 12., 8., 15., .1)
+
+
+def _report(temps: tuple) -> WeatherReport:
+    times = tuple(1767600000. + 3600 * hour for hour in range(len(temps)))
+    return WeatherReport.from_snapshot(SNAPSHOT, (times, temps, (0.,) * len(temps)))
+
+
+def test_hourly_changes_keep_the_weather_fragment():
+    cache = write_page.FragmentCache()
+    write_page.render_html(_report((10., 11., 12.)), [], Quote('', ''), Quote('', ''), cache)
+    misses = cache.misses()
+    write_page.render_html(_report((10., 11., 13.)), [], Quote('', ''), Quote('', ''), cache)
+    # Only the timeline is rendered again
+    assert cache.misses() == misses + 1
+
+
+def test_timeline_is_stored_next_to_the_snapshot(tmp_path):
+    store = SectionStore(str(tmp_path / 'sections.json'))
+    store.save_weather(_report((10., 11., 12.)))
+    report, _ = SectionStore(str(tmp_path / 'sections.json')).load_weather()
+    assert report.snapshot() == SNAPSHOT
+    assert report.timeline()[1] == (10., 11., 12.)
+    assert WeatherReport.from_snapshot(SNAPSHOT + report.timeline()).timeline() == report.timeline()
+
+
+def test_timeline_is_archived_next_to_the_snapshot(tmp_path):
+    archive = EditionArchive(str(tmp_path / 'archive.db'))
+    day = datetime.date(2026, 10, 18)
+    archive.store(day, 'alice', '<html></html>', _report((10., 11., 12.)), [])
+    report = archive.get(day, 'alice').report()
+    archive.close()
+    assert report.snapshot() == SNAPSHOT
+    assert report.timeline()[1] == (10., 11., 12.)
@@ -0,0 +1,13 @@
+import pytest
+
+from import_report import DEFAULT_BUDGET_MS, ENTRY_POINTS, ImportReport
+
+# Cold imports of a loaded CI machine are noisy, only a clear regression fails the suite
+MARGIN = 1.5
+
+
+@pytest.mark.parametrize('entry_point', list(ENTRY_POINTS))
+def test_entry_point_meets_startup_budget(entry_point):
+    report = ImportReport(entry_point, repeat=5)
+    assert report.heavy_modules() == list(ENTRY_POINTS[entry_point])
+    assert report.violations(DEFAULT_BUDGET_MS * MARGIN) == []
@@ -0,0 +1,57 @@
+import json
+
+from run_metrics import RunMetrics, Span, summarize
+
+
+def _span(name: str, edition: str = None, seconds: float = 1., bytes_: int = 0, outcome: str = 'ok') -> Span:
+    span = Span(name, edition)
+    span._duration = seconds
+    span.add_bytes(bytes_)
+    span.outcome(outcome)
+    return span
+
+
+def _series(path) -> list:
+    return [line for line in path.read_text().splitlines() if not line.startswith('#')]
+
+
+def test_prometheus_series_are_unique(tmp_path):
+    metrics = RunMetrics()
+    # The weather of two locations, then a prefetch and its retry
+    metrics.add(_span('fetch.weather', seconds=1., bytes_=100))
+    metrics.add(_span('fetch.weather', seconds=2., bytes_=50, outcome='timeout'))
+    metrics.add(_span('fetch.events', 'alice', seconds=.5))
+    metrics.gauge('breaker_open', 0, {'upstream': 'ron'})
+    path = tmp_path / 'tdc.prom'
+    metrics.write_prometheus(str(path))
+
+    series = [line.rpartition(' ')[0] for line in _series(path)]
+    assert len(series) == len(set(series))
+    lines = _series(path)
+    assert 'tdc_stage_duration_seconds{stage="fetch.weather",edition=""} 3.000000' in lines
+    assert 'tdc_stage_count{stage="fetch.weather",edition=""} 2' in lines
+    assert 'tdc_stage_bytes{stage="fetch.weather",edition=""} 150' in lines
+    assert 'tdc_stage_success{stage="fetch.weather",edition=""} 0' in lines
+    assert 'tdc_stage_success{stage="fetch.events",edition="alice"} 1' in lines
+    assert 'tdc_breaker_open{upstream="ron"} 0' in lines
+
+
+def test_prometheus_labels_are_escaped(tmp_path):
+    metrics = RunMetrics()
+    metrics.add(_span('render', 'a "quoted"\\name'))
+    path = tmp_path / 'tdc.prom'
+    metrics.write_prometheus(str(path))
+    assert 'tdc_stage_count{stage="render",edition="a \\"quoted\\"\\\\name"} 1' in _series(path)
+
+
+def test_jsonl_keeps_every_span(tmp_path):
+    metrics = RunMetrics()
+    metrics.add(_span('fetch.weather', seconds=1.))
+    metrics.add(_span('fetch.weather', seconds=3., outcome='error'))
+    path = tmp_path / 'metrics.jsonl'
+    metrics.write(str(path))
+    metrics.write(str(path))
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(spans) == 4 and {span['run'] for span in spans} == {metrics.run_id()}
+    assert summarize(str(path))['fetch.weather'][0] == 4
+    assert summarize(str(path))['fetch.weather'][3] == 2
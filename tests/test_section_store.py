@@ -0,0 +1,54 @@
+import datetime
+
+from get_quote import Quote
+from section_store import SectionStore
+
+
+def test_keep_or_load_falls_back_on_last_good_data(tmp_path):
+    store = SectionStore(str(tmp_path / 'sections.json'))
+    today = datetime.date.today()
+    quote, since = store.keep_or_load('qotd', Quote('Fresh', 'Someone'), today)
+    assert quote.text() == 'Fresh'
+    assert since is None
+
+    quote, since = SectionStore(str(tmp_path / 'sections.json')).keep_or_load('qotd', Quote('', ''), today)
+    assert quote.text() == 'Fresh'
+    assert since is not None
+
+
+def test_sections_are_keyed_by_subscriber(tmp_path):
+    store = SectionStore(str(tmp_path / 'sections.json'))
+    today = datetime.date.today()
+    store.keep_or_load('events', [], today, 'alice')
+    assert store.keep_or_load('events', None, today, 'alice')[1] is not None
+    assert store.keep_or_load('events', None, today, 'bob') == (None, None)
+
+
+def test_batch_edition_renders_without_weather_and_events(tmp_path, monkeypatch, profile_values):
+    import batch_commute
+    from daily_commute import ConfigDailyCommute
+    from run_metrics import RunMetrics
+
+    def unreachable(*args, **kwargs):
+        raise OSError('unreachable')
+
+    uploads = []
+    monkeypatch.setattr(batch_commute, 'fetch_events', unreachable)
+    monkeypatch.setattr(batch_commute, 'publish', lambda *args: uploads.append(args) or True)
+    result = batch_commute.create_edition('alice', ConfigDailyCommute(values=profile_values),
+                                          batch_commute.SharedInputs(), str(tmp_path), RunMetrics())
+    assert result.succeeded(), result.error()
+    assert len(uploads) == 1
+
+
+def test_deferred_saves_are_written_on_flush(tmp_path):
+    path = str(tmp_path / 'sections.json')
+    store = SectionStore(path, autoflush=False)
+    today = datetime.date.today()
+    for name in ('alice', 'bob'):
+        store.keep_or_load('events', [], today, name)
+    assert SectionStore(path).keep_or_load('events', None, today, 'alice') == (None, None)
+
+    store.flush()
+    reloaded = SectionStore(path)
+    assert all(reloaded.keep_or_load('events', None, today, name)[1] is not None for name in ('alice', 'bob'))
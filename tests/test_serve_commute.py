@@ -0,0 +1,93 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import serve_commute
+from daily_commute import ConfigDailyCommute
+from get_quote import Quote
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """Count the upstream fetches, the weather fetch waits for the release event"""
+    fetches = {'weather': 0, 'events': 0, 'release': threading.Event()}
+    fetches['release'].set()
+
+    def fetch_weather(daily_config, timeout):
+        fetches['weather'] += 1
+        fetches['release'].wait(5)
+        return None
+
+    def fetch_events(daily_config, timeout, parse_pool=None):
+        fetches['events'] += 1
+        return []
+
+    monkeypatch.setattr(serve_commute, 'fetch_weather', fetch_weather)
+    monkeypatch.setattr(serve_commute, 'fetch_events', fetch_events)
+    monkeypatch.setattr(serve_commute.get_quote, 'get_quote_of_the_day',
+                        lambda url, timeout: Quote('Vieux', 'Auteur'))
+    monkeypatch.setattr(serve_commute.get_quote, 'get_ron_swanson_quote', lambda url, timeout: Quote('Meat.', 'Ron'))
+    return fetches
+
+
+@pytest.fixture
+def server(profile_values):
+    def start(ttls=None):
+        editions = serve_commute.EditionServer({'alice': ConfigDailyCommute(values=profile_values)}, ttls=ttls)
+        http_server = serve_commute.serve(editions, port=0)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        started.append(http_server)
+        return editions, f'http://127.0.0.1:{http_server.server_address[1]}/alice'
+
+    started = []
+    yield start
+    for http_server in started:
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def test_concurrent_requests_render_once(sources, server):
+    editions, url = server()
+    sources['release'].clear()
+    statuses = []
+
+    def get():
+        with urllib.request.urlopen(url, timeout=5) as response:
+            statuses.append(response.status)
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(.2)
+    sources['release'].set()
+    for thread in threads:
+        thread.join(5)
+
+    assert statuses == [200] * 8
+    assert sources['weather'] == 1
+    assert editions.renders() == 1
+
+
+def test_if_none_match_is_not_modified(sources, server):
+    _, url = server()
+    with urllib.request.urlopen(url, timeout=5) as response:
+        etag = response.headers['ETag']
+    request = urllib.request.Request(url, headers={'If-None-Match': etag})
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request, timeout=5)
+    assert error.value.code == 304
+
+
+def test_expired_sources_are_fetched_and_rendered_again(sources, server):
+    # Half a second of freshness
+    editions, url = server({'weather': 1 / 120, 'events': 1 / 120})
+    for _ in range(2):
+        urllib.request.urlopen(url, timeout=5).close()
+    assert (sources['weather'], sources['events'], editions.renders()) == (1, 1, 1)
+
+    time.sleep(.6)
+    urllib.request.urlopen(url, timeout=5).close()
+    assert (sources['weather'], sources['events'], editions.renders()) == (2, 2, 2)
@@ -1,15 +1,15 @@
 """Upload a page via FTP"""
-import ftplib
 import logging
 
 
 class FtpConfig:
     """Store the FTP configuration for uploading the Daily Commute"""
-    def __init__(self, url: str, usr: str, pwd: str, directory: str):
+    def __init__(self, url: str, usr: str, pwd: str, directory: str, port: int = 21):
         self._url = url
         self._usr = usr
         self._pwd = pwd
         self._dir = directory
+        self._port = port
 
     def url(self) -> str:
         """
@@ -18,6 +18,13 @@ class FtpConfig:
         """
         return self._url
 
+    def port(self) -> int:
+        """
+        Get FTP port
+        :return: port
+        """
+        return self._port
+
     def usr(self) -> str:
         """
         Get FTP user name
@@ -40,24 +47,71 @@ class FtpConfig:
         return self._dir
 
 
-def upload_to(ftp_config, filename):
+def upload_to(ftp_config, filename, variants=(), timeout: float = 30):
     """
     Upload a file via FTP
     :param ftp_config: FTP configuration
     :param filename: File to upload
+    :param variants: Suffixes of precompressed variants uploaded next to it, e.g. '.gz'
+    :param timeout: Socket timeout in seconds
     :return: bool
     """
+    import ftplib
     try:
         logging.info(f'Connecting to {ftp_config.url()} with user {ftp_config.usr()}')
-        session = ftplib.FTP(ftp_config.url(), ftp_config.usr(), ftp_config.pwd())
+        session = ftplib.FTP(timeout=timeout)
+        session.connect(ftp_config.url(), ftp_config.port())
+        session.login(ftp_config.usr(), ftp_config.pwd())
         logging.info(f'Navigating to {ftp_config.dir()}')
         session.cwd(ftp_config.dir())
         logging.info(f'Uploading {filename}...')
         with open(filename, 'rb') as file:
             session.storbinary('STOR index.html', file)
+        for suffix in variants:
+            logging.info(f'Uploading {filename}{suffix}...')
+            with open(filename + suffix, 'rb') as file:
+                session.storbinary(f'STOR index.html{suffix}', file)
         session.quit()
         logging.info('The Daily Commute was posted')
         return True
     except Exception as exc:
         logging.exception(exc)
         return False
+
+
+def upload_files(ftp_config, local_dir, paths, timeout: float = 30):
+    """
+    Upload files via FTP, keeping their relative paths and creating the missing directories
+    :param ftp_config: FTP configuration
+    :param local_dir: Local directory the paths are relative to
+    :param paths: List of relative paths with '/' separators
+    :param timeout: Socket timeout in seconds
+    :return: bool
+    """
+    import ftplib
+    import os
+    try:
+        session = ftplib.FTP(timeout=timeout)
+        session.connect(ftp_config.url(), ftp_config.port())
+        session.login(ftp_config.usr(), ftp_config.pwd())
+        session.cwd(ftp_config.dir())
+        created = set()
+        for path in paths:
+            parts = path.split('/')[:-1]
+            for depth in range(1, len(parts) + 1):
+                directory = '/'.join(parts[:depth])
+                if directory not in created:
+                    try:
+                        session.mkd(directory)
+                    except ftplib.error_perm:
+                        # Already exists
+                        pass
+                    created.add(directory)
+            logging.info(f'Uploading {path}...')
+            with open(os.path.join(local_dir, *path.split('/')), 'rb') as file:
+                session.storbinary(f'STOR {path}', file)
+        session.quit()
+        return True
+    except Exception as exc:
+        logging.exception(exc)
+        return False
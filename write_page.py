@@ -1,47 +1,54 @@
 """Write the HTML page for the Daily Commute"""
 
+import collections
 import logging
 import datetime
+import threading
 import time
-import locale
+import os
 
 import dominate
 from dominate import tags
+from dominate.util import raw
 
 import get_weather
 import get_quote
-from ephemeris import Ephemeris
-from get_events import Event
+from ephemeris import load_ephemeris
+from inline_assets import LinkedAssets, write_precompressed
+from get_events import Event, use_french_locale
 
 
-def write_head(doc: dominate.document):
+def write_head(doc: dominate.document, assets=None):
     """
     Write head for HTML document
     :param doc: Dominate document
+    :param assets: LinkedAssets or InlineAssets, linked by default
     """
-    with doc.head:
-        tags.link(rel='stylesheet', href='style.css')
+    if assets is None:
+        assets = LinkedAssets()
+    assets.write_head(doc)
 
 
-def write_date(doc: dominate.document):
+def render_date(day: datetime.date) -> str:
     """
-    Write date in HTML document
-    :param doc: Dominate document
+    Render the date section
+    :param day: Day of the edition
+    :return: HTML fragment
     """
-    now = datetime.datetime.now()
-    locale.setlocale(locale.LC_ALL, 'fr-FR')
-    doc.add(tags.h2(str(time.strftime('%A %d %B %Y', now.timetuple())).capitalize()))
+    use_french_locale()
+    return tags.h2(str(time.strftime('%A %d %B %Y', day.timetuple())).capitalize()).render()
 
 
-def write_ephemeris(doc: dominate.document):
+def render_ephemeris(day: datetime.date) -> str:
     """
-    Write ephemeris in HTML document
-    :param doc: Dominate document
+    Render the ephemeris section
+    :param day: Day of the edition
+    :return: HTML fragment
     """
-    ephemeris = Ephemeris('data\\ephemeris-fr.json')
-    today_eph = ephemeris.get_today_ephemeris()
+    ephemeris = load_ephemeris(os.path.join('data', 'ephemeris-fr.json'))
+    today_eph = ephemeris.get_ephemeris_for(day.month, day.day)
     string_eph = today_eph[1] + ' ' + today_eph[0] if today_eph[1] else today_eph[0]
-    doc.add(tags.h3(string_eph))
+    return tags.h3(string_eph).render()
 
 
 def write_quote(quote: get_quote.Quote):
@@ -53,26 +60,16 @@ def write_quote(quote: get_quote.Quote):
     tags.p('— ' + quote.author(), cls='author')
 
 
-def write_qotd(doc: dominate.document):
+def render_quote(quote: get_quote.Quote, cls: str) -> str:
     """
-    Write quote of the day in HTML document
-    :param doc:  Dominate document
-    """
-    with doc:
-        with tags.div(cls='qotd'):
-            quote = get_quote.get_quote_of_the_day()
-            write_quote(quote)
-
-
-def write_ron_quote(doc: dominate.document):
-    """
-    Write a Ron Swanson quote in HTML document
-    :param doc:  Dominate document
+    Render a quote section
+    :param quote: Quote to be written
+    :param cls: CSS class of the section, 'qotd' or 'ron'
+    :return: HTML fragment
     """
-    with doc:
-        with tags.div(cls='ron'):
-            quote = get_quote.get_ron_swanson_quote()
-            write_quote(quote)
+    with tags.div(cls=cls) as section:
+        write_quote(quote)
+    return section.render()
 
 
 def get_svg_path(weather: get_weather.Weather) -> str:
@@ -154,20 +151,72 @@ def get_rain_svg(risk_of_rain: float) -> str:
     return 'Icons/Umbrella.svg'
 
 
-def write_weather(doc: dominate.document, report: get_weather.WeatherReport):
+def render_weather(report: get_weather.WeatherReport, assets) -> str:
     """
-    Write weather report in HTML document
-    :param doc: Dominate document
+    Render the weather section
     :param report: Weather report
-    """
-    with doc:
-        with tags.div(cls='weather'):
-            tags.img(src=get_svg_path(report.weather()), alt='Weather icon', cls='icon')
-            tags.p(report.summary(), cls='summary')
-            tags.img(src=get_temp_svg(report.temp()), alt='Thermometer', cls='icon')
-            tags.p(get_temp_str(report.temp()), cls='summary')
-            tags.img(src=get_rain_svg(report.risk_of_rain()), alt='Rain', cls='icon')
-            tags.p(get_rain_str(report.risk_of_rain()), cls='summary')
+    :param assets: LinkedAssets or InlineAssets
+    :return: HTML fragment
+    """
+    with tags.div(cls='weather') as section:
+        assets.icon(get_svg_path(report.weather()), 'Weather icon')
+        tags.p(report.summary(), cls='summary')
+        assets.icon(get_temp_svg(report.temp()), 'Thermometer')
+        tags.p(get_temp_str(report.temp()), cls='summary')
+        assets.icon(get_rain_svg(report.risk_of_rain()), 'Rain')
+        tags.p(get_rain_str(report.risk_of_rain()), cls='summary')
+    return section.render()
+
+
+TIMELINE_WIDTH = 300
+TIMELINE_HEIGHT = 90
+# Vertical room of the hour labels under the chart and of the temperature labels above it
+TIMELINE_MARGIN = 14
+
+
+def _svg_number(value: float) -> str:
+    return f'{value:.1f}'.rstrip('0').rstrip('.')
+
+
+def render_timeline(times, temps, rain) -> str:
+    """
+    Render the hourly forecast as an inline SVG: temperature line over precipitation bars
+    :param times: Timestamps of the hours
+    :param temps: Temperatures
+    :param rain: Precipitation probabilities between 0 and 1
+    :return: HTML fragment, empty with less than two hours
+    """
+    count = len(times)
+    if count < 2:
+        return ''
+    step = TIMELINE_WIDTH / count
+    top, bottom = TIMELINE_MARGIN, TIMELINE_HEIGHT - TIMELINE_MARGIN
+    t_min, t_max = min(temps), max(temps)
+    scale = (bottom - top) / ((t_max - t_min) or 1.)
+
+    def x(index: int) -> float:
+        return (index + .5) * step
+
+    def y(temp: float) -> float:
+        return bottom - (temp - t_min) * scale
+
+    bars = ''.join(f'M{_svg_number(index * step + 1)} {bottom}v-{_svg_number(value * (bottom - top))}'
+                   f'h{_svg_number(step - 2)}V{bottom}z'
+                   for index, value in enumerate(rain) if value > 0)
+    line = 'M' + 'L'.join(f'{_svg_number(x(index))} {_svg_number(y(temp))}' for index, temp in enumerate(temps))
+    labels = [(x(index), TIMELINE_HEIGHT - 2, f'{datetime.datetime.fromtimestamp(times[index]):%H}h')
+              for index in range(0, count, 3)]
+    for temp in {t_min, t_max}:
+        index = list(temps).index(temp)
+        labels.append((x(index), y(temp) - 4, f'{round(temp)}°'))
+    texts = ''.join(f'<text x="{_svg_number(text_x)}" y="{_svg_number(text_y)}">{text}</text>'
+                    for text_x, text_y, text in labels)
+    return (f'<div class="timeline"><svg xmlns="http://www.w3.org/2000/svg" role="img" '
+            f'aria-label="Températures et risque de pluie heure par heure" '
+            f'viewBox="0 0 {TIMELINE_WIDTH} {TIMELINE_HEIGHT}" width="100%">'
+            f'<path d="{bars}" fill="#9cc3e6"/>'
+            f'<path d="{line}" fill="none" stroke="#e07b39" stroke-width="2" stroke-linejoin="round"/>'
+            f'<g font-size="9" text-anchor="middle" fill="#555">{texts}</g></svg></div>')
 
 
 def event_type_to_string(event: Event) -> str:
@@ -203,47 +252,188 @@ def write_event(event: Event):
             tags.p(location, cls='place')
 
 
-def write_events(doc: dominate.document, events):
+def render_events(events, assets) -> str:
     """
-    Write events to HTML document
-    :param doc: Dominate document
+    Render the agenda section
     :param events: List of events
+    :param assets: LinkedAssets or InlineAssets
+    :return: HTML fragment
+    """
+    with tags.div(cls='agenda') as section:
+        assets.icon('Icons/Calendar.svg', 'Calendar icon')
+        for event in events:
+            write_event(event)
+    return section.render()
+
+
+def render_stale(since: datetime.datetime) -> str:
+    """
+    Render the marker of a section rendered from old data
+    :param since: Time the data was fetched
+    :return: HTML fragment
     """
-    with doc:
-        with tags.div(cls='agenda'):
-            tags.img(src='Icons/Calendar.svg', alt='Calendar icon', cls='icon')
-            for event in events:
-                write_event(event)
+    return tags.p(f'Non mis à jour depuis le {since:%d/%m à %H:%M}', cls='stale').render()
 
 
-def write_body(doc: dominate.document, report: get_weather.WeatherReport, events):
+def events_key(events, day: datetime.date) -> tuple:
     """
-    Write the body of the Daily Commute
+    Get the cache key of the agenda section
+    :param events: List of events
+    :param day: Day of the edition, display strings depend on it
+    :return: tuple identifying the rendered agenda
+    """
+    return (day,) + tuple((event.type(), event.summary(), event.location(),
+                           event.get_start(), event.get_end()) for event in events)
+
+
+class FragmentCache:
+    """Keep rendered HTML fragments keyed by the data they were rendered from"""
+    def __init__(self, max_entries: int = 256):
+        self._fragments = collections.OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, section: str, key: tuple, render, *args) -> str:
+        """
+        Get a fragment, rendering it only if its input data changed
+        :param section: Section name
+        :param key: Input data of the section
+        :param render: Function rendering the fragment
+        :param args: Arguments of the render function
+        :return: HTML fragment
+        """
+        cache_key = (section, key)
+        with self._lock:
+            fragment = self._fragments.get(cache_key)
+            if fragment is not None:
+                self._fragments.move_to_end(cache_key)
+                self._hits += 1
+                return fragment
+            self._misses += 1
+
+        fragment = render(*args)
+        with self._lock:
+            self._fragments[cache_key] = fragment
+            while len(self._fragments) > self._max_entries:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def hits(self) -> int:
+        """
+        Get the number of fragments served from the cache
+        :return: count
+        """
+        return self._hits
+
+    def misses(self) -> int:
+        """
+        Get the number of fragments which had to be rendered
+        :return: count
+        """
+        return self._misses
+
+    def clear(self):
+        """
+        Drop every cached fragment
+        """
+        with self._lock:
+            self._fragments.clear()
+
+
+def write_body(doc: dominate.document, report: get_weather.WeatherReport, events,
+               qotd: get_quote.Quote = None, ron_quote: get_quote.Quote = None,
+               cache: FragmentCache = None, assets=None, stale: dict = None):
+    """
+    Write the body of the Daily Commute from cached section fragments
     :param doc: Dominate document
-    :param report: Weather report
+    :param report: Weather report, the section is omitted if None
     :param events: List of events
-    """
-    doc.add(tags.h1('The Daily Commute'))
-    write_date(doc)
-    write_ephemeris(doc)
-    write_qotd(doc)
-    write_weather(doc, report)
+    :param qotd: Quote of the day, fetched if not provided, omitted if empty
+    :param ron_quote: Ron Swanson quote, fetched if not provided, omitted if empty
+    :param cache: Fragment cache shared between renders, optional
+    :param assets: LinkedAssets or InlineAssets, linked by default
+    :param stale: Dictionary of section name to the time its old data was fetched, optional
+    """
+    if cache is None:
+        cache = FragmentCache()
+    if assets is None:
+        assets = LinkedAssets()
+    if qotd is None:
+        qotd = get_quote.get_quote_of_the_day()
+    if ron_quote is None:
+        ron_quote = get_quote.get_ron_swanson_quote()
+    stale = stale or {}
+    today = datetime.date.today()
+
+    fragments = [tags.h1('The Daily Commute').render(),
+                 cache.get('date', (today,), render_date, today),
+                 cache.get('ephemeris', (today,), render_ephemeris, today)]
+
+    def add(section: str, fragment: str):
+        fragments.append(fragment)
+        if section in stale:
+            fragments.append(render_stale(stale[section]))
+
+    if qotd:
+        add('qotd', cache.get('qotd', (qotd.text(), qotd.author()), render_quote, qotd, 'qotd'))
+    if report is not None:
+        add('weather', cache.get('weather', (assets.mode(),) + report.snapshot(),
+                                 render_weather, report, assets) +
+            cache.get('timeline', report.timeline(), render_timeline, *report.hourly()))
     if events:
-        write_events(doc, events)
-    write_ron_quote(doc)
+        add('events', cache.get('events', (assets.mode(),) + events_key(events, today),
+                                render_events, events, assets))
+    if ron_quote:
+        add('ron', cache.get('ron', (ron_quote.text(), ron_quote.author()),
+                             render_quote, ron_quote, 'ron'))
+    body = '\n'.join(fragments)
+    doc.add(raw(assets.sprite(body) + body))
 
 
-def write_html(report: get_weather.WeatherReport, events, out: str):
+def render_html(report: get_weather.WeatherReport, events, qotd: get_quote.Quote = None,
+                ron_quote: get_quote.Quote = None, cache: FragmentCache = None, assets=None,
+                stale: dict = None) -> str:
     """
-    Write HTML file containing the Daily Commute
-    :param report: Weather report
+    Render the Daily Commute page
+    :param report: Weather report, the section is omitted if None
     :param events: List of events
-    :param out: path to html file
+    :param qotd: Quote of the day, fetched if not provided
+    :param ron_quote: Ron Swanson quote, fetched if not provided
+    :param cache: Fragment cache shared between renders, optional
+    :param assets: LinkedAssets or InlineAssets, linked by default
+    :param stale: Dictionary of section name to the time its old data was fetched, optional
+    :return: HTML text
     """
     logging.info('Creating HTML document')
     doc = dominate.document(title='The Daily Commute')
-    write_head(doc)
-    write_body(doc, report, events)
+    write_head(doc, assets)
+    write_body(doc, report, events, qotd, ron_quote, cache, assets, stale)
+    return doc.render()
+
+
+def write_html(report: get_weather.WeatherReport, events, out: str,
+               qotd: get_quote.Quote = None, ron_quote: get_quote.Quote = None,
+               cache: FragmentCache = None, assets=None, stale: dict = None) -> list:
+    """
+    Write HTML file containing the Daily Commute
+    :param report: Weather report, the section is omitted if None
+    :param events: List of events
+    :param out: path to html file
+    :param qotd: Quote of the day, fetched if not provided
+    :param ron_quote: Ron Swanson quote, fetched if not provided
+    :param cache: Fragment cache shared between renders, optional
+    :param assets: LinkedAssets or InlineAssets, linked by default
+    :param stale: Dictionary of section name to the time its old data was fetched, optional
+    :return: suffixes of the precompressed variants written next to the file
+    """
+    html = render_html(report, events, qotd, ron_quote, cache, assets, stale)
     logging.info('Writing HTML document')
     with open(out, 'w') as file:
-        file.write(doc.render())
+        file.write(html)
+
+    if assets is not None and assets.mode() == 'inline':
+        logging.info('Writing precompressed variants')
+        return write_precompressed(out)
+    return []